@@ -0,0 +1,163 @@
+"""
+Measures the CPU/bytes trade-off of compressing large message contents: plain storage, zlib,
+zstd, and zstd with a dictionary trained per agent, on generated code and document messages.
+
+With --uri, the same conversations are also written to a MongoDB database with and without compression,
+to compare the stored size of the documents and the time of get_by_agent_name.
+
+Usage:
+    python benchmarks/compression_benchmark.py
+    python benchmarks/compression_benchmark.py --threshold 1024 --uri "mongodb+srv://..."
+
+Run it against a scratch database: the benchmark conversations are deleted afterwards.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from justai.entities.conversation import Conversation, Message  # noqa: E402
+from justai.frameworks_and_drivers import mongo_compression  # noqa: E402
+from justai.frameworks_and_drivers.mongo_compression import MessageCompressor  # noqa: E402
+
+WORDS = (
+    "the agent answers customer questions about orders deliveries refunds and invoices "
+    "please find below the detailed steps configuration values and an example request "
+    "your account settings were updated successfully let me know if anything else is needed"
+).split()
+
+CODE_TEMPLATE = '''def {name}(client, {arg}):
+    """Return the {noun} matching the given {arg}."""
+    response = client.get("/api/{noun}s", params={{"{arg}": {arg}, "limit": {limit}}})
+    response.raise_for_status()
+    return [item for item in response.json()["items"] if item["status"] == "{status}"]
+'''
+
+
+def make_message(rng: random.Random, min_bytes: int) -> str:
+    parts = []
+    size = 0
+    while size < min_bytes:
+        if rng.random() < 0.5:
+            part = CODE_TEMPLATE.format(
+                name=f"fetch_{rng.choice(WORDS)}_{rng.randint(0, 999)}",
+                arg=rng.choice(("order_id", "customer_id", "invoice_id")),
+                noun=rng.choice(WORDS),
+                limit=rng.randint(1, 500),
+                status=rng.choice(("open", "closed", "pending"))
+            )
+        else:
+            part = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + ".\n"
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def timed(operation: Callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def codec_table(messages: List[str], training: List[str], repeat: int, level: int) -> None:
+    raw = [message.encode("utf-8") for message in messages]
+    raw_bytes = sum(len(data) for data in raw)
+    codecs: Dict[str, Optional[MessageCompressor]] = {"plain": None}
+    zlib_compressor = MessageCompressor(threshold=0, level=level)
+    zlib_compressor.codec = mongo_compression.CODEC_ZLIB
+    codecs["zlib"] = zlib_compressor
+    if mongo_compression.zstandard is not None:
+        codecs["zstd"] = MessageCompressor(threshold=0, level=level)
+        dictionary_compressor = MessageCompressor(threshold=0, level=level)
+        dictionary_compressor.train("benchmark", training)
+        codecs["zstd + dictionary"] = dictionary_compressor
+    else:
+        print("zstandard is not installed: only zlib is measured.")
+
+    print(f"{len(messages)} messages, {raw_bytes / 1e6:.2f} MB")
+    print(f"{'codec':<20}{'stored MB':>12}{'ratio':>8}{'compress ms':>14}{'decompress ms':>16}")
+    for name, compressor in codecs.items():
+        if compressor is None:
+            print(f"{name:<20}{raw_bytes / 1e6:>12.2f}{1:>8.2f}{0:>14.1f}{0:>16.1f}")
+            continue
+        documents: List[dict] = []
+
+        def compress_all():
+            documents[:] = [
+                {"role": "assistant", **compressor.compress(message, "benchmark")} for message in messages
+            ]
+
+        def decompress_all():
+            for document in documents:
+                compressor.decompress(document)
+
+        compress_time = timed(compress_all, repeat)
+        decompress_time = timed(decompress_all, repeat)
+        stored = sum(len(document["content_z"]) for document in documents)
+        print(f"{name:<20}{stored / 1e6:>12.2f}{raw_bytes / stored:>8.2f}"
+              f"{compress_time * 1e3:>14.1f}{decompress_time * 1e3:>16.1f}")
+
+
+def mongo_table(uri: str, conversations: List[Conversation], threshold: int, repeat: int) -> None:
+    from justai.frameworks_and_drivers.mongo_repositories import MongoConversationRepository
+
+    for label, compression_threshold in (("plain", None), (f"compressed >= {threshold} B", threshold)):
+        repository = MongoConversationRepository(uri, compression_threshold=compression_threshold)
+        agent_name = conversations[0].agent_name
+        repository.delete_by_agent_name(agent_name)
+        try:
+            if compression_threshold is not None and mongo_compression.zstandard is not None:
+                for conversation in conversations[:200]:
+                    repository.create(conversation)
+                repository.train_compression_dictionary(agent_name)
+                repository.delete_by_agent_name(agent_name)
+            for conversation in conversations:
+                repository.create(conversation)
+            stored = next(repository.collection.aggregate([
+                {"$match": {"agent_name": agent_name}},
+                {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}}
+            ]))["bytes"]
+            read_time = timed(lambda: repository.get_by_agent_name(agent_name), repeat)
+            print(f"{label:<28}{stored / 1e6:>12.2f}{read_time * 1e3:>22.1f}")
+        finally:
+            repository.delete_by_agent_name(agent_name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--message-bytes", type=int, default=6000, help="Minimum size of a generated message.")
+    parser.add_argument("--threshold", type=int, default=mongo_compression.DEFAULT_COMPRESSION_THRESHOLD)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--uri", help="Connection link of a MongoDB database, to also measure the repository.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    training = [make_message(rng, args.message_bytes) for _ in range(500)]
+    messages = [make_message(rng, args.message_bytes) for _ in range(args.messages)]
+    print(f"seed={args.seed} level={args.level} zlib={zlib.ZLIB_VERSION}")
+    codec_table(messages, training, args.repeat, args.level)
+
+    if args.uri:
+        conversations = [
+            Conversation("bench-compression", [Message("user", "Show me an example."), Message("assistant", message)])
+            for message in messages
+        ]
+        print()
+        print(f"{'repository':<28}{'stored MB':>12}{'get_by_agent_name ms':>22}")
+        mongo_table(args.uri, conversations, args.threshold, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Times the conversation repository operations used by the app, against the in-memory backend
+or a MongoDB database, so that both paths can be compared on the same workload.
+
+Usage:
+    python benchmarks/repository_benchmark.py                       # in-memory backend
+    python benchmarks/repository_benchmark.py --backend mongodb --uri "mongodb+srv://..."
+
+Run it against a scratch database: the benchmark agents and their conversations are deleted afterwards.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from justai.entities.agent import Agent  # noqa: E402
+from justai.entities.conversation import LABEL_PREFIX, Conversation, Message  # noqa: E402
+
+
+def build_repositories(backend: str, uri: str) -> Dict:
+    if backend == "memory":
+        from justai.frameworks_and_drivers import memory_repositories as module
+        prefix = "InMemory"
+    else:
+        from justai.frameworks_and_drivers import mongo_repositories as module
+        prefix = "Mongo"
+    return {
+        "agent": getattr(module, f"{prefix}AgentRepository")(uri),
+        "conversation": getattr(module, f"{prefix}ConversationRepository")(uri),
+        "backup": getattr(module, f"{prefix}BackupRepository")(uri),
+    }
+
+
+def make_conversation(agent: Agent, users: List[str], turns: int, rng: random.Random) -> Conversation:
+    messages = [Message("system", agent.system_prompt)]
+    for turn in range(turns):
+        messages.append(Message("user", f"question {turn} " * rng.randint(5, 40)))
+        messages.append(Message("assistant", f"answer {turn} " * rng.randint(20, 120)))
+    tags = [rng.choice(users)]
+    if rng.random() < 0.3:
+        tags.append(f"{LABEL_PREFIX}label {rng.randint(0, 10_000)}")
+    return Conversation(agent.name, messages, tags=tags)
+
+
+def timed(label: str, operation: Callable, repeat: int, results: Dict[str, List[float]]):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outcome = operation()
+        timings.append(time.perf_counter() - start)
+    results[label] = timings
+    return outcome
+
+
+def run(backend: str, uri: str, agents: int, conversations: int, turns: int, repeat: int, seed: int) -> None:
+    rng = random.Random(seed)
+    repos = build_repositories(backend, uri)
+    users = [f"bench-user-{i}" for i in range(5)]
+    bench_agents = [Agent(f"bench-agent-{i}", f"You are benchmark agent {i}.") for i in range(agents)]
+    results: Dict[str, List[float]] = {}
+
+    for agent in bench_agents:
+        if not repos["agent"].exists(agent.name):
+            repos["agent"].create(agent)
+    try:
+        generated = [
+            make_conversation(bench_agents[i % agents], users, turns, rng)
+            for i in range(conversations)
+        ]
+
+        def create_all():
+            for conversation in generated:
+                repos["conversation"].create(conversation)
+        timed(f"create x{conversations}", create_all, 1, results)
+
+        target = bench_agents[0].name
+        timed("count_by_agent_name", lambda: repos["conversation"].count_by_agent_name(target), repeat, results)
+        timed("exists_by_agent_name", lambda: repos["conversation"].exists_by_agent_name(target), repeat, results)
+        timed("get_by_agent_name", lambda: repos["conversation"].get_by_agent_name(target), repeat, results)
+        timed("get_by_agent_name_and_tag", lambda: repos["conversation"].get_by_agent_name_and_tag(target, users[0]),
+              repeat, results)
+        timed("get_labelled_headers", lambda: repos["conversation"].get_labelled_headers_by_agent_name_and_user(
+            target, users[0]), repeat, results)
+
+        def walk_pages():
+            after_id = None
+            while True:
+                page = repos["conversation"].get_page(after_id, 50, target)
+                if len(page) < 50:
+                    return
+                after_id = page[-1].id
+        timed("get_page (full walk, 50/page)", walk_pages, repeat, results)
+
+        conversation_id = repos["conversation"].get_page(None, 1, target)[0].id
+        timed("get_by_id", lambda: repos["conversation"].get_by_id(conversation_id), repeat, results)
+        timed("append_messages", lambda: repos["conversation"].append_messages(
+            conversation_id, [Message("user", "ping"), Message("assistant", "pong")]), repeat, results)
+        timed("move_conversations_by_agent_name", lambda: repos["backup"].move_conversations_by_agent_name(target),
+              1, results)
+    finally:
+        for agent in bench_agents:
+            repos["conversation"].delete_by_agent_name(agent.name)
+            repos["backup"].delete_conversations_by_agent_object(agent)
+            repos["agent"].delete(agent)
+
+    print(f"backend={backend} agents={agents} conversations={conversations} turns={turns} repeat={repeat}")
+    print(f"{'operation':<36}{'median ms':>12}{'min ms':>12}{'max ms':>12}")
+    for label, timings in results.items():
+        print(f"{label:<36}{statistics.median(timings) * 1e3:>12.3f}"
+              f"{min(timings) * 1e3:>12.3f}{max(timings) * 1e3:>12.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "mongodb"], default="memory")
+    parser.add_argument("--uri", default="memory://benchmark", help="Connection link of the database.")
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=4, help="User/assistant exchanges per conversation.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.backend == "mongodb" and args.uri.startswith("memory://"):
+        parser.error("--uri is required with the mongodb backend")
+    run(args.backend, args.uri, args.agents, args.conversations, args.turns, args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,7 +46,27 @@ conversation_schema = {
                         },
                         "content": {
                             "bsonType": "string",
-                            "description": "Content of the message"
+                            "description": "Content of the message, empty when the prompt is stored by reference"
+                        },
+                        "prompt_ref": {
+                            "bsonType": "object",
+                            "required": ["agent_id"],
+                            "properties": {
+                                "agent_id": {
+                                    "bsonType": "objectId",
+                                    "description": "The agent whose current system prompt is the content of the message"
+                                }
+                            },
+                            "description": "Reference to the agent's system prompt, set on system messages only"
+                        },
+                        "content_z": {
+                            "bsonType": "binData",
+                            "description": "Compressed content of the message, whose content is then empty"
+                        },
+                        "codec": {
+                            "bsonType": "string",
+                            "enum": ["zstd", "zlib"],
+                            "description": "Codec of content_z, set with it"
                         }
                     }
                 }
@@ -57,6 +77,14 @@ conversation_schema = {
                     "bsonType": "string"
                 },
                 "description": "List of tags associated with the conversation"
+            },
+            "label": {
+                "bsonType": ["string", "null"],
+                "description": "Label of the conversation, copied from its 'label: ' tag for indexed lookups"
+            },
+            "updated_at": {
+                "bsonType": "date",
+                "description": "Time of the last write to the conversation"
             }
         }
     }
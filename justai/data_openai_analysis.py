@@ -1,11 +1,16 @@
 import streamlit as st
 
 import json
-import tiktoken
+import os
 import numpy as np
 from collections import defaultdict
 import matplotlib.pyplot as plt
 
+from justai.dataset_analysis import MAX_TOKENS_PER_EXAMPLE, DatasetReport, StreamingDistribution, analyze_dataset
+from justai.dataset_analysis import example_format_errors
+from justai.token_cache import TokenCountCache
+from justai.token_counting import count_dataset_tokens
+
 
 def data_loading_openft(data_path="data/toy_chat_fine_tuning.jsonl"):
 
@@ -21,72 +26,28 @@ def validate_format(dataset):
     format_errors = defaultdict(int)
 
     for ex in dataset:
-        if not isinstance(ex, dict):
-            format_errors["data_type"] += 1
-            continue
-
-        messages = ex.get("messages", None)
-        if not messages:
-            format_errors["missing_messages_list"] += 1
-            continue
-
-        for message in messages:
-            if "role" not in message or "content" not in message:
-                format_errors["message_missing_key"] += 1
-
-            if any(k not in ("role", "content", "name") for k in message):
-                format_errors["message_unrecognized_key"] += 1
-
-            if message.get("role", None) not in ("system", "user", "assistant"):
-                format_errors["unrecognized_role"] += 1
+        for error in example_format_errors(ex):
+            format_errors[error] += 1
 
-            content = message.get("content", None)
-            if not content or not isinstance(content, str):
-                format_errors["missing_content"] += 1
+    display_format_errors(format_errors)
+    return format_errors
 
-        if not any(message.get("role", None) == "assistant" for message in messages):
-            format_errors["example_missing_assistant_message"] += 1
 
+def display_format_errors(format_errors):
     if format_errors:
         st.warning("Found errors:")
         for k, v in format_errors.items():
             st.write(f"{k}: {v}")
     else:
         st.success("No errors found")
-    return format_errors
-
-
-# not exact!
-# simplified from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-encoding = tiktoken.get_encoding("cl100k_base")
-
-
-def num_tokens_from_messages(messages, tokens_per_message=3, tokens_per_name=1):
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3
-    return num_tokens
-
-
-def num_assistant_tokens_from_messages(messages):
-    num_tokens = 0
-    for message in messages:
-        if message["role"] == "assistant":
-            num_tokens += len(encoding.encode(message["content"]))
-    return num_tokens
 
 
 def print_distribution(values, name):
     with st.expander(f"\n `{name}` Distribution:"):
         dist1, dist2, dist3 = st.columns(3)
-        dist1.metric("min / max:", f"{min(values)} / {max(values)}")
+        dist1.metric("min / max:", f"{np.min(values)} / {np.max(values)}")
         dist2.metric("mean / median:", f"{np.mean(values):.2f} / {np.median(values):.2f}")
-        dist3.metric("p5 / p95:", f"{np.quantile(values, 0.1):.2f} / {np.quantile(values, 0.9):.2f}")
+        dist3.metric("p5 / p95:", f"{np.quantile(values, 0.05):.2f} / {np.quantile(values, 0.95):.2f}")
 
         plt.figure(figsize=(8, 1))
         plt.boxplot(values, vert=False)
@@ -97,23 +58,88 @@ def print_distribution(values, name):
         st.pyplot(plt)
 
 
-def count_tokens_and_data_warnings(dataset):
-    # Warnings and tokens counts
-    n_missing_system = 0
-    n_missing_user = 0
-    n_messages = []
-    convo_lens = []
-    assistant_message_lens = []
+def print_distribution_summary(distribution: StreamingDistribution, name):
+    # Same as print_distribution, from the sketch of a DatasetReport: the values themselves are not kept
+    with st.expander(f"\n `{name}` Distribution:"):
+        dist1, dist2, dist3 = st.columns(3)
+        dist1.metric("min / max:", f"{distribution.minimum} / {distribution.maximum}")
+        dist2.metric("mean / median:", f"{distribution.mean:.2f} / {distribution.quantile(0.5):.2f}")
+        dist3.metric("p5 / p95:", f"{distribution.quantile(0.05):.2f} / {distribution.quantile(0.95):.2f}")
+
+        fig, ax = plt.subplots(figsize=(8, 1))
+        ax.bxp([distribution.box_stats(name)], vert=False, showfliers=False)
+        ax.set_title(f"Boxplot of {name} (whiskers at p5 / p95)")
+        ax.tick_params(axis="x", rotation=45)
+        ax.set_xlabel("Number of Tokens" if "tokens" in name else "Number of Messages")
+
+        st.pyplot(fig)
+        plt.close(fig)
 
-    for ex in dataset:
-        messages = ex["messages"]
-        if not any(message["role"] == "system" for message in messages):
-            n_missing_system += 1
-        if not any(message["role"] == "user" for message in messages):
-            n_missing_user += 1
-        n_messages.append(len(messages))
-        convo_lens.append(num_tokens_from_messages(messages))
-        assistant_message_lens.append(num_assistant_tokens_from_messages(messages))
+
+@st.cache_resource
+def token_count_cache():
+    # One cache per server process, shared by the sessions: its connections are per thread
+    return TokenCountCache()
+
+
+@st.cache_data(max_entries=16, show_spinner="Analysing the dataset...")
+def _cached_dataset_report(path, size, mtime_ns) -> DatasetReport:
+    return analyze_dataset(path, cache=token_count_cache())
+
+
+def dataset_report(path) -> DatasetReport:
+    # Keyed by the size and modification time of the file: a file built again is analysed again
+    stat = os.stat(path)
+    return _cached_dataset_report(path, stat.st_size, stat.st_mtime_ns)
+
+
+def display_dataset_report(report: DatasetReport):
+    """Render the format errors, counts and distributions of a DatasetReport."""
+    display_format_errors(report.format_errors)
+    if not report.distributions["num_total_tokens_per_example"].count:
+        return
+    if report.cache_lookups:
+        st.caption(
+            f"Token count cache: {report.cache_hits} / {report.cache_lookups} distinct contents already counted "
+            f"({report.cache_hits / report.cache_lookups:.0%})."
+        )
+    size_cols = st.columns(3)
+    st.write("First example from the dataset:")
+    for i, message in enumerate(report.first_example.get("messages", [])):
+        size_cols[i % 3].write(f"{i+1}- {message.get('role')}:")
+        size_cols[i % 3].json(message, expanded=False)
+    size_cols[0].metric("Num examples:", report.n_examples)
+    size_cols[1].metric("Num examples missing system message:", report.n_missing_system)
+    size_cols[2].metric("Num examples missing user message:", report.n_missing_user)
+    for name, distribution in report.distributions.items():
+        print_distribution_summary(distribution, name)
+    if report.n_too_long == 0:
+        st.success(f"No examples are over the {report.max_tokens} token limit")
+    else:
+        st.warning(
+            f"\n{report.n_too_long} examples may be over the {report.max_tokens} token limit, "
+            "they'll be truncated during fine-tuning"
+        )
+
+
+def count_tokens_and_data_warnings(dataset):
+    # Warnings and tokens counts, in a single pass over the dataset
+    cache = token_count_cache()
+    stats_before = cache.stats()
+    counts = count_dataset_tokens(dataset, cache=cache)
+    stats = cache.stats()
+    hits = stats["hits"] - stats_before["hits"]
+    lookups = hits + stats["misses"] - stats_before["misses"]
+    st.caption(
+        f"Token count cache: {hits} / {lookups} distinct contents already counted "
+        f"({hits / lookups if lookups else 0:.0%}), {stats['entries']} counts cached, "
+        f"overall hit rate {stats['hit_rate']:.0%}."
+    )
+    n_missing_system = int((~counts.has_system).sum())
+    n_missing_user = int((~counts.has_user).sum())
+    n_messages = counts.messages
+    convo_lens = counts.total
+    assistant_message_lens = counts.assistant
 
     size_cols = st.columns(3)
     st.write("First example from the dataset:")
@@ -126,7 +152,7 @@ def count_tokens_and_data_warnings(dataset):
     print_distribution(n_messages, "num_messages_per_example")
     print_distribution(convo_lens, "num_total_tokens_per_example")
     print_distribution(assistant_message_lens, "num_assistant_tokens_per_example")
-    n_too_long = sum(convo_len > 4096 for convo_len in convo_lens)
+    n_too_long = int((convo_lens > 4096).sum())
     if n_too_long == 0:
         st.success("No examples are over the 4096 token limit")
     else:
@@ -134,25 +160,32 @@ def count_tokens_and_data_warnings(dataset):
     return convo_lens
 
 
+# Pricing and default n_epochs estimate
+TARGET_EPOCHS = 3
+MIN_TARGET_EXAMPLES = 100
+MAX_TARGET_EXAMPLES = 25000
+MIN_DEFAULT_EPOCHS = 1
+MAX_DEFAULT_EPOCHS = 25
+
+
 def estimate_cost(dataset, convo_lens, n_epochs_manual, cost_per_1k_tokens):
-    # Pricing and default n_epochs estimate
-    MAX_TOKENS_PER_EXAMPLE = 4096
+    n_billing_tokens_in_dataset = int(np.minimum(convo_lens, MAX_TOKENS_PER_EXAMPLE).sum())
+    estimate_cost_from_totals(len(dataset), n_billing_tokens_in_dataset, n_epochs_manual, cost_per_1k_tokens)
 
-    TARGET_EPOCHS = 3
-    MIN_TARGET_EXAMPLES = 100
-    MAX_TARGET_EXAMPLES = 25000
-    MIN_DEFAULT_EPOCHS = 1
-    MAX_DEFAULT_EPOCHS = 25
 
+def estimate_cost_from_totals(n_train_examples, n_billing_tokens_in_dataset, n_epochs_manual, cost_per_1k_tokens):
+    """
+    Same as estimate_cost, from the number of examples and of billed tokens only:
+    used with the token counts stored on the conversations, without reading a file.
+    """
     n_epochs_default = TARGET_EPOCHS
-    n_train_examples = len(dataset)
-    if n_train_examples * TARGET_EPOCHS < MIN_TARGET_EXAMPLES:
+    if not n_train_examples:
+        n_epochs_default = 0
+    elif n_train_examples * TARGET_EPOCHS < MIN_TARGET_EXAMPLES:
         n_epochs_default = min(MAX_DEFAULT_EPOCHS, MIN_TARGET_EXAMPLES // n_train_examples)
     elif n_train_examples * TARGET_EPOCHS > MAX_TARGET_EXAMPLES:
         n_epochs_default = max(MIN_DEFAULT_EPOCHS, MAX_TARGET_EXAMPLES // n_train_examples)
 
-    n_billing_tokens_in_dataset = sum(min(MAX_TOKENS_PER_EXAMPLE, length) for length in convo_lens)
-
     col1, col2 = st.columns(2)
     col1.write(
         f"1️⃣ Dataset has `~{n_billing_tokens_in_dataset}`\
@@ -1,65 +1,48 @@
-import json
+import itertools
+from typing import Optional, Tuple
+
 import streamlit as st
-import numpy as np
 import pandas as pd
+from justai.dataset_export import DEFAULT_SPLIT_RATIOS, DEFAULT_SPLIT_SEED, assign_split
+from justai.entities.conversation_batch import ConversationBatch
+from justai.jsonl_index import read_page
 from justai.use_cases.conversation_use_cases import ConversationUseCases
 
 
 @st.cache_data
-def import_gen_dataset(_conversation_use_cases: ConversationUseCases, agent_name: str):
+def import_gen_dataset(
+    _conversation_use_cases: ConversationUseCases,
+    agent_name: str,
+    max_rows: Optional[int] = 500,
+    seed: int = DEFAULT_SPLIT_SEED,
+    ratios: Tuple[float, ...] = DEFAULT_SPLIT_RATIOS
+):
     progress_bar = st.progress(0, "Processing dataset")
     status_text = st.empty()
 
-    status_text.text("Initializing seed...")
-    np.random.seed(123)
-    progress_bar.progress(10, "Processing dataset")
-
     status_text.text("loading dataframe from database...")
-    conversations = _conversation_use_cases.get_by_agent_name(agent_name)
-    progress_bar.progress(40, "Processing dataset")
-    conversations_data = [conversation.to_dict() for conversation in conversations]
-
+    if max_rows is None:
+        batch = _conversation_use_cases.get_batch_by_agent_name(agent_name)
+    else:
+        # Only the first conversations are read, in the order of the export
+        conversations = _conversation_use_cases.iter_by_agent_name(agent_name)
+        batch = ConversationBatch.from_conversations(itertools.islice(conversations, max_rows))
     progress_bar.progress(60, "Processing dataset")
-    conversations_df = pd.DataFrame(conversations_data)
+
+    # The columns are read straight from the batch, no Conversation or Message object is built
+    conversations_df = pd.DataFrame({
+        "id": batch.ids,
+        "agent_name": batch.agent_names,
+        "messages": [batch.message_dicts(i) for i in range(len(batch))],
+        "tags": batch.tags
+    })
     status_text.text("Loaded dataset...")
 
-    # We're going to create a new column called `split` where:
-    # 90% will be assigned a value of 0 -> train set
-    # 5% will be assigned a value of 1 -> validation set
-    # 5% will be assigned a value of 2 -> test set
-    status_text.text("Calculate the number of rows for each split value...")
-    total_rows = len(conversations_df)
-    split_0_count = int(total_rows * 0.9)
-    split_1_count = int(total_rows * 0.05)
-    split_2_count = total_rows - split_0_count - split_1_count
-    progress_bar.progress(70)
-    status_text.text("Calculate done")
-
-    status_text.text("Create an array"
-                     "with split values based on the counts...")
-    split_values = np.concatenate([
-        np.zeros(split_0_count),
-        np.ones(split_1_count),
-        np.full(split_2_count, 2)
-    ])
-    progress_bar.progress(80, "Processing dataset")
-    status_text.text("Array created")
-
-    status_text.text("Shuffle the array to ensure randomness...")
-    np.random.shuffle(split_values)
-    progress_bar.progress(85)
-    status_text.text("Array shuffled")
-
-    status_text.text("Add the 'split' column to the DataFrame...")
-    conversations_df['split'] = split_values
-    conversations_df['split'] = conversations_df['split'].astype(int)
-    progress_bar.progress(85, "Processing dataset")
-    status_text.text("'Split' column added to the DataFrame'")
-
-    status_text.text("For this webinar,"
-                     "we will just 500 rows of this dataset."
-                     "Truncating...")
-    conversations_df = conversations_df.head(n=500)
+    # The `split` column is 0 for the train set, 1 for the validation set and 2 for the test set.
+    # It is drawn from the id of each conversation, so it does not change when conversations are added.
+    status_text.text("Assign each conversation to its split...")
+    conversations_df["split"] = [assign_split(conversation_id, seed, ratios) for conversation_id in batch.ids]
+    conversations_df["split"] = conversations_df["split"].astype(int)
     progress_bar.progress(100, "Processing dataset")
     status_text.text("done")
     return conversations_df
@@ -106,78 +89,16 @@ def construct_user_message(instruction, input_data):
     return instruction
 
 
-def populate_template(template, user_message, assistant_message):
-    populated_template = template.copy()
-    populated_template['messages'][1]['content'] = user_message
-    populated_template['messages'][2]['content'] = assistant_message
-    return populated_template
-
-
-def construct_user_assistant_message(*args):
-    # Concatenate multiple columns to create the user message
-    return ' '.join(map(str, args))
-
-
-def write_iio_to_jsonl(dataframe, user_message_columns, assistant_message_columns, template, path):
-    with open(path, 'w') as file:
-        for _, row in dataframe.iterrows():
-            user_message_values = [row[column] for column in user_message_columns]
-            user_message = construct_user_assistant_message(*user_message_values)
-
-            assistant_message_values = [row[column] for column in assistant_message_columns]
-            assistant_message = construct_user_assistant_message(*assistant_message_values)
-
-            populated_template = populate_template(template, user_message, assistant_message)
-
-            file.write(json.dumps(populated_template) + '\n')
-
-
-def iio_jsonl_formatting(dataframe, template_message_format, user_message_columns, assistant_message_columns):
-    paths = {
-        0: 'data/openai_ready/output_train.jsonl',
-        1: 'data/openai_ready/output_valid.jsonl',
-        2: 'data/openai_ready/output_test.jsonl'
-    }
-
-    for split, path in paths.items():
-        split_df = dataframe[dataframe['split'] == split]
-
-        write_iio_to_jsonl(split_df, user_message_columns, assistant_message_columns, template_message_format, path)
-
-
-def messages_jsonl_formatting(dataframe, messages_column):
-    paths = {
-        0: 'data/openai_ready/output_train.jsonl',
-        1: 'data/openai_ready/output_valid.jsonl',
-        2: 'data/openai_ready/output_test.jsonl'
-    }
-
-    for split, path in paths.items():
-        split_df = dataframe[dataframe['split'] == split]
-
-        write_messages_to_jsonl(split_df, messages_column, path)
-
-
-def write_messages_to_jsonl(dataframe, messages_column, path):
-    with open(path, 'w') as file:
-        for _, row in dataframe.iterrows():
-            messages_json = {"messages": row[messages_column].to_list()[0]}
-
-            file.write(json.dumps(messages_json) + '\n')
-
-
-def format_dataframe_for_display(path='data/openai_ready/output_train.jsonl'):
-    # Read the JSONL file and convert it to a DataFrame
-    data = []
-    with open(path, 'r') as file:
-        for line in file:
-            data.append(json.loads(line))
-
+def format_dataframe_for_display(path='data/openai_ready/output_train.jsonl', start=0, stop=None):
+    """
+    One row per message of the examples of a JSONL file, from example `start` to `stop` excluded.
+    Only these examples are read, through the offset index of the file.
+    """
     # Extract messages and format them
     roles = []
     contents = []
     indices = []
-    for idx, entry in enumerate(data, 1):
+    for idx, entry in enumerate(read_page(path, start, stop), start + 1):
         for message in entry["messages"]:
             roles.append(message["role"].upper())
             contents.append(message["content"])
@@ -0,0 +1,240 @@
+"""
+Single-pass analysis of OpenAI fine-tuning files.
+
+analyze_dataset reads a JSONL file once, line by line: every example is checked for format errors, and the
+examples are counted by batches of ANALYSIS_BATCH_SIZE with count_dataset_tokens. The distributions of the
+counts are accumulated in constant memory, as histograms added to batch by batch with NumPy:
+min, max, mean and quantiles are exact, without keeping the values.
+The result is a DatasetReport, a plain object the pages only render. No Streamlit here.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from justai.entities.token_count import DEFAULT_ENCODING
+from justai.token_cache import TokenCountCache
+from justai.token_counting import count_dataset_tokens
+
+# Examples longer than this are truncated by the fine-tuning, and only billed up to it
+MAX_TOKENS_PER_EXAMPLE = 4096
+
+# Examples counted at once: bounds the memory of an analysis, whatever the size of the file
+ANALYSIS_BATCH_SIZE = 10_000
+
+# Bins of the histogram of a distribution, so at most 8 MB: values beyond are only counted as large
+HISTOGRAM_BINS = 1 << 20
+
+VALID_ROLES = ("system", "user", "assistant")
+VALID_MESSAGE_KEYS = ("role", "content", "name")
+
+
+def example_format_errors(example: Any) -> List[str]:
+    """The format errors of one example, a key per error found, as counted by validate_format."""
+    if not isinstance(example, dict):
+        return ["data_type"]
+    messages = example.get("messages", None)
+    if not messages or not isinstance(messages, list):
+        return ["missing_messages_list"]
+    errors = []
+    for message in messages:
+        if not isinstance(message, dict):
+            errors.append("message_data_type")
+            continue
+        if "role" not in message or "content" not in message:
+            errors.append("message_missing_key")
+        if any(k not in VALID_MESSAGE_KEYS for k in message):
+            errors.append("message_unrecognized_key")
+        if message.get("role", None) not in VALID_ROLES:
+            errors.append("unrecognized_role")
+        content = message.get("content", None)
+        if not content or not isinstance(content, str):
+            errors.append("missing_content")
+    if not any(isinstance(message, dict) and message.get("role", None) == "assistant" for message in messages):
+        errors.append("example_missing_assistant_message")
+    return errors
+
+
+def _countable(example: Any) -> bool:
+    # count_dataset_tokens needs a list of messages as dictionaries, other errors only skew the counts
+    return (
+        isinstance(example, dict)
+        and isinstance(example.get("messages"), list)
+        and all(isinstance(message, dict) for message in example["messages"])
+    )
+
+
+class StreamingDistribution:
+    """
+    Summary of a distribution of non-negative integers, accumulated batch by batch in constant memory.
+
+    The values are counted in a histogram, one bin per value, added to with np.bincount for each batch:
+    quantiles are exact, and the histogram only grows with the largest value, up to HISTOGRAM_BINS bins.
+    Larger values share the last bin, and quantiles falling in it are reported as the maximum.
+
+    Attributes:
+        count (int): Number of values.
+        total (int): Sum of the values.
+        minimum (Optional[int]): Smallest value, None without values.
+        maximum (Optional[int]): Largest value, None without values.
+        histogram (np.ndarray): Number of occurrences of each value.
+    """
+    __slots__ = ("count", "total", "minimum", "maximum", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum: Optional[int] = None
+        self.maximum: Optional[int] = None
+        self.histogram = np.zeros(0, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> None:
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += int(values.sum())
+        low, high = int(values.min()), int(values.max())
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+        counts = np.bincount(np.minimum(values, HISTOGRAM_BINS - 1))
+        if len(counts) > len(self.histogram):
+            counts[:len(self.histogram)] += self.histogram
+            self.histogram = counts
+        else:
+            self.histogram[:len(counts)] += counts
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else float("nan")
+
+    def _value_at(self, rank: int) -> int:
+        # Value of the rank-th smallest value, from 0
+        value = int(np.searchsorted(np.cumsum(self.histogram), rank, side="right"))
+        return self.maximum if value == HISTOGRAM_BINS - 1 else value
+
+    def quantile(self, p: float) -> float:
+        """The `p` quantile, interpolated between the closest values like np.quantile does by default."""
+        if not self.count:
+            return float("nan")
+        position = (self.count - 1) * p
+        below = int(np.floor(position))
+        low = self._value_at(below)
+        if below + 1 >= self.count:
+            return float(low)
+        return low + (position - below) * (self._value_at(below + 1) - low)
+
+    def box_stats(self, label: str) -> Dict[str, Any]:
+        """Statistics for matplotlib's Axes.bxp: quartiles, whiskers at the 5th and 95th percentiles, no outliers."""
+        return {
+            "label": label,
+            "whislo": self.quantile(0.05),
+            "q1": self.quantile(0.25),
+            "med": self.quantile(0.5),
+            "q3": self.quantile(0.75),
+            "whishi": self.quantile(0.95),
+            "mean": self.mean,
+            "fliers": []
+        }
+
+
+class DatasetReport:
+    """
+    Result of the analysis of a fine-tuning file.
+
+    Attributes:
+        path (str): The analysed file.
+        max_tokens (int): The number of tokens examples are truncated to.
+        n_examples (int): Number of examples, lines that are not valid JSON excluded.
+        format_errors (Dict[str, int]): Number of errors found, by kind.
+        first_example (Optional[Dict]): The first example whose tokens could be counted, for display.
+        n_missing_system (int): Examples without a system message.
+        n_missing_user (int): Examples without a user message.
+        n_too_long (int): Examples over max_tokens.
+        n_billing_tokens (int): Tokens billed for one epoch, each example counting at most max_tokens.
+        distributions (Dict[str, StreamingDistribution]): num_messages_per_example,
+            num_total_tokens_per_example and num_assistant_tokens_per_example.
+        cache_hits (int): Distinct contents whose count was found in the token count cache.
+        cache_lookups (int): Distinct contents looked up in the token count cache.
+    """
+    def __init__(self, path: str, max_tokens: int = MAX_TOKENS_PER_EXAMPLE):
+        self.path = path
+        self.max_tokens = max_tokens
+        self.n_examples = 0
+        self.format_errors: Dict[str, int] = {}
+        self.first_example: Optional[Dict] = None
+        self.n_missing_system = 0
+        self.n_missing_user = 0
+        self.n_too_long = 0
+        self.n_billing_tokens = 0
+        self.distributions = {
+            name: StreamingDistribution()
+            for name in ("num_messages_per_example", "num_total_tokens_per_example", "num_assistant_tokens_per_example")
+        }
+        self.cache_hits = 0
+        self.cache_lookups = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"DatasetReport(path={self.path}, n_examples={self.n_examples}, "
+            f"format_errors={sum(self.format_errors.values())}, n_billing_tokens={self.n_billing_tokens})"
+        )
+
+
+def _add_batch(
+    report: DatasetReport,
+    batch: List[Dict[str, Any]],
+    encoding_name: str,
+    num_threads: Optional[int],
+    cache: Optional[TokenCountCache]
+) -> None:
+    counts = count_dataset_tokens(batch, encoding_name, num_threads, cache)
+    report.n_missing_system += int((~counts.has_system).sum())
+    report.n_missing_user += int((~counts.has_user).sum())
+    report.n_too_long += int((counts.total > report.max_tokens).sum())
+    report.n_billing_tokens += int(np.minimum(counts.total, report.max_tokens).sum())
+    report.distributions["num_messages_per_example"].update(counts.messages)
+    report.distributions["num_total_tokens_per_example"].update(counts.total)
+    report.distributions["num_assistant_tokens_per_example"].update(counts.assistant)
+
+
+def analyze_dataset(
+    path: str,
+    max_tokens: int = MAX_TOKENS_PER_EXAMPLE,
+    encoding_name: str = DEFAULT_ENCODING,
+    num_threads: Optional[int] = None,
+    cache: Optional[TokenCountCache] = None,
+    batch_size: int = ANALYSIS_BATCH_SIZE
+) -> DatasetReport:
+    """
+    Validate and count a JSONL file of fine-tuning examples in one read. Blank lines are skipped,
+    lines that are not valid JSON are reported as `invalid_json` errors.
+    """
+    report = DatasetReport(path, max_tokens)
+    stats_before = cache.stats() if cache is not None else None
+    batch: List[Dict[str, Any]] = []
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                example = json.loads(line)
+            except ValueError:
+                report.format_errors["invalid_json"] = report.format_errors.get("invalid_json", 0) + 1
+                continue
+            report.n_examples += 1
+            for error in example_format_errors(example):
+                report.format_errors[error] = report.format_errors.get(error, 0) + 1
+            if _countable(example):
+                if report.first_example is None:
+                    report.first_example = example
+                batch.append(example)
+                if len(batch) == batch_size:
+                    _add_batch(report, batch, encoding_name, num_threads, cache)
+                    batch = []
+    if batch:
+        _add_batch(report, batch, encoding_name, num_threads, cache)
+    if cache is not None:
+        stats = cache.stats()
+        report.cache_hits = stats["hits"] - stats_before["hits"]
+        report.cache_lookups = report.cache_hits + stats["misses"] - stats_before["misses"]
+    return report
@@ -0,0 +1,268 @@
+"""
+Incremental builds of the JSONL files of a fine-tuning dataset.
+
+A build manifest, stored next to the split files, records for each exported conversation its split,
+the hash of its JSONL line and the last modification time of the conversation. A rebuild with the same
+settings only reads the conversations added or modified since, from their headers, and patches the split files:
+- a split with only new conversations is appended to,
+- a split with modified or removed conversations is copied line by line, only the changed lines being replaced.
+Unchanged conversations are neither read from the database nor serialized again.
+"""
+import hashlib
+import itertools
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from justai.dataset_export import SplitOf, SplitWriter, WRITE_BUFFER_SIZE, json_line_encoder, split_paths
+from justai.entities.conversation import Conversation
+from justai.use_cases.conversation_use_cases import ConversationUseCases
+
+MANIFEST_NAME = "build_manifest.json"
+MANIFEST_VERSION = 3
+
+# Conversations read from the database per query
+READ_BATCH_SIZE = 500
+
+
+def line_hash(line: bytes) -> str:
+    return hashlib.blake2b(line, digest_size=16).hexdigest()
+
+
+def settings_fingerprint(*parts: Any) -> str:
+    """Short hash of JSON-serializable values, such as a system prompt or a template."""
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class BuildManifest:
+    """
+    State of the last build of a dataset.
+
+    Attributes:
+        settings (Dict[str, Any]): Everything the examples depend on besides the conversations
+            (format, template, split seed and ratios, system prompt...). Other settings require a full rebuild.
+        entries (Dict[str, list]): [split, line hash, last modification] of each exported conversation,
+            in the order of the lines of the split files.
+        file_sizes (Dict[str, int]): Size of each split file after the build, to detect files modified since.
+    """
+    def __init__(self, settings: Dict[str, Any], entries: Dict[str, list], file_sizes: Dict[str, int]):
+        self.settings = settings
+        self.entries = entries
+        self.file_sizes = file_sizes
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BuildManifest"]:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                document = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if document.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(document["settings"], document["entries"], document["file_sizes"])
+
+    def save(self, path: str) -> None:
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "settings": self.settings,
+                    "file_sizes": self.file_sizes,
+                    "entries": self.entries
+                },
+                file,
+                separators=(",", ":")
+            )
+        os.replace(f"{path}.tmp", path)
+
+    def matches_files(self, paths: Dict[int, str]) -> bool:
+        for split, path in paths.items():
+            try:
+                if os.path.getsize(path) != self.file_sizes.get(str(split)):
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def ids_by_split(self, split: int) -> List[str]:
+        return [id for id, entry in self.entries.items() if entry[0] == split]
+
+
+def _entry(split: int, line: bytes, last_modified: Optional[str]) -> list:
+    return [split, line_hash(line), last_modified]
+
+
+def _read_changed(
+    conversation_use_cases: ConversationUseCases,
+    ids: List[str]
+) -> Iterator[Conversation]:
+    for start in range(0, len(ids), READ_BATCH_SIZE):
+        yield from conversation_use_cases.get_by_ids(ids[start:start + READ_BATCH_SIZE])
+
+
+def _patch_split(path: str, old_ids: List[str], replaced: Dict[str, bytes], removed: set, added: List[bytes]) -> None:
+    """Rewrite a split file, replacing or dropping the lines of the given conversations and appending the new ones."""
+    if not replaced and not removed:
+        with open(path, "ab", buffering=WRITE_BUFFER_SIZE) as file:
+            file.writelines(added)
+        return
+    with open(path, "rb", buffering=WRITE_BUFFER_SIZE) as source, \
+            open(f"{path}.tmp", "wb", buffering=WRITE_BUFFER_SIZE) as target:
+        for id, line in zip(old_ids, source):
+            if id in removed:
+                continue
+            target.write(replaced.get(id, line))
+        target.writelines(added)
+    os.replace(f"{path}.tmp", path)
+
+
+def _modification_times(
+    conversation_use_cases: ConversationUseCases,
+    agent_name: str,
+    max_rows: Optional[int]
+) -> Dict[str, Optional[str]]:
+    headers = itertools.islice(conversation_use_cases.iter_headers_by_agent_name(agent_name), max_rows)
+    return {header.id: header.last_modified.isoformat() if header.last_modified else None for header in headers}
+
+
+def _full_build(
+    conversation_use_cases: ConversationUseCases,
+    agent_name: str,
+    split_of: SplitOf,
+    to_example: Callable[[Conversation, int], Any],
+    settings: Dict[str, Any],
+    max_rows: Optional[int],
+    paths: Dict[int, str]
+) -> BuildManifest:
+    # Read before the conversations: one modified in between is read again by the next build
+    modified_at = _modification_times(conversation_use_cases, agent_name, max_rows)
+    encode = json_line_encoder()
+    entries = {}
+    with SplitWriter(paths) as writer:
+        for conversation in itertools.islice(conversation_use_cases.iter_by_agent_name(agent_name), max_rows):
+            split = split_of(conversation.id)
+            if split is not None:
+                example = to_example(conversation, split)
+                line = encode(example)
+                writer.write(split, line)
+                entries[conversation.id] = _entry(split, line, modified_at.get(conversation.id))
+    return BuildManifest(settings, entries, {})
+
+
+def build_dataset(
+    conversation_use_cases: ConversationUseCases,
+    agent_name: str,
+    split_of: SplitOf,
+    to_example: Callable[[Conversation, int], Any],
+    settings: Dict[str, Any],
+    max_rows: Optional[int] = None,
+    paths: Optional[Dict[int, str]] = None
+) -> Dict[str, Any]:
+    """
+    Build or update the split files of the dataset of an agent.
+
+    Args:
+        split_of (SplitOf): Split of each conversation, see dataset_export.assign_split.
+        to_example (Callable[[Conversation, int], Any]): Builds the JSONL example of a conversation.
+        settings (Dict[str, Any]): JSON-serializable description of split_of, to_example and of what they
+            depend on. The files are built again from scratch when it differs from the last build.
+        max_rows (Optional[int]): Only export the first conversations of the agent, sorted by ID.
+
+    Returns:
+        The number of added, modified, removed and unchanged conversations, and whether the files were built
+        from scratch.
+    """
+    paths = paths or split_paths()
+    manifest_path = os.path.join(os.path.dirname(paths[0]), MANIFEST_NAME)
+    # Round-tripped through JSON, so that it compares equal to the settings loaded from the manifest
+    settings = json.loads(json.dumps(
+        {"agent_name": agent_name, "max_rows": max_rows, **settings}
+    ))
+    manifest = BuildManifest.load(manifest_path)
+    if manifest is None or manifest.settings != settings or not manifest.matches_files(paths):
+        manifest = _full_build(
+            conversation_use_cases, agent_name, split_of, to_example, settings, max_rows, paths
+        )
+        report = {"added": len(manifest.entries), "modified": 0, "removed": 0, "unchanged": 0, "full_build": True}
+    else:
+        report = _patch(
+            conversation_use_cases, agent_name, split_of, to_example, max_rows, paths, manifest
+        )
+    manifest.file_sizes = {str(split): os.path.getsize(path) for split, path in paths.items()}
+    manifest.save(manifest_path)
+    return report
+
+
+def _patch(
+    conversation_use_cases: ConversationUseCases,
+    agent_name: str,
+    split_of: SplitOf,
+    to_example: Callable[[Conversation, int], Any],
+    max_rows: Optional[int],
+    paths: Dict[int, str],
+    manifest: BuildManifest
+) -> Dict[str, Any]:
+    entries = manifest.entries
+    modified_at = _modification_times(conversation_use_cases, agent_name, max_rows)
+    to_read = [
+        id for id, last_modified in modified_at.items()
+        if id not in entries or last_modified is None or entries[id][2] != last_modified
+    ]
+    report = {
+        "added": 0,
+        "modified": 0,
+        "removed": 0,
+        "unchanged": len(modified_at) - len(to_read),
+        "full_build": False
+    }
+    old_ids = {split: manifest.ids_by_split(split) for split in paths}
+    # Conversations whose line is dropped from its split: deleted, left out, or moved to another split
+    dropped = {id for id in entries if id not in modified_at}
+    replaced: Dict[int, Dict[str, bytes]] = {split: {} for split in paths}
+    added: Dict[int, List[bytes]] = {split: [] for split in paths}
+    new_entries: List[Tuple[str, list]] = []
+    read = set()
+
+    encode = json_line_encoder()
+    for conversation in _read_changed(conversation_use_cases, to_read):
+        id = conversation.id
+        read.add(id)
+        split = split_of(id)
+        previous = entries.get(id)
+        if split is None:
+            if previous is not None:
+                dropped.add(id)
+            continue
+        example = to_example(conversation, split)
+        line = encode(example)
+        if previous is not None and previous[0] == split and previous[1] == line_hash(line):
+            # Only the modification time changes
+            report["unchanged"] += 1
+            previous[2] = modified_at[id]
+            continue
+        entry = _entry(split, line, modified_at[id])
+        if previous is not None and previous[0] == split:
+            replaced[split][id] = line
+            report["modified"] += 1
+            entries[id] = entry
+            continue
+        if previous is None:
+            report["added"] += 1
+        else:
+            dropped.add(id)
+            report["modified"] += 1
+        added[split].append(line)
+        new_entries.append((id, entry))
+    # Deleted between the listing of the headers and the read
+    dropped.update(id for id in to_read if id not in read and id in entries)
+    report["removed"] = len(dropped) - (report["modified"] - sum(len(lines) for lines in replaced.values()))
+
+    for split, path in paths.items():
+        split_dropped = {id for id in dropped if entries[id][0] == split}
+        if replaced[split] or split_dropped or added[split]:
+            _patch_split(path, old_ids[split], replaced[split], split_dropped, added[split])
+    for id in dropped:
+        del entries[id]
+    # Appended lines come last in their split, and so do their entries
+    entries.update(new_entries)
+    return report
@@ -0,0 +1,193 @@
+"""
+Streaming export of conversations to the JSONL files of a fine-tuning dataset.
+
+Conversations are read one by one from a repository cursor, routed to their split,
+serialized and written to buffered files in a single pass: no DataFrame is built,
+and memory does not grow with the number of conversations.
+"""
+import bisect
+import functools
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from justai.entities.conversation import Conversation
+
+try:
+    import orjson
+except ImportError:  # Optional dependency, installed with the `export` extra
+    orjson = None
+
+DEFAULT_OUTPUT_DIR = "data/openai_ready"
+SPLIT_NAMES = {0: "train", 1: "valid", 2: "test"}
+
+# Size of the write buffer of each split file
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Returns the split of a conversation from its id, or None to leave it out of the dataset
+SplitOf = Callable[[str], Optional[int]]
+
+# Share of the train, valid and test splits
+DEFAULT_SPLIT_RATIOS = (0.9, 0.05, 0.05)
+DEFAULT_SPLIT_SEED = 123
+
+
+@functools.lru_cache(maxsize=32)
+def _split_bounds(ratios: Tuple[float, ...]) -> Tuple[int, ...]:
+    if len(ratios) != len(SPLIT_NAMES) or any(ratio < 0 for ratio in ratios) or sum(ratios) <= 0:
+        raise ValueError(f"Split ratios must be {len(SPLIT_NAMES)} non-negative numbers, not all zero: {ratios}")
+    total = sum(ratios)
+    bounds = []
+    cumulative = 0.0
+    for ratio in ratios[:-1]:
+        cumulative += ratio
+        bounds.append(int(cumulative / total * 2 ** 64))
+    return tuple(bounds)
+
+
+def assign_split(
+    conversation_id: str,
+    seed: int = DEFAULT_SPLIT_SEED,
+    ratios: Sequence[float] = DEFAULT_SPLIT_RATIOS
+) -> int:
+    """
+    Split of a conversation (0: train, 1: valid, 2: test), from a keyed BLAKE2b hash of its id.
+
+    A conversation stays in the same split whatever is added to or removed from the dataset,
+    so splits are computed on the fly, while streaming, without seeing the other conversations.
+    Another seed draws other splits, with the same ratios on average.
+    """
+    digest = hashlib.blake2b(conversation_id.encode("utf-8"), digest_size=8, key=str(seed).encode("utf-8"))
+    return bisect.bisect_right(_split_bounds(tuple(ratios)), int.from_bytes(digest.digest(), "big"))
+
+
+def split_router(seed: int = DEFAULT_SPLIT_SEED, ratios: Sequence[float] = DEFAULT_SPLIT_RATIOS) -> SplitOf:
+    _split_bounds(tuple(ratios))  # Fail early on invalid ratios
+    return functools.partial(assign_split, seed=seed, ratios=tuple(ratios))
+
+
+def split_paths(output_dir: str = DEFAULT_OUTPUT_DIR) -> Dict[int, str]:
+    return {split: os.path.join(output_dir, f"output_{name}.jsonl") for split, name in SPLIT_NAMES.items()}
+
+
+def json_line_encoder() -> Callable[[Any], bytes]:
+    """
+    Encoder of one JSONL line, newline included: orjson when installed, the standard library otherwise.
+    Both write compact UTF-8 JSON, so the files do not depend on the encoder used.
+    """
+    if orjson is not None:
+        return functools.partial(orjson.dumps, option=orjson.OPT_APPEND_NEWLINE)
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    return lambda obj: (encode(obj) + "\n").encode("utf-8")
+
+
+class SplitWriter:
+    """
+    Buffered writers of the split files, used as a context manager.
+
+    Each split is written to a temporary file moved over the previous one on success,
+    so readers never see a partially written dataset. On error the previous files are kept.
+    """
+    def __init__(self, paths: Dict[int, str]):
+        self.paths = paths
+        self.counts = {split: 0 for split in paths}
+        self._files = {}
+
+    def __enter__(self) -> "SplitWriter":
+        for split, path in self.paths.items():
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._files[split] = open(f"{path}.tmp", "wb", buffering=WRITE_BUFFER_SIZE)
+        return self
+
+    def write(self, split: int, line: bytes) -> None:
+        self._files[split].write(line)
+        self.counts[split] += 1
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        for file in self._files.values():
+            file.close()
+        for split, path in self.paths.items():
+            if exc_type is None:
+                os.replace(f"{path}.tmp", path)
+            else:
+                os.remove(f"{path}.tmp")
+
+
+def export_conversations(
+    conversations: Iterable[Conversation],
+    split_of: SplitOf,
+    to_example: Callable[[Conversation, int], Any],
+    paths: Optional[Dict[int, str]] = None
+) -> Dict[int, int]:
+    """
+    Write each conversation as the example built by `to_example` into the file of its split.
+    Returns the number of examples written per split.
+    """
+    encode = json_line_encoder()
+    with SplitWriter(paths or split_paths()) as writer:
+        for conversation in conversations:
+            split = split_of(conversation.id)
+            if split is not None:
+                writer.write(split, encode(to_example(conversation, split)))
+    return writer.counts
+
+
+def messages_example(conversation: Conversation, split: int) -> Dict[str, List[Dict[str, str]]]:
+    """The conversation in the chat format of the fine-tuning API."""
+    return {"messages": [{"role": message.role, "content": message.content} for message in conversation.messages]}
+
+
+def conversation_fields(conversation: Conversation, split: int) -> Dict[str, Any]:
+    """The fields of a conversation selectable as user or assistant message in a template."""
+    return {
+        "id": conversation.id,
+        "agent_name": conversation.agent_name,
+        "messages": messages_example(conversation, split)["messages"],
+        "tags": conversation.tags,
+        "split": split
+    }
+
+
+def template_example(
+    template: Dict[str, Any],
+    user_message_fields: Sequence[str],
+    assistant_message_fields: Sequence[str]
+) -> Callable[[Conversation, int], Dict[str, Any]]:
+    """
+    Builds examples from a template of three messages (system, user, assistant),
+    whose user and assistant contents are the selected fields of the conversation, joined by spaces.
+    """
+    system_message, user_message, assistant_message = template["messages"][:3]
+
+    def to_example(conversation: Conversation, split: int) -> Dict[str, Any]:
+        fields = conversation_fields(conversation, split)
+        return {
+            **template,
+            "messages": [
+                system_message,
+                {**user_message, "content": " ".join(str(fields[name]) for name in user_message_fields)},
+                {**assistant_message, "content": " ".join(str(fields[name]) for name in assistant_message_fields)}
+            ]
+        }
+    return to_example
+
+
+def export_messages_jsonl(
+    conversations: Iterable[Conversation],
+    split_of: SplitOf,
+    paths: Optional[Dict[int, str]] = None
+) -> Dict[int, int]:
+    return export_conversations(conversations, split_of, messages_example, paths)
+
+
+def export_template_jsonl(
+    conversations: Iterable[Conversation],
+    split_of: SplitOf,
+    template: Dict[str, Any],
+    user_message_fields: Sequence[str],
+    assistant_message_fields: Sequence[str],
+    paths: Optional[Dict[int, str]] = None
+) -> Dict[int, int]:
+    to_example = template_example(template, user_message_fields, assistant_message_fields)
+    return export_conversations(conversations, split_of, to_example, paths)
@@ -0,0 +1,195 @@
+"""
+Sharded copies of the dataset builds of the agents.
+
+Each agent builds its dataset in its own directory, data/openai_ready/<agent>/, so that several agents can be
+built at the same time. A build can then be published as shards, under data/openai_ready/<agent>/<build id>/:
+each split is cut into files bounded by a number of bytes or of examples, optionally gzipped for archival,
+and described by a manifest.json holding the counts, token totals and SHA-256 checksums of every shard.
+Tokens are only counted when publishing, by batches with the token count cache: builds never tokenize.
+Shards can be uploaded and validated in parallel, and a build is never modified once published.
+"""
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from justai.dataset_build import MANIFEST_NAME, BuildManifest
+from justai.dataset_export import DEFAULT_OUTPUT_DIR, SPLIT_NAMES, WRITE_BUFFER_SIZE, split_paths
+from justai.token_cache import TokenCountCache
+from justai.token_counting import count_dataset_tokens
+
+SHARD_MANIFEST_NAME = "manifest.json"
+
+# Lines counted at once when publishing: bounds the memory of a publication, whatever the size of the split
+TOKEN_COUNT_BATCH_SIZE = 10_000
+
+
+def agent_dataset_dir(agent_name: str, root: str = DEFAULT_OUTPUT_DIR) -> str:
+    """Directory of the dataset of an agent. Names that are not safe as a path get a hash suffix to stay distinct."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", agent_name).strip("._") or "agent"
+    if slug != agent_name:
+        slug = f"{slug}-{hashlib.blake2b(agent_name.encode('utf-8'), digest_size=4).hexdigest()}"
+    return os.path.join(root, slug)
+
+
+def agent_split_paths(agent_name: str, root: str = DEFAULT_OUTPUT_DIR) -> Dict[int, str]:
+    return split_paths(agent_dataset_dir(agent_name, root))
+
+
+def new_build_id() -> str:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return f"{now:%Y%m%dT%H%M%S}-{os.urandom(2).hex()}"
+
+
+def list_dataset_files(root: str = DEFAULT_OUTPUT_DIR, extensions=(".jsonl",)) -> List[str]:
+    """Paths, relative to `root`, of the dataset files found in `root` and its subdirectories."""
+    found = []
+    for directory, _, files in os.walk(root):
+        found.extend(
+            os.path.relpath(os.path.join(directory, file), root)
+            for file in files if file.endswith(extensions)
+        )
+    return sorted(found)
+
+
+class _HashingWriter:
+    """File wrapper computing the SHA-256 and size of the bytes written to disk."""
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class ShardWriter:
+    """
+    Writes the lines of one split into numbered shards, starting a new shard before exceeding
+    `max_bytes` (uncompressed) or `max_examples`. Returns the description of each shard on close.
+    """
+    def __init__(
+        self,
+        directory: str,
+        split_name: str,
+        max_bytes: Optional[int] = None,
+        max_examples: Optional[int] = None,
+        compress: bool = False
+    ):
+        self.directory = directory
+        self.split_name = split_name
+        self.max_bytes = max_bytes
+        self.max_examples = max_examples
+        self.compress = compress
+        self.shards: List[Dict[str, Any]] = []
+        self._file = None
+        self._hashing = None
+        self._stream = None
+        self._current: Optional[Dict[str, Any]] = None
+
+    def _open(self) -> None:
+        name = f"{self.split_name}-{len(self.shards):05d}.jsonl" + (".gz" if self.compress else "")
+        self._file = open(os.path.join(self.directory, name), "wb", buffering=WRITE_BUFFER_SIZE)
+        self._hashing = _HashingWriter(self._file)
+        # mtime is fixed so that the same content always gives the same checksum
+        self._stream = gzip.GzipFile(fileobj=self._hashing, mode="wb", mtime=0) if self.compress else self._hashing
+        self._current = {"file": name, "examples": 0, "bytes": 0, "tokens": 0}
+
+    def _close_shard(self) -> None:
+        if self._stream is not self._hashing:
+            self._stream.close()
+        self._file.close()
+        self._current["stored_bytes"] = self._hashing.size
+        self._current["sha256"] = self._hashing.sha256.hexdigest()
+        self.shards.append(self._current)
+        self._current = None
+
+    def write(self, line: bytes, tokens: int) -> None:
+        current = self._current
+        if current is not None and current["examples"] and (
+            (self.max_examples and current["examples"] >= self.max_examples)
+            or (self.max_bytes and current["bytes"] + len(line) > self.max_bytes)
+        ):
+            self._close_shard()
+        if self._current is None:
+            self._open()
+        self._stream.write(line)
+        self._current["examples"] += 1
+        self._current["bytes"] += len(line)
+        self._current["tokens"] += tokens
+
+    def close(self) -> List[Dict[str, Any]]:
+        if self._current is not None:
+            self._close_shard()
+        return self.shards
+
+
+def _total(shards: List[Dict[str, Any]], key: str) -> int:
+    return sum(shard[key] for shard in shards)
+
+
+def write_shards(
+    agent_name: str,
+    root: str = DEFAULT_OUTPUT_DIR,
+    max_bytes: Optional[int] = None,
+    max_examples: Optional[int] = None,
+    compress: bool = False,
+    build_id: Optional[str] = None,
+    cache: Optional[TokenCountCache] = None
+) -> Dict[str, Any]:
+    """
+    Publish the current build of an agent's dataset as shards in a new build directory, and return its manifest.
+    The split files are copied line by line, their tokens counted by batches of TOKEN_COUNT_BATCH_SIZE lines:
+    with a `cache`, only the message contents never counted before are encoded.
+    Raises ValueError when the dataset was not built or was modified since.
+    """
+    dataset_dir = agent_dataset_dir(agent_name, root)
+    paths = split_paths(dataset_dir)
+    build_manifest = BuildManifest.load(os.path.join(dataset_dir, MANIFEST_NAME))
+    if build_manifest is None or not build_manifest.matches_files(paths):
+        raise ValueError(f"The dataset of agent {agent_name} must be built before being sharded.")
+
+    build_id = build_id or new_build_id()
+    build_dir = os.path.join(dataset_dir, build_id)
+    os.makedirs(build_dir)
+    splits = {}
+    for split, path in paths.items():
+        writer = ShardWriter(build_dir, SPLIT_NAMES[split], max_bytes, max_examples, compress)
+        with open(path, "rb", buffering=WRITE_BUFFER_SIZE) as source:
+            while True:
+                lines = list(itertools.islice(source, TOKEN_COUNT_BATCH_SIZE))
+                if not lines:
+                    break
+                counts = count_dataset_tokens([json.loads(line) for line in lines], cache=cache)
+                for line, tokens in zip(lines, counts.total.tolist()):
+                    writer.write(line, tokens)
+        shards = writer.close()
+        splits[SPLIT_NAMES[split]] = {
+            "examples": _total(shards, "examples"),
+            "bytes": _total(shards, "bytes"),
+            "tokens": _total(shards, "tokens"),
+            "shards": shards
+        }
+
+    manifest = {
+        "agent_name": agent_name,
+        "build_id": build_id,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "settings": build_manifest.settings,
+        "max_bytes": max_bytes,
+        "max_examples": max_examples,
+        "compressed": compress,
+        "splits": splits
+    }
+    with open(os.path.join(build_dir, SHARD_MANIFEST_NAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
@@ -1,4 +1,10 @@
-from typing import List, Dict, Optional
+import copy
+import datetime
+import sys
+from collections.abc import MutableSequence
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+LABEL_PREFIX = "label: "
 
 
 class Message:
@@ -11,9 +17,14 @@ class Message:
 
     Methods:
         to_dict: Returns a dictionary representation of the Message object.
+
+    Messages are created by the million when loading datasets: they are slotted, and their role
+    is interned so that every message shares one string per role.
     """
+    __slots__ = ("role", "content")
+
     def __init__(self, role: str, content: str):
-        self.role = role
+        self.role = sys.intern(role)
         self.content = content
 
     def to_dict(self) -> Dict[str, str]:
@@ -26,26 +37,105 @@ class Message:
         return f"Message(role={self.role}, content={self.content})"
 
 
+class LazyMessageList(MutableSequence):
+    """
+    A list of messages decoded from their stored representation on first access.
+
+    Repositories hand over the raw message entries and the function decoding one entry, so that
+    listing or filtering conversations never builds the Message objects of conversations not displayed.
+    A decoded message is kept, so it can be modified in place like in a plain list.
+    Copies and pickles are plain lists of decoded messages: `decode` may hold a database client.
+
+    Attributes:
+        entries (List): The stored messages, replaced by their decoded Message once accessed.
+        decode (Callable[[Any], Message]): Builds a Message from a stored entry.
+    """
+    __slots__ = ("entries", "decode", "_decoded")
+
+    def __init__(self, entries: Iterable[Any], decode: Callable[[Any], "Message"]):
+        self.entries = list(entries)
+        self.decode = decode
+        self._decoded = [False] * len(self.entries)
+
+    def _get(self, index: int) -> "Message":
+        if not self._decoded[index]:
+            self.entries[index] = self.decode(self.entries[index])
+            self._decoded[index] = True
+        return self.entries[index]
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self.entries)))]
+        return self._get(range(len(self.entries))[index])
+
+    def __setitem__(self, index: Union[int, slice], message) -> None:
+        if isinstance(index, slice):
+            # Decode everything first, so that every entry left after the assignment is a Message
+            self.entries = list(self)
+            self.entries[index] = list(message)
+            self._decoded = [True] * len(self.entries)
+            return
+        index = range(len(self.entries))[index]
+        self.entries[index] = message
+        self._decoded[index] = True
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        del self.entries[index]
+        del self._decoded[index]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def insert(self, index: int, message: "Message") -> None:
+        self.entries.insert(index, message)
+        self._decoded.insert(index, True)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __deepcopy__(self, memo) -> List["Message"]:
+        return copy.deepcopy(list(self), memo)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, LazyMessageList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
 class Conversation:
     """
     Represents a conversation which consists of a list of messages.
 
     Attributes:
         agent_name (str): The name or title of the conversation.
-        messages (List[Message]): A list of messages that form the conversation.
+        messages (List[Message]): A list of messages that form the conversation,
+            possibly a LazyMessageList when read from a repository decoding lazily.
         id (Optional[str]): An optional identifier for the conversation.
         tags (Optional[List[str]]): A list of tags associated with the conversation.
+        label (Optional[str]): The label of the conversation, read from its 'label: ' tag if any.
 
     Methods:
         to_dict: Returns a dictionary representation of the Conversation object.
         to_dict_stringify_messages: Returns a dictionary representation of the Conversation object with messages as str.
     """
+    __slots__ = ("agent_name", "messages", "id", "tags")
+
     def __init__(self, agent_name: str, messages: List[Message], id: Optional[str] = None, tags: Optional[List[str]] = None):
         self.agent_name = agent_name
         self.messages = messages
         self.id = id or None
         self.tags = tags or []
 
+    @property
+    def label(self) -> Optional[str]:
+        for tag in self.tags:
+            if tag.startswith(LABEL_PREFIX):
+                return tag[len(LABEL_PREFIX):].strip()
+        return None
+
     def to_dict(self) -> Dict[str, List[Dict[str, str]]]:
         return {
             "id": self.id or "",
@@ -64,3 +154,43 @@ class Conversation:
 
     def __repr__(self) -> str:
         return f"Conversation(agent_name={self.agent_name}, messages={self.messages}, id={self.id}, tags={self.tags})"
+
+
+class ConversationHeader:
+    """
+    Lightweight read model of a conversation, used by listings that do not need the messages.
+
+    Attributes:
+        id (str): The identifier of the conversation.
+        agent_name (str): The name of the agent linked to the conversation.
+        tags (List[str]): A list of tags associated with the conversation.
+        message_count (int): The number of messages in the conversation.
+        last_modified (Optional[datetime.datetime]): When the conversation was last written, if known.
+        label (Optional[str]): The label of the conversation, read from its 'label: ' tag if any.
+    """
+    def __init__(
+        self,
+        id: str,
+        agent_name: str,
+        tags: Optional[List[str]] = None,
+        message_count: int = 0,
+        last_modified: Optional[datetime.datetime] = None
+    ):
+        self.id = id
+        self.agent_name = agent_name
+        self.tags = tags or []
+        self.message_count = message_count
+        self.last_modified = last_modified
+
+    @property
+    def label(self) -> Optional[str]:
+        for tag in self.tags:
+            if tag.startswith(LABEL_PREFIX):
+                return tag[len(LABEL_PREFIX):].strip()
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"ConversationHeader(agent_name={self.agent_name}, id={self.id}, tags={self.tags}, "
+            f"message_count={self.message_count}, last_modified={self.last_modified})"
+        )
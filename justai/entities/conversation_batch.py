@@ -0,0 +1,148 @@
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from justai.entities.conversation import Conversation, Message
+
+# Roles known in advance get stable codes, any other role is appended to the batch's role table
+KNOWN_ROLES = ("system", "user", "assistant", "function", "tool")
+
+
+class ConversationBatch:
+    """
+    Columnar, read-only container of many conversations, used for bulk reads such as dataset exports.
+
+    Instead of one Conversation object and one Message object per message, a batch keeps a handful of
+    flat columns:
+    - ids, agent_names and tags: one entry per conversation.
+    - message_offsets: conversation i owns the messages message_offsets[i] to message_offsets[i + 1].
+    - role_codes: one byte per message, indexing the `roles` table.
+    - content_offsets: message j's content is content[content_offsets[j]:content_offsets[j + 1]].
+    - content: every message content concatenated in a single string.
+
+    Conversations and messages are only materialized on access.
+
+    Methods:
+    - from_conversations(conversations) -> ConversationBatch: Build a batch from Conversation objects.
+    - conversation(i) / batch[i] -> Conversation: Materialize a conversation.
+    - message_dicts(i) -> List[Dict[str, str]]: The messages of a conversation as role/content dicts.
+    - iter_messages(i) -> Iterator[Tuple[str, str]]: The (role, content) pairs of a conversation.
+    """
+    __slots__ = ("ids", "agent_names", "tags", "roles", "message_offsets", "role_codes", "content_offsets", "content")
+
+    def __init__(
+        self,
+        ids: List[str],
+        agent_names: List[str],
+        tags: List[List[str]],
+        roles: Tuple[str, ...],
+        message_offsets: array,
+        role_codes: array,
+        content_offsets: array,
+        content: str
+    ):
+        self.ids = ids
+        self.agent_names = agent_names
+        self.tags = tags
+        self.roles = roles
+        self.message_offsets = message_offsets
+        self.role_codes = role_codes
+        self.content_offsets = content_offsets
+        self.content = content
+
+    @classmethod
+    def from_conversations(cls, conversations: Iterable[Conversation]) -> "ConversationBatch":
+        builder = ConversationBatchBuilder()
+        for conversation in conversations:
+            builder.add(
+                conversation.id,
+                conversation.agent_name,
+                conversation.tags,
+                ((message.role, message.content) for message in conversation.messages)
+            )
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def iter_messages(self, index: int) -> Iterator[Tuple[str, str]]:
+        roles, role_codes, offsets, content = self.roles, self.role_codes, self.content_offsets, self.content
+        for j in range(self.message_offsets[index], self.message_offsets[index + 1]):
+            yield roles[role_codes[j]], content[offsets[j]:offsets[j + 1]]
+
+    def message_dicts(self, index: int) -> List[Dict[str, str]]:
+        return [{"role": role, "content": content} for role, content in self.iter_messages(index)]
+
+    def message_count(self, index: int) -> int:
+        return self.message_offsets[index + 1] - self.message_offsets[index]
+
+    def conversation(self, index: int) -> Conversation:
+        messages = [Message(role, content) for role, content in self.iter_messages(index)]
+        return Conversation(self.agent_names[index], messages, self.ids[index], list(self.tags[index]))
+
+    def __getitem__(self, index: int) -> Conversation:
+        return self.conversation(range(len(self))[index])
+
+    def __iter__(self) -> Iterator[Conversation]:
+        for index in range(len(self)):
+            yield self.conversation(index)
+
+    def __repr__(self) -> str:
+        return f"ConversationBatch(conversations={len(self)}, messages={len(self.role_codes)})"
+
+
+class ConversationBatchBuilder:
+    """
+    Accumulates conversations, then freezes them into a ConversationBatch.
+    Repositories feed it straight from their storage format, without creating entity objects.
+    """
+    def __init__(self):
+        self.ids: List[str] = []
+        self.agent_names: List[str] = []
+        self.tags: List[List[str]] = []
+        self.roles: List[str] = list(KNOWN_ROLES)
+        self._role_codes_by_name: Dict[str, int] = {role: code for code, role in enumerate(KNOWN_ROLES)}
+        self.message_offsets = array("q", [0])
+        self.role_codes = array("B")
+        self.content_offsets = array("q", [0])
+        self._contents: List[str] = []
+        self._content_length = 0
+
+    def _role_code(self, role: str) -> int:
+        code = self._role_codes_by_name.get(role)
+        if code is None:
+            code = len(self.roles)
+            if code > 255:
+                raise ValueError("A conversation batch can not hold more than 256 distinct roles.")
+            self.roles.append(sys.intern(role))
+            self._role_codes_by_name[role] = code
+        return code
+
+    def add(
+        self,
+        id: Optional[str],
+        agent_name: str,
+        tags: Optional[List[str]],
+        messages: Iterable[Tuple[str, str]]
+    ) -> None:
+        self.ids.append(id)
+        self.agent_names.append(sys.intern(agent_name))
+        self.tags.append(list(tags or []))
+        for role, content in messages:
+            self.role_codes.append(self._role_code(role))
+            self._contents.append(content)
+            self._content_length += len(content)
+            self.content_offsets.append(self._content_length)
+        self.message_offsets.append(len(self.role_codes))
+
+    def build(self) -> ConversationBatch:
+        return ConversationBatch(
+            self.ids,
+            self.agent_names,
+            self.tags,
+            tuple(self.roles),
+            self.message_offsets,
+            self.role_codes,
+            self.content_offsets,
+            "".join(self._contents)
+        )
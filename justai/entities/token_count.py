@@ -0,0 +1,49 @@
+from typing import Dict, List
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+class TokenCount:
+    """
+    Token counts of a conversation for one encoding, computed when the conversation is written.
+
+    Attributes:
+        encoding (str): The name of the tiktoken encoding.
+        messages (List[int]): The number of tokens of the content of each message.
+        total (int): The number of tokens of the conversation as a fine-tuning example, message overheads included.
+        assistant (int): The number of tokens of the contents of the assistant messages.
+
+    Methods:
+        to_dict: Returns the stored representation of the counts, without the encoding.
+        from_dict: Builds the counts of an encoding from their stored representation.
+        extended: Returns the counts of the conversation once messages counted by other counts are appended.
+    """
+    __slots__ = ("encoding", "messages", "total", "assistant")
+
+    def __init__(self, encoding: str, messages: List[int], total: int, assistant: int):
+        self.encoding = encoding
+        self.messages = messages
+        self.total = total
+        self.assistant = assistant
+
+    def to_dict(self) -> Dict:
+        return {"messages": list(self.messages), "total": self.total, "assistant": self.assistant}
+
+    @classmethod
+    def from_dict(cls, encoding: str, document: Dict) -> "TokenCount":
+        return cls(encoding, list(document["messages"]), document["total"], document["assistant"])
+
+    def extended(self, appended: "TokenCount") -> "TokenCount":
+        """
+        The counts of the conversation once the messages counted by `appended` are added at its end.
+        The total of `appended` must leave out the overhead of the reply, already counted once in this total.
+        """
+        return TokenCount(
+            self.encoding,
+            self.messages + appended.messages,
+            self.total + appended.total,
+            self.assistant + appended.assistant
+        )
+
+    def __repr__(self) -> str:
+        return f"TokenCount(encoding={self.encoding}, total={self.total}, assistant={self.assistant})"
@@ -0,0 +1,194 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from justai.entities.agent import Agent
+from justai.entities.user import User
+from justai.interface_adapters.conversational_repository_interface import IAgentRepository, IUserRepository
+
+_ALL = ("__all__",)
+_COUNT = ("__count__",)
+
+
+class TTLCache:
+    """
+    A thread-safe, size-bounded cache whose entries expire after a time-to-live.
+
+    When full, the least recently used entry is evicted.
+    Each key has a generation, moved forward when the key is invalidated: a value read from the repository
+    is only stored if the generation of its key is still the one taken before the read, so that a write
+    invalidating the key in between is not undone by storing the value it replaced.
+
+    Attributes:
+    - maxsize (int): Maximum number of entries kept.
+    - ttl (float): Number of seconds an entry stays valid.
+    - hits (int) / misses (int): Lookup statistics.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._clock = 0
+        self._generations: Dict[Hashable, int] = {}
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (True, value) on a hit, (False, None) on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def generation(self, key: Hashable) -> int:
+        """The generation of a key, to take before reading the value to pass to set."""
+        with self._lock:
+            return self._generation(key)
+
+    def _generation(self, key: Hashable) -> int:
+        return max(self._generations.get(key, 0), self._cleared_at)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Store a value, unless `generation` is given and the key was invalidated since it was taken."""
+        with self._lock:
+            if generation is not None and generation != self._generation(key):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            self._clock += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._clock
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clock += 1
+            self._entries.clear()
+            self._generations.clear()
+            self._cleared_at = self._clock
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachedUserRepository(IUserRepository):
+    """
+    Read-through cache in front of an IUserRepository.
+
+    Reads are served from a TTL + LRU cache, writes go to the wrapped repository
+    and invalidate the affected entries. Returned users are copies, so callers can not alter the cache.
+    """
+    def __init__(self, repository: IUserRepository, maxsize: int = 1024, ttl: float = 300.0):
+        self.repository = repository
+        self.cache = TTLCache(maxsize, ttl)
+
+    def get_by_name(self, user_name: str) -> Optional[User]:
+        hit, user = self.cache.get(("name", user_name))
+        if not hit:
+            generation = self.cache.generation(("name", user_name))
+            user = self.repository.get_by_name(user_name)
+            # Missing users are not cached: one created by another process would be reported missing
+            if user is not None:
+                self.cache.set(("name", user_name), user, generation)
+        return copy.deepcopy(user)
+
+    def create(self, user: User) -> None:
+        self.repository.create(user)
+        self.cache.invalidate(("name", user.user_name), _ALL, _COUNT)
+
+    def update(self, current_user: User, updated_user: User) -> None:
+        self.repository.update(current_user, updated_user)
+        self.cache.invalidate(("name", current_user.user_name), ("name", updated_user.user_name), _ALL)
+
+    def delete(self, user: User) -> None:
+        self.repository.delete(user)
+        self.cache.invalidate(("name", user.user_name), _ALL, _COUNT)
+
+    def get_all(self) -> List[User]:
+        hit, users = self.cache.get(_ALL)
+        if not hit:
+            generation = self.cache.generation(_ALL)
+            users = self.repository.get_all()
+            self.cache.set(_ALL, users, generation)
+        return copy.deepcopy(users)
+
+    def exists(self, user_name: str) -> bool:
+        hit, _ = self.cache.get(("name", user_name))
+        return hit or self.repository.exists(user_name)
+
+    def count(self) -> int:
+        hit, count = self.cache.get(_COUNT)
+        if not hit:
+            generation = self.cache.generation(_COUNT)
+            count = self.repository.count()
+            self.cache.set(_COUNT, count, generation)
+        return count
+
+
+class CachedAgentRepository(IAgentRepository):
+    """
+    Read-through cache in front of an IAgentRepository.
+
+    Reads are served from a TTL + LRU cache, writes go to the wrapped repository
+    and invalidate the affected entries. Returned agents are copies, so callers can not alter the cache.
+    """
+    def __init__(self, repository: IAgentRepository, maxsize: int = 1024, ttl: float = 300.0):
+        self.repository = repository
+        self.cache = TTLCache(maxsize, ttl)
+
+    def get_by_name(self, agent_name: str) -> Optional[Agent]:
+        hit, agent = self.cache.get(("name", agent_name))
+        if not hit:
+            generation = self.cache.generation(("name", agent_name))
+            agent = self.repository.get_by_name(agent_name)
+            # Missing agents are not cached: one created by another process would be reported missing
+            if agent is not None:
+                self.cache.set(("name", agent_name), agent, generation)
+        return copy.deepcopy(agent)
+
+    def create(self, agent: Agent) -> None:
+        self.repository.create(agent)
+        self.cache.invalidate(("name", agent.name), _ALL, _COUNT)
+
+    def update(self, current_agent: Agent, updated_agent: Agent) -> None:
+        self.repository.update(current_agent, updated_agent)
+        self.cache.invalidate(("name", current_agent.name), ("name", updated_agent.name), _ALL)
+
+    def delete(self, agent: Agent) -> None:
+        self.repository.delete(agent)
+        self.cache.invalidate(("name", agent.name), _ALL, _COUNT)
+
+    def get_all(self) -> List[Agent]:
+        hit, agents = self.cache.get(_ALL)
+        if not hit:
+            generation = self.cache.generation(_ALL)
+            agents = self.repository.get_all()
+            self.cache.set(_ALL, agents, generation)
+        return copy.deepcopy(agents)
+
+    def exists(self, agent_name: str) -> bool:
+        hit, _ = self.cache.get(("name", agent_name))
+        return hit or self.repository.exists(agent_name)
+
+    def count(self) -> int:
+        hit, count = self.cache.get(_COUNT)
+        if not hit:
+            generation = self.cache.generation(_COUNT)
+            count = self.repository.count()
+            self.cache.set(_COUNT, count, generation)
+        return count
@@ -47,8 +47,9 @@ def remove_agent(agent_use_cases: AgentUseCases, agent_names: List[str]):
 
         if delete_agent and selected_agent_name:
             try:
-                agent_use_cases.delete(selected_agent_name)
-                st.success(f"Agent {selected_agent_name} removed successfully!")
+                backed_up = agent_use_cases.delete(selected_agent_name)
+                st.success(f"Agent {selected_agent_name} removed successfully!\
+                    {backed_up} conversations were moved to the backup.")
                 time.sleep(3)
                 st.rerun()
             except Exception as e:
@@ -91,9 +92,48 @@ def update_agent_details(agent_use_cases: AgentUseCases, agent_names: List[str])
                 st.error(f"Error: {e}")
 
 
+def recover_agent(agent_use_cases: AgentUseCases):
+    backed_up_agent_names = agent_use_cases.get_backed_up_agent_names()
+    with st.form("Recover Agent form"):
+        selected_agent_name = st.selectbox(
+            "Select Agent to Recover",
+            backed_up_agent_names
+        )
+        system_prompt = st.text_area("Enter system prompt for the recovered agent")
+        batch_size = st.number_input(
+            "Conversations recovered per batch",
+            value=1000,
+            min_value=1,
+            max_value=100000,
+            step=100
+        )
+        recover_agent = st.form_submit_button("Recover Agent")
+
+        if recover_agent and selected_agent_name and system_prompt:
+            progress_bar = st.progress(0, "Recovering conversations")
+
+            def _report_progress(recovered: int, total: int):
+                progress_bar.progress(min(recovered / total, 1.0), f"Recovered {recovered}/{total} conversations")
+
+            try:
+                recovered = agent_use_cases.recover(
+                    selected_agent_name,
+                    system_prompt,
+                    batch_size=batch_size,
+                    progress_callback=_report_progress
+                )
+                st.session_state.agent = selected_agent_name
+                st.success(f"Agent {selected_agent_name} and its {recovered} conversations recovered successfully!")
+                time.sleep(3)
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error: {e}. Submit the form again to resume the recovery.")
+
+
 def agent_management_dashboard(agent_use_cases: AgentUseCases, agents: List[Agent], expander=False):
     st.header("Agent Management Dashboard")
     st.subheader("Agent Directory")
+    st.metric("Agents", agent_use_cases.count())
     agent_column_headers = '''
     - **ID**: Unique identifier assigned to each agent.
     - **Agent Name**: Distinctive name given to the agent for identification.
@@ -119,3 +159,7 @@ def agent_management_dashboard(agent_use_cases: AgentUseCases, agents: List[Agen
     st.subheader("Update an agent's details")
     st.caption("Select an agent from the dropdown menu and enter a new system prompt to update the agent's details.")
     update_agent_details(agent_use_cases, [agent.name for agent in agents])
+    st.subheader("Recover an agent")
+    st.caption("Select a removed agent to restore it along with its backed up conversations.\
+        An interrupted recovery resumes where it stopped.")
+    recover_agent(agent_use_cases)
@@ -13,10 +13,17 @@ if "agent" not in st.session_state:
     st.session_state.agent = "None"
 
 
+ALL_AGENTS = "All agents"
+
+
 def _set_agent_memory():
     st.session_state.agent = st.session_state.conv_dashboard_agent_select
 
 
+def _reset_conversation_pages():
+    st.session_state.conv_page_cursors = [None]
+
+
 def generate_dummy_conversation(selected_agent_cf_prompt: str, nb_exchanges: int) -> List[Dict]:
     messages = [{"role": "system", "content": selected_agent_cf_prompt}]
 
@@ -80,6 +87,75 @@ def display_conversations(conversations: List[Conversation]):
     #st.dataframe(filtered_conv_df, use_container_width=True)
 
 
+def display_conversations_page(conversation_use_cases: ConversationUseCases, agent_names: List[str]):
+    """
+    Display the conversations one page at a time.
+    Pages are fetched with keyset pagination: the session keeps the ID of the last conversation
+    of every page visited so far, so going forward or backward never rescans the collection.
+    """
+    if "conv_page_cursors" not in st.session_state:
+        _reset_conversation_pages()
+
+    c1, c2 = st.columns(2)
+    agent_filter = c1.selectbox(
+        "Filter by agent",
+        [ALL_AGENTS] + agent_names,
+        key="conv_page_agent_filter",
+        on_change=_reset_conversation_pages
+    )
+    page_size = c2.number_input(
+        "Conversations per page",
+        value=50,
+        min_value=1,
+        max_value=1000,
+        step=10,
+        key="conv_page_size",
+        on_change=_reset_conversation_pages
+    )
+
+    cursors = st.session_state.conv_page_cursors
+    agent_name = None if agent_filter == ALL_AGENTS else agent_filter
+    total = conversation_use_cases.count(agent_name)
+    st.metric("Conversations", total)
+    conversations = conversation_use_cases.get_page(
+        after_id=cursors[-1],
+        limit=page_size,
+        agent_name=agent_name
+    )
+    if conversations:
+        display_conversations(conversations)
+    else:
+        st.info("No conversations to display.")
+
+    c1, c2, c3 = st.columns([1, 1, 4])
+    if c1.button("Previous page", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if c2.button("Next page", disabled=len(conversations) < page_size):
+        cursors.append(conversations[-1].id)
+        st.rerun()
+    c3.caption(f"Page {len(cursors)} of {max(1, -(-total // page_size))}")
+
+
+def search_conversations(conversation_use_cases: ConversationUseCases, agent_names: List[str]):
+    """
+    Search the conversations by the content of their messages.
+    """
+    c1, c2 = st.columns([3, 1])
+    text = c1.text_input("Search in messages", key="conv_search_text")
+    agent_filter = c2.selectbox("Agent", [ALL_AGENTS] + agent_names, key="conv_search_agent")
+    if text:
+        conversations = conversation_use_cases.search_by_content(
+            text,
+            agent_name=None if agent_filter == ALL_AGENTS else agent_filter,
+            limit=100
+        )
+        if conversations:
+            display_conversations(conversations)
+        else:
+            st.info("No conversation matches the search.")
+
+
 def create_conversation(
     agent_use_cases: AgentUseCases,
     conversation_use_cases: ConversationUseCases,
@@ -173,7 +249,6 @@ def conversation_management_dashboard(
     agent_use_cases: AgentUseCases,
     conversation_use_cases: ConversationUseCases,
     agent_names: List[str],
-    conversations: List[Conversation],
     expander: bool = False
 ):
     # Display the conversations
@@ -194,7 +269,11 @@ def conversation_management_dashboard(
     else:
         st.markdown("**Column Headers:**")
         st.markdown(conversation_column_headers)
-    display_conversations(conversations)
+    display_conversations_page(conversation_use_cases, agent_names)
+
+    st.subheader("Search conversations")
+    st.caption("Find the conversations whose messages contain a word or a sentence.")
+    search_conversations(conversation_use_cases, agent_names)
 
     # Add a new conversation
     st.subheader("Create a new conversation")
@@ -60,6 +60,7 @@ class FeedbackManagementDashboard:
 
         st.header("Feedback Directory")
         st.caption("Browse through all the feedback entries.")
+        st.metric("Feedback entries", self.feedback_use_cases.count())
         self.display_feedbacks()
 
         st.header("Submit New Feedback")
@@ -84,6 +84,7 @@ class UserManagementDashboard:
 
         st.header("User Directory")
         st.caption("A comprehensive list of all registered users.")
+        st.metric("Registered users", self.user_use_cases.count())
         self.display_users()
 
         st.header("Register New User")
@@ -0,0 +1,608 @@
+import bisect
+import copy
+import datetime
+import itertools
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from bson import ObjectId
+from justai.application.exceptions import DuplicateError, NotFoundError
+from justai.entities.agent import Agent
+from justai.entities.conversation import Conversation, ConversationHeader, Message
+from justai.entities.conversation_batch import ConversationBatch, ConversationBatchBuilder
+from justai.entities.feedback import Feedback
+from justai.entities.token_count import TokenCount
+from justai.entities.user import User
+from justai.interface_adapters.conversational_repository_interface import IAgentRepository, IUserRepository
+from justai.interface_adapters.conversational_repository_interface import IBackupRepository
+from justai.interface_adapters.conversational_repository_interface import IConversationRepository
+from justai.interface_adapters.feedback_repository_interface import IFeedbackRepository
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _message_to_document(message: Union[Message, dict]) -> dict:
+    if isinstance(message, Message):
+        return message.to_dict()
+    return {"role": message["role"], "content": message["content"]}
+
+
+def _token_counts_to_document(token_counts: Optional[Dict[str, TokenCount]]) -> Dict[str, dict]:
+    return {encoding: count.to_dict() for encoding, count in (token_counts or {}).items()}
+
+
+class SortedIdIndex:
+    """
+    Hash index from a key to the sorted list of the IDs carrying it.
+
+    IDs are ObjectId hex strings: their lexicographic order is their creation order,
+    which is the order every backend iterates conversations in.
+    """
+    def __init__(self):
+        self._ids: Dict[object, List[str]] = defaultdict(list)
+
+    def add(self, key, id: str) -> None:
+        ids = self._ids[key]
+        position = bisect.bisect_left(ids, id)
+        if position == len(ids) or ids[position] != id:
+            ids.insert(position, id)
+
+    def remove(self, key, id: str) -> None:
+        ids = self._ids.get(key)
+        if not ids:
+            return
+        position = bisect.bisect_left(ids, id)
+        if position < len(ids) and ids[position] == id:
+            del ids[position]
+        if not ids:
+            del self._ids[key]
+
+    def get(self, key) -> List[str]:
+        return self._ids.get(key, [])
+
+    def after(self, key, after_id: Optional[str]) -> List[str]:
+        ids = self.get(key)
+        if after_id:
+            return ids[bisect.bisect_right(ids, after_id):]
+        return ids
+
+    def keys(self) -> List:
+        return list(self._ids)
+
+
+class InMemoryStore:
+    """
+    Every collection of one in-memory database, with the indexes backing the repository queries.
+
+    Conversations are kept as plain documents, shaped like their MongoDB counterpart, and indexed by
+    ID, by agent name and by (agent name, tag). All accesses go through `lock`.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users: Dict[str, User] = {}
+        self.agents: Dict[str, Agent] = {}
+        self.conversations: Dict[str, dict] = {}
+        self.conversation_ids = SortedIdIndex()
+        self.conversations_by_agent = SortedIdIndex()
+        self.conversations_by_agent_and_tag = SortedIdIndex()
+        self.backup: Dict[str, dict] = {}
+        self.backup_by_agent = SortedIdIndex()
+        self.recovery_checkpoints: Dict[str, dict] = {}
+        self.feedback: Dict[int, Feedback] = {}
+        self.feedback_ids = itertools.count(1)
+
+    def index_conversation(self, document: dict) -> None:
+        id = document["_id"]
+        self.conversation_ids.add(None, id)
+        self.conversations_by_agent.add(document["agent_name"], id)
+        for tag in set(document["tags"]):
+            self.conversations_by_agent_and_tag.add((document["agent_name"], tag), id)
+
+    def unindex_conversation(self, document: dict) -> None:
+        id = document["_id"]
+        self.conversation_ids.remove(None, id)
+        self.conversations_by_agent.remove(document["agent_name"], id)
+        for tag in set(document["tags"]):
+            self.conversations_by_agent_and_tag.remove((document["agent_name"], tag), id)
+
+
+_stores: Dict[str, InMemoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_memory_store(uri: str) -> InMemoryStore:
+    """Return the process-wide store for the URI, so that repositories built with the same URI share their data."""
+    with _stores_lock:
+        if uri not in _stores:
+            _stores[uri] = InMemoryStore()
+        return _stores[uri]
+
+
+class InMemoryUserRepository(IUserRepository):
+    def __init__(self, uri: str):
+        self.store = get_memory_store(uri)
+
+    def get_by_name(self, user_name: str) -> Optional[User]:
+        with self.store.lock:
+            user = self.store.users.get(user_name)
+        return User(user.user_name) if user else None
+
+    def create(self, user: User) -> None:
+        with self.store.lock:
+            if user.user_name in self.store.users:
+                raise DuplicateError(f"User with the name {user.user_name} already exists.")
+            self.store.users[user.user_name] = User(user.user_name)
+
+    def update(self, current_user: User, updated_user: User) -> None:
+        with self.store.lock:
+            if current_user.user_name not in self.store.users:
+                raise NotFoundError(f"User with the name {current_user.user_name} not found.")
+            if updated_user.user_name != current_user.user_name and updated_user.user_name in self.store.users:
+                raise DuplicateError(f"User with the name {updated_user.user_name} already exists.")
+            del self.store.users[current_user.user_name]
+            self.store.users[updated_user.user_name] = User(updated_user.user_name)
+
+    def delete(self, user: User) -> None:
+        with self.store.lock:
+            self.store.users.pop(user.user_name, None)
+
+    def get_all(self) -> List[User]:
+        with self.store.lock:
+            return [User(user.user_name) for user in self.store.users.values()]
+
+    def exists(self, user_name: str) -> bool:
+        return user_name in self.store.users
+
+    def count(self) -> int:
+        return len(self.store.users)
+
+
+class InMemoryAgentRepository(IAgentRepository):
+    def __init__(self, uri: str):
+        self.store = get_memory_store(uri)
+
+    def get_by_name(self, agent_name: str) -> Optional[Agent]:
+        with self.store.lock:
+            return copy.deepcopy(self.store.agents.get(agent_name))
+
+    def create(self, agent: Agent) -> None:
+        with self.store.lock:
+            if agent.name in self.store.agents:
+                raise DuplicateError(f"Agent with the name {agent.name} already exists.")
+            self.store.agents[agent.name] = copy.deepcopy(agent)
+
+    def update(self, current_agent: Agent, updated_agent: Agent) -> None:
+        with self.store.lock:
+            if current_agent.name not in self.store.agents:
+                raise NotFoundError(f"Agent with the name {current_agent.name} not found.")
+            if updated_agent.name != current_agent.name and updated_agent.name in self.store.agents:
+                raise DuplicateError(f"Agent with the name {updated_agent.name} already exists.")
+            del self.store.agents[current_agent.name]
+            self.store.agents[updated_agent.name] = copy.deepcopy(updated_agent)
+
+    def delete(self, agent: Agent) -> None:
+        with self.store.lock:
+            self.store.agents.pop(agent.name, None)
+
+    def get_all(self) -> List[Agent]:
+        with self.store.lock:
+            return copy.deepcopy(list(self.store.agents.values()))
+
+    def exists(self, agent_name: str) -> bool:
+        return agent_name in self.store.agents
+
+    def count(self) -> int:
+        return len(self.store.agents)
+
+
+class InMemoryConversationRepository(IConversationRepository):
+    def __init__(self, uri: str):
+        self.store = get_memory_store(uri)
+
+    @staticmethod
+    def _to_conversation(document: dict) -> Conversation:
+        messages = [Message(message["role"], message["content"]) for message in document["messages"]]
+        return Conversation(document["agent_name"], messages, document["_id"], list(document["tags"]))
+
+    @staticmethod
+    def _to_header(document: dict) -> ConversationHeader:
+        return ConversationHeader(
+            document["_id"],
+            document["agent_name"],
+            list(document["tags"]),
+            len(document["messages"]),
+            document["updated_at"]
+        )
+
+    def _get_document(self, conversation_id: str) -> dict:
+        document = self.store.conversations.get(conversation_id)
+        if document is None:
+            raise ValueError(f"Conversation with id {conversation_id} does not exist.")
+        return document
+
+    def _insert(self, document: dict) -> None:
+        self.store.conversations[document["_id"]] = document
+        self.store.index_conversation(document)
+
+    def _iter_ids(self, ids: List[str], batch_size: int) -> Iterator[Conversation]:
+        # Documents are copied out batch by batch, so that writers are only blocked for one batch at a time
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            with self.store.lock:
+                documents = [self.store.conversations.get(id) for id in ids[start:start + batch_size]]
+                batch = [self._to_conversation(document) for document in documents if document is not None]
+            yield from batch
+
+    def create(self, conversation: Conversation, token_counts: Optional[Dict[str, TokenCount]] = None) -> None:
+        with self.store.lock:
+            id = conversation.id or str(ObjectId())
+            if id in self.store.conversations:
+                raise ValueError(f"Conversation with id {conversation.id} already exists.")
+            self._insert({
+                "_id": id,
+                "agent_name": conversation.agent_name,
+                "messages": [_message_to_document(message) for message in conversation.messages],
+                "tags": list(conversation.tags),
+                "label": conversation.label,
+                "token_counts": _token_counts_to_document(token_counts),
+                "updated_at": _now()
+            })
+
+    def get_by_agent_name(self, agent_name: str) -> List[Conversation]:
+        return list(self.iter_by_agent_name(agent_name))
+
+    def get_by_id(self, conversation_id: str) -> Conversation:
+        with self.store.lock:
+            return self._to_conversation(self._get_document(conversation_id))
+
+    def get_by_agent_name_and_tag(self, agent_name: str, tag: str) -> List[Conversation]:
+        with self.store.lock:
+            ids = self.store.conversations_by_agent_and_tag.get((agent_name, tag))
+            return [self._to_conversation(self.store.conversations[id]) for id in ids]
+
+    def _labelled_documents(self, agent_name: str, user_name: str) -> List[dict]:
+        ids = self.store.conversations_by_agent_and_tag.get((agent_name, user_name))
+        documents = [self.store.conversations[id] for id in ids]
+        return [document for document in documents if isinstance(document["label"], str)]
+
+    def get_labelled_by_agent_name_and_user(self, agent_name: str, user_name: str) -> List[Conversation]:
+        with self.store.lock:
+            return [self._to_conversation(document) for document in self._labelled_documents(agent_name, user_name)]
+
+    def get_labelled_headers_by_agent_name_and_user(
+        self,
+        agent_name: str,
+        user_name: str
+    ) -> List[ConversationHeader]:
+        with self.store.lock:
+            return [self._to_header(document) for document in self._labelled_documents(agent_name, user_name)]
+
+    def update_agent_field(self, current_agent: Agent, updated_agent: Agent) -> None:
+        with self.store.lock:
+            for id in list(self.store.conversations_by_agent.get(current_agent.name)):
+                document = self.store.conversations[id]
+                self.store.unindex_conversation(document)
+                document["agent_name"] = updated_agent.name
+                for message in document["messages"]:
+                    if message["role"] == "system":
+                        message["content"] = updated_agent.system_prompt
+                if updated_agent.system_prompt != current_agent.system_prompt:
+                    document["token_counts"] = {}
+                self.store.index_conversation(document)
+
+    def update(
+        self,
+        current_conversation: Conversation,
+        updated_conversation: Conversation,
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        with self.store.lock:
+            document = self.store.conversations.get(current_conversation.id)
+            if document is None:
+                return
+            self.store.unindex_conversation(document)
+            document.update({
+                "agent_name": updated_conversation.agent_name,
+                "messages": [_message_to_document(message) for message in updated_conversation.messages],
+                "tags": list(updated_conversation.tags),
+                "label": updated_conversation.label,
+                "token_counts": _token_counts_to_document(token_counts),
+                "updated_at": _now()
+            })
+            self.store.index_conversation(document)
+
+    def append_messages(
+        self,
+        conversation_id: str,
+        messages: List[Message],
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        with self.store.lock:
+            document = self._get_document(conversation_id)
+            document["messages"].extend(_message_to_document(message) for message in messages)
+            stored = document["token_counts"]
+            if token_counts and stored.keys() == token_counts.keys():
+                document["token_counts"] = _token_counts_to_document({
+                    encoding: TokenCount.from_dict(encoding, stored[encoding]).extended(count)
+                    for encoding, count in token_counts.items()
+                })
+            else:
+                document["token_counts"] = {}
+            document["updated_at"] = _now()
+
+    def replace_message_at(self, conversation_id: str, index: int, message: Message) -> None:
+        with self.store.lock:
+            document = self.store.conversations.get(conversation_id)
+            if document is None or not 0 <= index < len(document["messages"]):
+                raise ValueError(f"Conversation with id {conversation_id} has no message at index {index}.")
+            document["messages"][index] = _message_to_document(message)
+            document["token_counts"] = {}
+            document["updated_at"] = _now()
+
+    def truncate_after(self, conversation_id: str, index: int) -> None:
+        with self.store.lock:
+            document = self._get_document(conversation_id)
+            del document["messages"][index + 1:]
+            document["token_counts"] = {}
+            document["updated_at"] = _now()
+
+    def delete_by_agent_name(self, agent_name: str) -> None:
+        with self.store.lock:
+            for id in list(self.store.conversations_by_agent.get(agent_name)):
+                self.store.unindex_conversation(self.store.conversations.pop(id))
+
+    def delete_by_agent_object(self, agent: Agent) -> None:
+        self.delete_by_agent_name(agent.name)
+
+    def delete_by_id(self, conversation_id: str) -> None:
+        with self.store.lock:
+            document = self.store.conversations.pop(conversation_id, None)
+            if document is not None:
+                self.store.unindex_conversation(document)
+
+    def recover(self, conversations: List) -> int:
+        recovered = 0
+        with self.store.lock:
+            for conversation in conversations:
+                id = str(conversation["_id"])
+                # Conversations inserted by an interrupted recovery are skipped
+                if id in self.store.conversations:
+                    continue
+                document = copy.deepcopy(conversation)
+                document["_id"] = id
+                document.setdefault("tags", [])
+                document.setdefault("label", Conversation(document["agent_name"], [], tags=document["tags"]).label)
+                # Counts taken before the backup may include a prompt the agent no longer has
+                document["token_counts"] = {}
+                document.setdefault("updated_at", _now())
+                self._insert(document)
+                recovered += 1
+        return recovered
+
+    def get_all(self) -> List[Conversation]:
+        return list(self.iter_all())
+
+    def iter_all(self, batch_size: int = 500) -> Iterator[Conversation]:
+        with self.store.lock:
+            ids = self.store.conversation_ids.get(None)
+        return self._iter_ids(ids, batch_size)
+
+    def iter_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[Conversation]:
+        with self.store.lock:
+            ids = self.store.conversations_by_agent.get(agent_name)
+        return self._iter_ids(ids, batch_size)
+
+    def iter_headers_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[ConversationHeader]:
+        with self.store.lock:
+            ids = list(self.store.conversations_by_agent.get(agent_name))
+        for start in range(0, len(ids), batch_size):
+            with self.store.lock:
+                documents = [self.store.conversations.get(id) for id in ids[start:start + batch_size]]
+                batch = [self._to_header(document) for document in documents if document is not None]
+            yield from batch
+
+    def get_by_ids(self, conversation_ids: List[str]) -> List[Conversation]:
+        with self.store.lock:
+            documents = [self.store.conversations.get(id) for id in sorted(set(conversation_ids))]
+            return [self._to_conversation(document) for document in documents if document is not None]
+
+    def get_batch_by_agent_name(self, agent_name: str, batch_size: int = 500) -> ConversationBatch:
+        builder = ConversationBatchBuilder()
+        with self.store.lock:
+            for id in self.store.conversations_by_agent.get(agent_name):
+                document = self.store.conversations[id]
+                builder.add(
+                    id,
+                    document["agent_name"],
+                    document["tags"],
+                    ((message["role"], message["content"]) for message in document["messages"])
+                )
+        return builder.build()
+
+    def get_page(
+        self,
+        after_id: Optional[str] = None,
+        limit: int = 50,
+        agent_name: Optional[str] = None
+    ) -> List[Conversation]:
+        index = self.store.conversation_ids if agent_name is None else self.store.conversations_by_agent
+        with self.store.lock:
+            ids = index.after(agent_name, after_id)[:limit]
+            return [self._to_conversation(self.store.conversations[id]) for id in ids]
+
+    def exists_by_agent_name(self, agent_name: str) -> bool:
+        return bool(self.store.conversations_by_agent.get(agent_name))
+
+    def count_by_agent_name(self, agent_name: str) -> int:
+        return len(self.store.conversations_by_agent.get(agent_name))
+
+    def count(self) -> int:
+        return len(self.store.conversations)
+
+    def search_by_content(self, text: str, agent_name: Optional[str] = None, limit: int = 50) -> List[Conversation]:
+        text = text.lower()
+        index = self.store.conversation_ids if agent_name is None else self.store.conversations_by_agent
+        found = []
+        with self.store.lock:
+            for id in index.get(agent_name):
+                document = self.store.conversations[id]
+                if any(text in message["content"].lower() for message in document["messages"]):
+                    found.append(self._to_conversation(document))
+                    if len(found) == limit:
+                        break
+        return found
+
+    def iter_headers_without_token_counts(
+        self,
+        encoding: str,
+        agent_name: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Iterator[ConversationHeader]:
+        index = self.store.conversation_ids if agent_name is None else self.store.conversations_by_agent
+        with self.store.lock:
+            ids = [id for id in index.get(agent_name) if encoding not in self.store.conversations[id]["token_counts"]]
+        for start in range(0, len(ids), batch_size):
+            with self.store.lock:
+                documents = [self.store.conversations.get(id) for id in ids[start:start + batch_size]]
+                batch = [self._to_header(document) for document in documents if document is not None]
+            yield from batch
+
+    def set_token_counts(
+        self,
+        conversation_id: str,
+        token_counts: Dict[str, TokenCount],
+        last_modified: Optional[datetime.datetime]
+    ) -> bool:
+        with self.store.lock:
+            document = self.store.conversations.get(conversation_id)
+            if document is None or last_modified is not None and document["updated_at"] != last_modified:
+                return False
+            document["token_counts"].update(_token_counts_to_document(token_counts))
+            return True
+
+    def get_token_statistics(self, agent_name: str, encoding: str, max_tokens: int) -> Dict[str, int]:
+        statistics = dict.fromkeys(
+            ("conversations", "counted", "total_tokens", "assistant_tokens", "billing_tokens", "over_limit"), 0
+        )
+        with self.store.lock:
+            for id in self.store.conversations_by_agent.get(agent_name):
+                statistics["conversations"] += 1
+                count = self.store.conversations[id]["token_counts"].get(encoding)
+                if count is None:
+                    continue
+                statistics["counted"] += 1
+                statistics["total_tokens"] += count["total"]
+                statistics["assistant_tokens"] += count["assistant"]
+                statistics["billing_tokens"] += min(count["total"], max_tokens)
+                statistics["over_limit"] += count["total"] > max_tokens
+        return statistics
+
+
+class InMemoryBackupRepository(IBackupRepository):
+    def __init__(self, uri: str):
+        self.store = get_memory_store(uri)
+
+    def _insert(self, document: dict) -> None:
+        self.store.backup[document["_id"]] = document
+        self.store.backup_by_agent.add(document["agent_name"], document["_id"])
+
+    def backup_conversations(self, conversations: Union[List[Conversation], Conversation]) -> None:
+        """Backup a list of conversations."""
+        if not isinstance(conversations, list):
+            conversations = [conversations]
+        with self.store.lock:
+            for conversation in conversations:
+                document = conversation.to_dict()
+                document["_id"] = conversation.id or str(ObjectId())
+                self._insert(document)
+
+    def get_conversations_by_agent_object(self, agent: Agent) -> List:
+        """Fetch conversations linked with a specific agent from backup."""
+        with self.store.lock:
+            return [copy.deepcopy(self.store.backup[id]) for id in self.store.backup_by_agent.get(agent.name)]
+
+    def delete_conversations_by_agent_object(self, agent: Agent) -> None:
+        """Delete conversations linked with a specific agent from backup."""
+        with self.store.lock:
+            for id in list(self.store.backup_by_agent.get(agent.name)):
+                del self.store.backup[id]
+                self.store.backup_by_agent.remove(agent.name, id)
+
+    def move_conversations_by_agent_name(self, agent_name: str) -> Tuple[int, int]:
+        """Move the conversations linked with a specific agent to the backup, in a single locked step."""
+        with self.store.lock:
+            ids = list(self.store.conversations_by_agent.get(agent_name))
+            for id in ids:
+                document = self.store.conversations.pop(id)
+                self.store.unindex_conversation(document)
+                document["id"] = id
+                self._insert(document)
+        return len(ids), len(ids)
+
+    def count_conversations_by_agent_name(self, agent_name: str) -> int:
+        return len(self.store.backup_by_agent.get(agent_name))
+
+    def get_backed_up_agent_names(self) -> List[str]:
+        with self.store.lock:
+            return sorted(self.store.backup_by_agent.keys())
+
+    def iter_conversation_batches_by_agent_name(
+        self,
+        agent_name: str,
+        batch_size: int = 1000,
+        after_id: Optional[str] = None
+    ) -> Iterator[Tuple[List, str]]:
+        with self.store.lock:
+            ids = list(self.store.backup_by_agent.after(agent_name, after_id))
+        for start in range(0, len(ids), batch_size):
+            with self.store.lock:
+                batch = [copy.deepcopy(self.store.backup[id]) for id in ids[start:start + batch_size]]
+            yield batch, ids[start:start + batch_size][-1]
+
+    def get_recovery_checkpoint(self, agent_name: str) -> Optional[Dict]:
+        checkpoint = self.store.recovery_checkpoints.get(agent_name)
+        return dict(checkpoint) if checkpoint else None
+
+    def save_recovery_checkpoint(self, agent_name: str, last_id: Optional[str], recovered: int) -> None:
+        self.store.recovery_checkpoints[agent_name] = {"last_id": last_id, "recovered": recovered}
+
+    def delete_recovery_checkpoint(self, agent_name: str) -> None:
+        self.store.recovery_checkpoints.pop(agent_name, None)
+
+
+class InMemoryFeedbackRepository(IFeedbackRepository):
+    def __init__(self, uri: str):
+        self.store = get_memory_store(uri)
+
+    def create(self, feedback: Feedback) -> None:
+        with self.store.lock:
+            if feedback.id is None:
+                feedback.id = next(self.store.feedback_ids)
+            elif feedback.id in self.store.feedback:
+                raise ValueError(f"Feedback with id {feedback.id} already exists.")
+            self.store.feedback[feedback.id] = copy.deepcopy(feedback)
+
+    def get_by_id(self, feedback_id: int) -> Optional[Feedback]:
+        with self.store.lock:
+            return copy.deepcopy(self.store.feedback.get(feedback_id))
+
+    def update(self, current_feedback: Feedback, updated_feedback: Feedback) -> None:
+        with self.store.lock:
+            if current_feedback.id in self.store.feedback:
+                updated = copy.deepcopy(updated_feedback)
+                updated.id = current_feedback.id
+                self.store.feedback[current_feedback.id] = updated
+
+    def delete(self, feedback: Feedback) -> None:
+        with self.store.lock:
+            self.store.feedback.pop(feedback.id, None)
+
+    def get_all(self) -> List[Feedback]:
+        with self.store.lock:
+            return copy.deepcopy(list(self.store.feedback.values()))
+
+    def count(self) -> int:
+        return len(self.store.feedback)
@@ -0,0 +1,98 @@
+import atexit
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import MongoClient
+
+
+DEFAULT_CLIENT_OPTIONS = {
+    "maxPoolSize": 50,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 300000,
+    "serverSelectionTimeoutMS": 10000,
+    "connectTimeoutMS": 10000,
+    "socketTimeoutMS": 60000,
+    "retryWrites": True,
+}
+
+
+class MongoClientRegistry:
+    """
+    Process-wide registry of MongoClient instances, keyed by connection URI.
+
+    A MongoClient owns a connection pool and its own monitoring threads, so every repository of the
+    application borrows the client registered for its URI instead of opening a new one.
+
+    Attributes:
+    - options (Dict[str, Any]): Keyword arguments passed to every MongoClient created by the registry
+      (pool size, timeouts, ...). Defaults to DEFAULT_CLIENT_OPTIONS.
+
+    Methods:
+    - get_client(uri: str) -> MongoClient: Return the shared client for the URI, creating it on first use.
+    - configure(**options) -> None: Override client options for clients created afterwards.
+    - on_open(hook) / on_close(hook) -> None: Register callbacks run when a client is created or closed.
+    - close(uri: str) -> None: Close and forget the client for the URI.
+    - close_all() -> None: Close every client. Registered with atexit on the default registry.
+    """
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self.options = dict(DEFAULT_CLIENT_OPTIONS if options is None else options)
+        self._clients: Dict[str, MongoClient] = {}
+        self._lock = threading.Lock()
+        self._open_hooks: List[Callable[[str, MongoClient], None]] = []
+        self._close_hooks: List[Callable[[str, MongoClient], None]] = []
+
+    def configure(self, **options) -> None:
+        """Override client options. Only clients created after the call are affected."""
+        with self._lock:
+            self.options.update(options)
+
+    def on_open(self, hook: Callable[[str, MongoClient], None]) -> None:
+        """Register a callback invoked with (uri, client) after a client is created."""
+        self._open_hooks.append(hook)
+
+    def on_close(self, hook: Callable[[str, MongoClient], None]) -> None:
+        """Register a callback invoked with (uri, client) before a client is closed."""
+        self._close_hooks.append(hook)
+
+    def get_client(self, uri: str) -> MongoClient:
+        """Return the client registered for the URI, creating it on first use."""
+        client = self._clients.get(uri)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(uri)
+            if client is None:
+                client = MongoClient(uri, **self.options)
+                self._clients[uri] = client
+                for hook in self._open_hooks:
+                    hook(uri, client)
+        return client
+
+    def close(self, uri: str) -> None:
+        """Close the client registered for the URI, if any."""
+        with self._lock:
+            client = self._clients.pop(uri, None)
+        if client is not None:
+            for hook in self._close_hooks:
+                hook(uri, client)
+            client.close()
+
+    def close_all(self) -> None:
+        """Close every registered client."""
+        for uri in list(self._clients):
+            self.close(uri)
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._clients
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+mongo_client_registry = MongoClientRegistry()
+atexit.register(mongo_client_registry.close_all)
+
+
+def get_mongo_client(uri: str) -> MongoClient:
+    """Return the process-wide shared MongoClient for the URI."""
+    return mongo_client_registry.get_client(uri)
@@ -0,0 +1,148 @@
+import datetime
+import zlib
+from typing import Dict, Iterable, Optional
+
+from bson import Binary
+from pymongo import ASCENDING, DESCENDING
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, installed with the `compression` extra
+    zstandard = None
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+
+DEFAULT_COMPRESSION_THRESHOLD = 4096
+DEFAULT_DICTIONARY_SIZE = 64 * 1024
+
+
+class MessageCompressor:
+    """
+    Compresses the message contents larger than a threshold, and decompresses them when mapping documents to entities.
+
+    A compressed message is stored as {"role": ..., "content": "", "content_z": <bytes>, "codec": "zstd" | "zlib"}.
+    zstd is used when the `zstandard` package is installed, zlib otherwise. With zstd, each agent can have a
+    dictionary trained on its own messages: short, repetitive messages compress much better with it.
+    zstd frames carry the ID of their dictionary, so a message stays readable after its agent is renamed
+    or retrained. Dictionaries are therefore never deleted.
+
+    With a `threshold` of None nothing is compressed, but stored compressed messages are still read.
+    With a `dictionary_collection` of None, trained dictionaries are only kept in memory.
+
+    Compressors are created per call: zstandard contexts can not be shared between the threads of the server.
+    Dictionaries are digested once, when trained or loaded, so creating a compressor with one stays cheap.
+    """
+    def __init__(
+        self,
+        dictionary_collection=None,
+        threshold: Optional[int] = DEFAULT_COMPRESSION_THRESHOLD,
+        level: int = 3
+    ):
+        self.dictionary_collection = dictionary_collection
+        self.threshold = threshold
+        self.level = level
+        self.codec = CODEC_ZSTD if zstandard else CODEC_ZLIB
+        self._dictionaries: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._agent_dictionary_ids: Dict[str, Optional[int]] = {}
+        if dictionary_collection is not None:
+            dictionary_collection.create_index("dict_id", unique=True)
+            dictionary_collection.create_index([("agent_name", ASCENDING), ("created_at", DESCENDING)])
+
+    def should_compress(self, content: str) -> bool:
+        # A character is at most four bytes: most short contents are skipped without being encoded
+        return self.threshold is not None and len(content) >= self.threshold // 4 and \
+            len(content.encode("utf-8")) >= self.threshold
+
+    def compress(self, content: str, agent_name: Optional[str] = None) -> Optional[dict]:
+        """
+        Fields replacing the content of a message document, or None when the content is kept as is:
+        below the threshold, or not made smaller by compression.
+        """
+        if not self.should_compress(content):
+            return None
+        data = content.encode("utf-8")
+        if self.codec == CODEC_ZSTD:
+            dictionary = self._agent_dictionary(agent_name) if agent_name else None
+            compressed = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary).compress(data)
+        else:
+            compressed = zlib.compress(data, self.level)
+        if len(compressed) >= len(data):
+            return None
+        return {"content": "", "content_z": Binary(compressed), "codec": self.codec}
+
+    def compress_document(self, message_doc: dict, agent_name: Optional[str] = None) -> dict:
+        """Compress a message document in place. System messages are left as is, prompt references match them."""
+        if message_doc["role"] != "system":
+            fields = self.compress(message_doc["content"], agent_name)
+            if fields:
+                message_doc.update(fields)
+        return message_doc
+
+    def decompress(self, message_doc) -> str:
+        data = bytes(message_doc["content_z"])
+        if message_doc.get("codec") == CODEC_ZLIB:
+            return zlib.decompress(data).decode("utf-8")
+        if zstandard is None:
+            raise RuntimeError("Reading zstd compressed messages requires the zstandard package.")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dictionary = self._dictionary(dict_id) if dict_id else None
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data).decode("utf-8")
+
+    def train(self, agent_name: str, samples: Iterable[str], dict_size: int = DEFAULT_DICTIONARY_SIZE) -> int:
+        """
+        Train the dictionary used for the next messages of an agent, and return its ID.
+        Raises ValueError when the samples are too few or too small to train a dictionary.
+        """
+        if zstandard is None:
+            raise RuntimeError("Training a compression dictionary requires the zstandard package.")
+        samples = [sample.encode("utf-8") for sample in samples if sample]
+        try:
+            dictionary = zstandard.train_dictionary(dict_size, samples, level=self.level)
+        except zstandard.ZstdError as error:
+            raise ValueError(f"Can not train a compression dictionary for agent {agent_name}: {error}") from error
+        dictionary.precompute_compress(level=self.level)
+        dict_id = dictionary.dict_id()
+        if self.dictionary_collection is not None:
+            self.dictionary_collection.update_one(
+                {"dict_id": dict_id},
+                {"$setOnInsert": {
+                    "agent_name": agent_name,
+                    "data": Binary(dictionary.as_bytes()),
+                    "created_at": datetime.datetime.now(datetime.timezone.utc)
+                }},
+                upsert=True
+            )
+        self._dictionaries[dict_id] = dictionary
+        self._agent_dictionary_ids[agent_name] = dict_id
+        return dict_id
+
+    def _agent_dictionary(self, agent_name: str) -> Optional["zstandard.ZstdCompressionDict"]:
+        if agent_name not in self._agent_dictionary_ids:
+            document = None
+            if self.dictionary_collection is not None:
+                document = self.dictionary_collection.find_one(
+                    {"agent_name": agent_name},
+                    sort=[("created_at", DESCENDING)]
+                )
+            if document and document["dict_id"] not in self._dictionaries:
+                self._dictionaries[document["dict_id"]] = self._load_dictionary(document["data"])
+            self._agent_dictionary_ids[agent_name] = document["dict_id"] if document else None
+        dict_id = self._agent_dictionary_ids[agent_name]
+        return self._dictionaries[dict_id] if dict_id else None
+
+    def _dictionary(self, dict_id: int) -> "zstandard.ZstdCompressionDict":
+        if dict_id not in self._dictionaries:
+            document = None
+            if self.dictionary_collection is not None:
+                document = self.dictionary_collection.find_one({"dict_id": dict_id})
+            if document is None:
+                raise ValueError(f"Compression dictionary {dict_id} does not exist.")
+            self._dictionaries[dict_id] = self._load_dictionary(document["data"])
+        return self._dictionaries[dict_id]
+
+    def _load_dictionary(self, data: bytes) -> "zstandard.ZstdCompressionDict":
+        dictionary = zstandard.ZstdCompressionDict(bytes(data))
+        # Digested once, instead of by every compressor created with it
+        dictionary.precompute_compress(level=self.level)
+        return dictionary
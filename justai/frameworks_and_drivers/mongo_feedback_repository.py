@@ -1,13 +1,13 @@
 from typing import List, Optional
-from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
+from justai.frameworks_and_drivers.mongo_client import get_mongo_client
 from justai.entities.feedback import Feedback, FeedbackTag
 from justai.interface_adapters.feedback_repository_interface import IFeedbackRepository
 
 
 class MongoFeedbackRepository(IFeedbackRepository):
     def __init__(self, uri: str):
-        self.client = MongoClient(uri)
+        self.client = get_mongo_client(uri)
         self.db = self.client["FeedbackDB"]
         self.collection = self.db['feedback']
 
@@ -53,3 +53,6 @@ class MongoFeedbackRepository(IFeedbackRepository):
                 id=doc["id"]
             ) for doc in cursor
         ]
+
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
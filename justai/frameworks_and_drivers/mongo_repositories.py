@@ -1,23 +1,118 @@
-from typing import List, Optional, Union
-
-from bson import ObjectId
+import datetime
+import functools
+import re
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from bson import CodecOptions, ObjectId
+from bson.raw_bson import RawBSONDocument
+from justai.application.exceptions import DataBaseError, DuplicateError, NotFoundError
 from justai.entities.agent import Agent
-from justai.entities.conversation import Conversation, Message
+from justai.entities.conversation import LABEL_PREFIX, Conversation, ConversationHeader, LazyMessageList, Message
+from justai.entities.conversation_batch import ConversationBatch, ConversationBatchBuilder
+from justai.entities.token_count import DEFAULT_ENCODING, TokenCount
 from justai.entities.user import User
 from justai.interface_adapters.conversational_repository_interface import IAgentRepository, IUserRepository
 from justai.interface_adapters.conversational_repository_interface import IBackupRepository
 from justai.interface_adapters.conversational_repository_interface import IConversationRepository
 
 
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from justai.frameworks_and_drivers.mongo_client import get_mongo_client
+from justai.frameworks_and_drivers.mongo_compression import DEFAULT_DICTIONARY_SIZE, MessageCompressor
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+# Fields read into a ConversationBatch
+BATCH_PROJECTION = {
+    "agent_name": 1,
+    "tags": 1,
+    "messages.role": 1,
+    "messages.content": 1,
+    "messages.prompt_ref": 1,
+    "messages.content_z": 1,
+    "messages.codec": 1
+}
+
+# Fields needed to list conversations, the message bodies never leave the server
+HEADER_PROJECTION = {
+    "agent_name": 1,
+    "tags": 1,
+    "updated_at": 1,
+    "message_count": {"$size": {"$ifNull": ["$messages", []]}}
+}
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _message_to_document(message: Union[Message, dict]) -> dict:
+    if isinstance(message, Message):
+        return message.to_dict()
+    return {"role": message["role"], "content": message["content"]}
+
+
+def _token_counts_to_document(token_counts: Dict[str, TokenCount]) -> Dict[str, dict]:
+    return {encoding: count.to_dict() for encoding, count in token_counts.items()}
+
+
+def ensure_unique_index(collection, field: str) -> None:
+    """
+    Create the unique index on a field, rejecting duplicates on write.
+    Raises DataBaseError, naming some of the duplicates, when the collection already holds duplicate values.
+    """
+    try:
+        collection.create_index(field, unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        duplicates = collection.aggregate([
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": 5}
+        ])
+        names = ", ".join(repr(duplicate["_id"]) for duplicate in duplicates)
+        raise DataBaseError(
+            f"The `{collection.name}` collection holds several documents with the same {field} ({names}). "
+            f"Rename or delete the duplicates, then connect again."
+        ) from e
+
+
+class PromptResolver:
+    """
+    Resolves the system prompt references of the conversations read by one repository call.
+
+    A system message equal to its agent's prompt is stored as
+    {"role": "system", "content": "", "prompt_ref": {"agent_id": <agent _id>}}
+    and always reads as the agent's current prompt.
+    Each agent is fetched once per call, by ID, falling back to the conversation's agent name
+    when the agent was deleted and recreated since, as a recovery does.
+    """
+    def __init__(self, agent_collection):
+        self.agent_collection = agent_collection
+        self._prompts_by_id: Dict[ObjectId, Optional[str]] = {}
+        self._prompts_by_name: Dict[str, str] = {}
+
+    def resolve(self, prompt_ref, agent_name: str) -> str:
+        agent_id = prompt_ref["agent_id"]
+        if agent_id not in self._prompts_by_id:
+            agent = self.agent_collection.find_one({"_id": agent_id}, {"system_prompt": 1})
+            self._prompts_by_id[agent_id] = agent["system_prompt"] if agent else None
+        system_prompt = self._prompts_by_id[agent_id]
+        if system_prompt is None:
+            if agent_name not in self._prompts_by_name:
+                agent = self.agent_collection.find_one({"name": agent_name}, {"system_prompt": 1})
+                self._prompts_by_name[agent_name] = agent["system_prompt"] if agent else ""
+            system_prompt = self._prompts_by_name[agent_name]
+        return system_prompt
 
 
 class MongoUserRepository(IUserRepository):
     def __init__(self, uri: str):
-        self.client = MongoClient(uri)
+        self.client = get_mongo_client(uri)
         self.db = self.client["AgentConvoDB"]
         self.collection = self.db['user']
+        # Duplicate names are rejected by the index, writes do not need to check beforehand
+        ensure_unique_index(self.collection, "user_name")
 
     def get_by_name(self, user_name: str) -> Optional[User]:
         document = self.collection.find_one({"user_name": user_name})
@@ -33,19 +128,24 @@ class MongoUserRepository(IUserRepository):
                 }
             )
         except DuplicateKeyError:
-            raise ValueError(f"User with name {user.user_name} already exists.")
+            raise DuplicateError(f"User with the name {user.user_name} already exists.")
 
     def update(self, current_user: User, updated_user: User) -> None:
-        self.collection.update_one(
-            {
-                "user_name": current_user.user_name
-            },
-            {
-                "$set": {
-                    "user_name": updated_user.user_name
+        try:
+            result = self.collection.update_one(
+                {
+                    "user_name": current_user.user_name
+                },
+                {
+                    "$set": {
+                        "user_name": updated_user.user_name
+                    }
                 }
-            }
-        )
+            )
+        except DuplicateKeyError:
+            raise DuplicateError(f"User with the name {updated_user.user_name} already exists.")
+        if result.matched_count == 0:
+            raise NotFoundError(f"User with the name {current_user.user_name} not found.")
 
     def delete(self, user: User) -> None:
         self.collection.delete_one({"user_name": user.user_name})
@@ -54,12 +154,20 @@ class MongoUserRepository(IUserRepository):
         cursor = self.collection.find()
         return [User(doc["user_name"]) for doc in cursor]
 
+    def exists(self, user_name: str) -> bool:
+        return self.collection.find_one({"user_name": user_name}, {"_id": 1}) is not None
+
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
+
 
 class MongoAgentRepository(IAgentRepository):
     def __init__(self, uri: str):
-        self.client = MongoClient(uri)
+        self.client = get_mongo_client(uri)
         self.db = self.client["AgentConvoDB"]
         self.collection = self.db['agent']
+        # Duplicate names are rejected by the index, writes do not need to check beforehand
+        ensure_unique_index(self.collection, "name")
 
     def get_by_name(self, agent_name: str) -> Optional[Agent]:
         document = self.collection.find_one({"name": agent_name})
@@ -77,21 +185,26 @@ class MongoAgentRepository(IAgentRepository):
                 }
             )
         except DuplicateKeyError:
-            raise ValueError(f"Agent with name {agent.name} already exists.")
+            raise DuplicateError(f"Agent with the name {agent.name} already exists.")
 
     def update(self, current_agent: Agent, updated_agent: Agent) -> None:
-        self.collection.update_one(
-            {
-                "name": current_agent.name
-            },
-            {
-                "$set": {
-                    "name": updated_agent.name,
-                    "system_prompt": updated_agent.system_prompt,
-                    "dataset_generation_prompts": updated_agent.dataset_generation_prompts
+        try:
+            result = self.collection.update_one(
+                {
+                    "name": current_agent.name
+                },
+                {
+                    "$set": {
+                        "name": updated_agent.name,
+                        "system_prompt": updated_agent.system_prompt,
+                        "dataset_generation_prompts": updated_agent.dataset_generation_prompts
+                    }
                 }
-            }
-        )
+            )
+        except DuplicateKeyError:
+            raise DuplicateError(f"Agent with the name {updated_agent.name} already exists.")
+        if result.matched_count == 0:
+            raise NotFoundError(f"Agent with the name {current_agent.name} not found.")
 
     def delete(self, agent: Agent) -> None:
         self.collection.delete_one({"name": agent.name})
@@ -100,65 +213,392 @@ class MongoAgentRepository(IAgentRepository):
         cursor = self.collection.find()
         return [Agent(doc["name"], doc["system_prompt"], doc["dataset_generation_prompts"]) for doc in cursor]
 
+    def exists(self, agent_name: str) -> bool:
+        return self.collection.find_one({"name": agent_name}, {"_id": 1}) is not None
 
-class MongoConversationRepository(IConversationRepository):
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
 
-    def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
+
+class MongoConversationRepository(IConversationRepository):
+    """
+    Conversations stored in the `conversation` collection of MongoDB.
+
+    With `lazy_decoding`, conversations are read as RawBSONDocument: only the top-level fields are decoded,
+    and the messages are returned as a LazyMessageList decoding each message on first access.
+    Callers looking only at ids, agent names or tags never pay for decoding the messages.
+
+    System messages equal to the agent's prompt are stored by reference to the agent (see PromptResolver),
+    so that editing an agent's prompt does not rewrite its conversations.
+
+    With a `compression_threshold`, the other messages larger than it (in bytes) are stored compressed
+    (see MessageCompressor). Compressed messages are always read back, whatever the threshold.
+    search_by_content matches them after decompressing them, which makes searches slower as more
+    conversations hold compressed messages.
+
+    Token counts are stored by encoding in the `token_counts` field, {encoding: {"messages", "total", "assistant"}},
+    and aggregated server-side by get_token_statistics.
+    """
+    def __init__(
+        self,
+        connection_string: str,
+        lazy_decoding: bool = False,
+        compression_threshold: Optional[int] = None
+    ):
+        self.client = get_mongo_client(connection_string)
         self.db = self.client["AgentConvoDB"]
         self.collection = self.db["conversation"]
-
-    def create(self, conversation: Conversation) -> None:
+        self.agent_collection = self.db["agent"]
+        self.compressor = MessageCompressor(self.db["compression_dictionary"], compression_threshold)
+        self.lazy_decoding = lazy_decoding
+        # Collection used by the reads returning full conversations
+        self.read_collection = self.collection
+        if lazy_decoding:
+            self.read_collection = self.collection.with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument)
+            )
+        self.ensure_indexes()
+        self.migrate()
+
+    def migrate(self) -> None:
+        """
+        Bring the documents written by older versions up to date, run when the repository is built:
+        the app migrates its database on its first connection after an upgrade. Can also be run by hand,
+        MongoConversationRepository(<connection link>).migrate().
+        Idempotent and cheap once done: each step only matches the documents it did not migrate yet.
+        """
+        self.backfill_labels()
+        self.migrate_system_prompts()
+
+    def ensure_indexes(self) -> None:
+        """Create the indexes backing the conversation queries. No-op when they already exist."""
+        self.collection.create_index([("agent_name", ASCENDING), ("tags", ASCENDING)])
+        self.collection.create_index([("agent_name", ASCENDING), ("label", ASCENDING)])
+        # Covers the token statistics of the default encoding
+        self.collection.create_index([
+            ("agent_name", ASCENDING),
+            (f"token_counts.{DEFAULT_ENCODING}.total", ASCENDING),
+            (f"token_counts.{DEFAULT_ENCODING}.assistant", ASCENDING)
+        ])
+
+    def backfill_labels(self) -> int:
+        """
+        Fill the indexed `label` field of documents written before it existed, from their 'label: ' tag.
+        Runs server-side as a pipeline update and returns the number of modified documents.
+        """
+        label_tag = {
+            "$first": {
+                "$filter": {
+                    "input": {"$ifNull": ["$tags", []]},
+                    "cond": {"$eq": [{"$substrCP": ["$$this", 0, len(LABEL_PREFIX)]}, LABEL_PREFIX]}
+                }
+            }
+        }
+        result = self.collection.update_many(
+            {"label": {"$exists": False}},
+            [{"$set": {"label": {"$let": {
+                "vars": {"tag": label_tag},
+                "in": {"$cond": [
+                    {"$eq": [{"$type": "$$tag"}, "string"]},
+                    {"$trim": {"input": {"$substrCP": ["$$tag", len(LABEL_PREFIX), {"$strLenCP": "$$tag"}]}}},
+                    None
+                ]}
+            }}}}]
+        )
+        return result.modified_count
+
+    def migrate_system_prompts(self) -> int:
+        """
+        Replace the copies of their agent's prompt held by the conversations written before prompts
+        were stored by reference. Runs one server-side update per agent and returns the number of
+        modified documents. System messages differing from the agent's prompt are left as they are.
+        """
+        modified = 0
+        for agent in self.agent_collection.find({}, {"name": 1, "system_prompt": 1}):
+            inline_prompt = {"role": "system", "content": agent["system_prompt"], "prompt_ref": {"$exists": False}}
+            result = self.collection.update_many(
+                {"agent_name": agent["name"], "messages": {"$elemMatch": inline_prompt}},
+                {"$set": {"messages.$[elem]": {
+                    "role": "system",
+                    "content": "",
+                    "prompt_ref": {"agent_id": agent["_id"]}
+                }}},
+                array_filters=[{f"elem.{key}": value for key, value in inline_prompt.items()}]
+            )
+            modified += result.modified_count
+        return modified
+
+    def train_compression_dictionary(
+        self,
+        agent_name: str,
+        sample_size: int = 2000,
+        dict_size: int = DEFAULT_DICTIONARY_SIZE
+    ) -> int:
+        """
+        Train the compression dictionary of an agent on a random sample of its conversations, and return its ID.
+        The next messages written for the agent are compressed with it.
+        """
+        cursor = self.collection.aggregate([
+            {"$match": {"agent_name": agent_name}},
+            {"$sample": {"size": sample_size}},
+            {"$project": {"agent_name": 1, "messages": 1}}
+        ])
+        resolver = PromptResolver(self.agent_collection)
+        samples = [
+            message.content
+            for doc in cursor
+            for message in self._to_conversation(doc, resolver).messages
+            if message.role != "system"
+        ]
+        return self.compressor.train(agent_name, samples, dict_size)
+
+    def _to_documents(self, agent_name: str, messages: List[Union[Message, dict]]) -> List[dict]:
+        """
+        Serialize messages, storing the system messages equal to the agent's prompt by reference
+        and compressing the large ones.
+        """
+        documents = [_message_to_document(message) for message in messages]
+        if any(document["role"] == "system" for document in documents):
+            agent = self.agent_collection.find_one({"name": agent_name}, {"system_prompt": 1})
+            for document in documents:
+                if agent and document["role"] == "system" and document["content"] == agent["system_prompt"]:
+                    document["content"] = ""
+                    document["prompt_ref"] = {"agent_id": agent["_id"]}
+        for document in documents:
+            self.compressor.compress_document(document, agent_name)
+        return documents
+
+    def _to_documents_by_id(self, conversation_id: str, messages: List[Message]) -> List[dict]:
+        """Serialize messages written into an existing conversation, whose agent is only looked up if needed."""
+        documents = [_message_to_document(message) for message in messages]
+        if any(self.compressor.should_compress(document["content"]) for document in documents):
+            conversation = self.collection.find_one({"_id": ObjectId(conversation_id)}, {"agent_name": 1})
+            agent_name = conversation["agent_name"] if conversation else None
+            for document in documents:
+                self.compressor.compress_document(document, agent_name)
+        return documents
+
+    def create(self, conversation: Conversation, token_counts: Optional[Dict[str, TokenCount]] = None) -> None:
         if conversation.id:
             if self.collection.find_one({"id": conversation.id}):
                 raise ValueError(f"Conversation with id {conversation.id} already exists.")
-            self.collection.insert_one(
-                {
-                    "_id": ObjectId(conversation.id),
-                    "agent_name": conversation.agent_name,
-                    "messages": conversation.messages,
-                    "tags": conversation.tags
-                    }
-                )
+            document = {
+                "_id": ObjectId(conversation.id),
+                "agent_name": conversation.agent_name,
+                "messages": self._to_documents(conversation.agent_name, conversation.messages),
+                "tags": conversation.tags,
+                "label": conversation.label,
+                "updated_at": _now()
+            }
         else:
-            self.collection.insert_one(
-                {
-                    "agent_name": conversation.agent_name,
-                    "messages": conversation.messages,
-                    "tags": conversation.tags
-                }
-            )
-
-    def get_by_agent_name(self, agent_name: str) -> List[Conversation]:
-        cursor = self.collection.find({"agent_name": agent_name})
+            document = {
+                "agent_name": conversation.agent_name,
+                "messages": self._to_documents(conversation.agent_name, conversation.messages),
+                "tags": conversation.tags,
+                "label": conversation.label,
+                "updated_at": _now()
+            }
+        if token_counts:
+            document["token_counts"] = _token_counts_to_document(token_counts)
+        self.collection.insert_one(document)
+
+    def _message_content(self, message_doc, agent_name: str, resolver: PromptResolver) -> str:
+        if "prompt_ref" in message_doc:
+            return resolver.resolve(message_doc["prompt_ref"], agent_name)
+        if "content_z" in message_doc:
+            return self.compressor.decompress(message_doc)
+        return message_doc["content"]
+
+    def _to_message(self, message_doc, agent_name: str, resolver: PromptResolver) -> Message:
+        return Message(message_doc['role'], self._message_content(message_doc, agent_name, resolver))
+
+    def _to_conversation(self, doc, resolver: Optional[PromptResolver] = None) -> Conversation:
+        resolver = resolver or PromptResolver(self.agent_collection)
+        agent_name = doc['agent_name']
+        if self.lazy_decoding:
+            decode = functools.partial(self._to_message, agent_name=agent_name, resolver=resolver)
+            messages = LazyMessageList(doc['messages'], decode)
+        else:
+            # Convert list of message dicts to list of Message objects
+            messages = [self._to_message(message_doc, agent_name, resolver) for message_doc in doc['messages']]
+        # Use the MongoDB _id as the conversation id
+        return Conversation(agent_name, messages, str(doc['_id']), list(doc.get('tags', [])))
 
-        conversations = []
-        for doc in cursor:
-            # Assuming the MongoDB document has a 'name', 'messages', and '_id' field
-            agent_name = doc['agent_name']
+    def _iter_find(self, query: dict, batch_size: int) -> Iterator[Conversation]:
+        resolver = PromptResolver(self.agent_collection)
+        cursor = self.read_collection.find(query).sort("_id", ASCENDING).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                yield self._to_conversation(doc, resolver)
+        finally:
+            cursor.close()
 
-            # Convert list of message dicts to list of Message objects
-            messages = [Message(message_doc['role'], message_doc['content']) for message_doc in doc['messages']]
+    def get_by_agent_name(self, agent_name: str) -> List[Conversation]:
+        return list(self.iter_by_agent_name(agent_name))
+
+    def get_by_agent_name_and_tag(self, agent_name: str, tag: str) -> List[Conversation]:
+        return list(self._iter_find({"agent_name": agent_name, "tags": tag}, batch_size=100))
+
+    def get_labelled_by_agent_name_and_user(self, agent_name: str, user_name: str) -> List[Conversation]:
+        query = {"agent_name": agent_name, "tags": user_name, "label": {"$type": "string"}}
+        return list(self._iter_find(query, batch_size=100))
+
+    def get_labelled_headers_by_agent_name_and_user(
+        self,
+        agent_name: str,
+        user_name: str
+    ) -> List[ConversationHeader]:
+        query = {"agent_name": agent_name, "tags": user_name, "label": {"$type": "string"}}
+        cursor = self.collection.find(query, HEADER_PROJECTION).sort("_id", ASCENDING)
+        return [self._to_header(doc) for doc in cursor]
+
+    @staticmethod
+    def _to_header(doc) -> ConversationHeader:
+        return ConversationHeader(
+            str(doc["_id"]),
+            doc["agent_name"],
+            doc.get("tags", []),
+            doc.get("message_count", 0),
+            # Documents written before updated_at existed fall back to their creation time
+            doc.get("updated_at") or doc["_id"].generation_time
+        )
 
-            # Use the MongoDB _id as the conversation id
-            id = str(doc['_id'])
+    def iter_headers_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[ConversationHeader]:
+        cursor = self.collection.find({"agent_name": agent_name}, HEADER_PROJECTION)
+        cursor = cursor.sort("_id", ASCENDING).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                yield self._to_header(doc)
+        finally:
+            cursor.close()
+
+    def get_by_ids(self, conversation_ids: List[str]) -> List[Conversation]:
+        query = {"_id": {"$in": [ObjectId(conversation_id) for conversation_id in conversation_ids]}}
+        cursor = self.read_collection.find(query).sort("_id", ASCENDING)
+        resolver = PromptResolver(self.agent_collection)
+        return [self._to_conversation(doc, resolver) for doc in cursor]
+
+    def iter_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[Conversation]:
+        return self._iter_find({"agent_name": agent_name}, batch_size)
+
+    def iter_all(self, batch_size: int = 500) -> Iterator[Conversation]:
+        return self._iter_find({}, batch_size)
+
+    def get_batch_by_agent_name(self, agent_name: str, batch_size: int = 500) -> ConversationBatch:
+        builder = ConversationBatchBuilder()
+        resolver = PromptResolver(self.agent_collection)
+        cursor = self.collection.find({"agent_name": agent_name}, BATCH_PROJECTION)
+        cursor = cursor.sort("_id", ASCENDING).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                builder.add(
+                    str(doc["_id"]),
+                    doc["agent_name"],
+                    doc.get("tags"),
+                    (
+                        (message["role"], self._message_content(message, doc["agent_name"], resolver))
+                        for message in doc.get("messages", [])
+                    )
+                )
+        finally:
+            cursor.close()
+        return builder.build()
+
+    def get_page(
+        self,
+        after_id: Optional[str] = None,
+        limit: int = 50,
+        agent_name: Optional[str] = None
+    ) -> List[Conversation]:
+        query = {}
+        if agent_name is not None:
+            query["agent_name"] = agent_name
+        if after_id:
+            query["_id"] = {"$gt": ObjectId(after_id)}
+        cursor = self.read_collection.find(query).sort("_id", ASCENDING).limit(limit)
+        resolver = PromptResolver(self.agent_collection)
+        return [self._to_conversation(doc, resolver) for doc in cursor]
 
-            if 'tags' in doc:
-                tags = doc['tags']
-            else:
-                tags = []
+    def update_agent_field(self, current_agent: Agent, updated_agent: Agent) -> None:
+        # Prompts stored by reference follow the agent, a rename still has to be copied into the conversations
+        if updated_agent.name != current_agent.name:
+            self.collection.update_many(
+                {"agent_name": current_agent.name},
+                {"$set": {"agent_name": updated_agent.name}}
+            )
+        if updated_agent.system_prompt != current_agent.system_prompt:
+            # Conversations not migrated yet hold a copy of the prompt, see migrate_system_prompts
+            inline_prompt = {"role": "system", "prompt_ref": {"$exists": False}}
+            self.collection.update_many(
+                {"agent_name": updated_agent.name, "messages": {"$elemMatch": inline_prompt}},
+                {"$set": {"messages.$[elem].content": updated_agent.system_prompt}},
+                array_filters=[{f"elem.{key}": value for key, value in inline_prompt.items()}]
+            )
+            # The counts include the system messages, by reference or not
+            self.collection.update_many(
+                {"agent_name": updated_agent.name, "token_counts": {"$exists": True}},
+                {"$unset": {"token_counts": ""}}
+            )
 
-            conversation = Conversation(agent_name, messages, id, tags)
-            conversations.append(conversation)
+    def append_messages(
+        self,
+        conversation_id: str,
+        messages: List[Message],
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        push = {"messages": {"$each": self._to_documents_by_id(conversation_id, messages)}}
+        if token_counts:
+            # Added to the stored counts when the conversation is counted with exactly these encodings
+            query = {f"token_counts.{encoding}": {"$exists": True} for encoding in token_counts}
+            query["_id"] = ObjectId(conversation_id)
+            query["$expr"] = {"$eq": [{"$size": {"$objectToArray": "$token_counts"}}, len(token_counts)]}
+            result = self.collection.update_one(query, {
+                "$push": {**push, **{
+                    f"token_counts.{encoding}.messages": {"$each": count.messages}
+                    for encoding, count in token_counts.items()
+                }},
+                "$inc": {
+                    f"token_counts.{encoding}.{field}": getattr(count, field)
+                    for encoding, count in token_counts.items()
+                    for field in ("total", "assistant")
+                },
+                "$set": {"updated_at": _now()}
+            })
+            if result.matched_count:
+                return
+        result = self.collection.update_one(
+            {"_id": ObjectId(conversation_id)},
+            {"$push": push, "$set": {"updated_at": _now()}, "$unset": {"token_counts": ""}}
+        )
+        if not result.matched_count:
+            raise ValueError(f"Conversation with id {conversation_id} does not exist.")
 
-        return conversations
+    def replace_message_at(self, conversation_id: str, index: int, message: Message) -> None:
+        # Matching on the position makes sure the array is never padded with nulls
+        result = self.collection.update_one(
+            {"_id": ObjectId(conversation_id), f"messages.{index}": {"$exists": True}},
+            {
+                "$set": {
+                    f"messages.{index}": self._to_documents_by_id(conversation_id, [message])[0],
+                    "updated_at": _now()
+                },
+                "$unset": {"token_counts": ""}
+            }
+        )
+        if not result.matched_count:
+            raise ValueError(f"Conversation with id {conversation_id} has no message at index {index}.")
 
-    def update_agent_field(self, current_agent: Agent, updated_agent: Agent) -> None:
-        self.collection.update_many(
-            {"agent_name": current_agent.name},
-            {"$set": {"agent_name": updated_agent.name, "messages.$[elem].content": updated_agent.system_prompt}},
-            array_filters=[{"elem.role": "system"}]
+    def truncate_after(self, conversation_id: str, index: int) -> None:
+        result = self.collection.update_one(
+            {"_id": ObjectId(conversation_id)},
+            {
+                "$push": {"messages": {"$each": [], "$slice": index + 1}},
+                "$set": {"updated_at": _now()},
+                "$unset": {"token_counts": ""}
+            }
         )
+        if not result.matched_count:
+            raise ValueError(f"Conversation with id {conversation_id} does not exist.")
 
     def delete_by_agent_name(self, agent_name: str) -> None:
         self.collection.delete_many({"agent_name": agent_name})
@@ -169,71 +609,180 @@ class MongoConversationRepository(IConversationRepository):
     def delete_by_id(self, conversation_id: str) -> None:
         self.collection.delete_one({"_id": ObjectId(conversation_id)})
 
-    def recover(self, conversations: List) -> None:
-        self.collection.insert_many(conversations)
+    @staticmethod
+    def _to_recovered_document(doc) -> dict:
+        # Counts taken before the backup may include a prompt the agent no longer has, they are counted again
+        document = {key: value for key, value in doc.items() if key != "token_counts"}
+        if "label" not in document:
+            # Backed up before the label field existed
+            tags = list(document.get("tags") or [])
+            document["label"] = Conversation(document["agent_name"], [], tags=tags).label
+        return document
+
+    def recover(self, conversations: List) -> int:
+        conversations = [self._to_recovered_document(doc) for doc in conversations]
+        try:
+            return len(self.collection.insert_many(conversations, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Conversations inserted by an interrupted recovery are skipped, any other error is raised
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            return e.details["nInserted"]
 
     def get_all(self) -> List[Conversation]:
-        cursor = self.collection.find()
-
-        conversations = []
-        for doc in cursor:
-            # Assuming the MongoDB document has a 'name', 'messages', and '_id' field
-            name = doc['agent_name']
-
-            # Convert list of message dicts to list of Message objects
-            messages = [Message(message_doc['role'], message_doc['content']) for message_doc in doc['messages']]
-
-            # Use the MongoDB _id as the conversation id
-            id = str(doc['_id'])
-
-            if 'tags' in doc:
-                tags = doc['tags']
-            else:
-                tags = []
-
-            conversation = Conversation(name, messages, id, tags)
-            conversations.append(conversation)
-
-        return conversations
+        return list(self.iter_all())
+
+    def exists_by_agent_name(self, agent_name: str) -> bool:
+        return self.collection.find_one({"agent_name": agent_name}, {"_id": 1}) is not None
+
+    def count_by_agent_name(self, agent_name: str) -> int:
+        return self.collection.count_documents({"agent_name": agent_name})
+
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
+
+    def search_by_content(self, text: str, agent_name: Optional[str] = None, limit: int = 50) -> List[Conversation]:
+        # The server can not look into compressed contents: the documents holding some are also fetched,
+        # and every candidate is matched here. Prompts stored by reference are not matched.
+        query = {"$or": [
+            {"messages.content": {"$regex": re.escape(text), "$options": "i"}},
+            {"messages.content_z": {"$exists": True}}
+        ]}
+        if agent_name is not None:
+            query["agent_name"] = agent_name
+        pattern = re.compile(re.escape(text), re.IGNORECASE)
+        resolver = PromptResolver(self.agent_collection)
+        found = []
+        cursor = self.read_collection.find(query).sort("_id", ASCENDING).batch_size(100)
+        try:
+            for doc in cursor:
+                if any(
+                    pattern.search(self._message_content(message_doc, doc["agent_name"], resolver))
+                    for message_doc in doc["messages"]
+                    if "prompt_ref" not in message_doc
+                ):
+                    found.append(self._to_conversation(doc, resolver))
+                    if len(found) == limit:
+                        break
+        finally:
+            cursor.close()
+        return found
 
     def get_by_id(self, conversation_id: str) -> Conversation:
-        document = self.collection.find_one(ObjectId(conversation_id))
+        document = self.read_collection.find_one({"_id": ObjectId(conversation_id)})
         if document:
-            messages = [Message(message_doc['role'], message_doc['content']) for message_doc in document['messages']]
-            return Conversation(document["agent_name"], messages, document["_id"], document["tags"])
+            return self._to_conversation(document)
         else:
             raise ValueError(f"Conversation with id {conversation_id} does not exist.")
 
-    def update(self, current_conversation: Conversation, updated_conversation: Conversation) -> None:
+    def update(
+        self,
+        current_conversation: Conversation,
+        updated_conversation: Conversation,
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
         '''
         Update a conversation in the database.
-        updates the agent_name, messages, and tags fields.
+        updates the agent_name, messages, tags and token_counts fields.
         Do not update the id field
         '''
-        self.collection.update_one(
-            {"_id": current_conversation.id},
-            {"$set": {
-                "agent_name": updated_conversation.agent_name,
-                "messages": [message.to_dict() for message in updated_conversation.messages],
-                "tags": updated_conversation.tags
-                }
-             }
-        )
+        fields = {
+            "agent_name": updated_conversation.agent_name,
+            "messages": self._to_documents(updated_conversation.agent_name, updated_conversation.messages),
+            "tags": updated_conversation.tags,
+            "label": updated_conversation.label,
+            "updated_at": _now()
+        }
+        if token_counts:
+            fields["token_counts"] = _token_counts_to_document(token_counts)
+            update = {"$set": fields}
+        else:
+            update = {"$set": fields, "$unset": {"token_counts": ""}}
+        self.collection.update_one({"_id": ObjectId(current_conversation.id)}, update)
+
+    def iter_headers_without_token_counts(
+        self,
+        encoding: str,
+        agent_name: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Iterator[ConversationHeader]:
+        query = {f"token_counts.{encoding}": {"$exists": False}}
+        if agent_name is not None:
+            query["agent_name"] = agent_name
+        cursor = self.collection.find(query, HEADER_PROJECTION).sort("_id", ASCENDING).batch_size(batch_size)
+        try:
+            for doc in cursor:
+                yield self._to_header(doc)
+        finally:
+            cursor.close()
+
+    def set_token_counts(
+        self,
+        conversation_id: str,
+        token_counts: Dict[str, TokenCount],
+        last_modified: Optional[datetime.datetime]
+    ) -> bool:
+        query = {"_id": ObjectId(conversation_id)}
+        if last_modified is not None:
+            # Headers of documents written before updated_at existed carry their creation time instead
+            query["$or"] = [{"updated_at": last_modified}, {"updated_at": {"$exists": False}}]
+        result = self.collection.update_one(query, {"$set": {
+            f"token_counts.{encoding}": count for encoding, count in _token_counts_to_document(token_counts).items()
+        }})
+        return result.matched_count == 1
+
+    def get_token_statistics(self, agent_name: str, encoding: str, max_tokens: int) -> Dict[str, int]:
+        counted = {"$isNumber": "$count.total"}
+        cursor = self.collection.aggregate([
+            {"$match": {"agent_name": agent_name}},
+            {"$project": {"_id": 0, "count": f"$token_counts.{encoding}"}},
+            {"$group": {
+                "_id": None,
+                "conversations": {"$sum": 1},
+                "counted": {"$sum": {"$cond": [counted, 1, 0]}},
+                "total_tokens": {"$sum": "$count.total"},
+                "assistant_tokens": {"$sum": "$count.assistant"},
+                "billing_tokens": {"$sum": {"$cond": [counted, {"$min": ["$count.total", max_tokens]}, 0]}},
+                "over_limit": {"$sum": {"$cond": [{"$and": [counted, {"$gt": ["$count.total", max_tokens]}]}, 1, 0]}}
+            }}
+        ])
+        statistics = next(cursor, None) or {}
+        return {
+            key: int(statistics.get(key, 0))
+            for key in ("conversations", "counted", "total_tokens", "assistant_tokens", "billing_tokens", "over_limit")
+        }
 
 
 class MongoBackupRepository(IBackupRepository):
-    def __init__(self, connection_string: str):
-        self.client = MongoClient(connection_string)
+    """
+    Conversations set aside in the `backup` collection of MongoDB when their agent is deleted.
+
+    Conversations moved from the conversation collection keep their stored form, compressed messages included,
+    except for the system prompts stored by reference: the agent is deleted next, so they are written inline.
+    With a `compression_threshold`, the messages of the conversations backed up from entities are compressed too.
+    """
+    def __init__(self, connection_string: str, compression_threshold: Optional[int] = None):
+        self.client = get_mongo_client(connection_string)
         self.db = self.client["AgentConvoDB"]
         self.collection = self.db["backup"]
+        self.compressor = MessageCompressor(self.db["compression_dictionary"], compression_threshold)
+        self.conversation_collection = self.db["conversation"]
+        self.checkpoint_collection = self.db["recovery_checkpoint"]
+        self.collection.create_index([("agent_name", ASCENDING), ("_id", ASCENDING)])
 
     def backup_conversations(self, conversations: Union[List[Conversation], Conversation]) -> None:
         """Backup a list of conversations."""
         # Assuming each conversation is a dictionary
         if isinstance(conversations, list):
-            self.collection.insert_many([conversation.to_dict() for conversation in conversations])
+            self.collection.insert_many([self._to_document(conversation) for conversation in conversations])
         else:
-            self.collection.insert_one(conversations.to_dict())
+            self.collection.insert_one(self._to_document(conversations))
+
+    def _to_document(self, conversation: Conversation) -> dict:
+        document = conversation.to_dict()
+        for message_doc in document["messages"]:
+            self.compressor.compress_document(message_doc, conversation.agent_name)
+        return document
 
     def get_conversations_by_agent_object(self, agent: Agent) -> List:
         """Fetch conversations linked with a specific agent from backup."""
@@ -242,3 +791,89 @@ class MongoBackupRepository(IBackupRepository):
     def delete_conversations_by_agent_object(self, agent: Agent) -> None:
         """Delete conversations linked with a specific agent from backup."""
         self.collection.delete_many({"agent_name": agent.name})
+
+    def move_conversations_by_agent_name(self, agent_name: str) -> Tuple[int, int]:
+        """
+        Move the conversations linked with a specific agent to the backup, server-side.
+
+        The documents are copied with an aggregation $merge, keyed on _id so that a retry replaces
+        the copies instead of duplicating them, then deleted from the conversation collection.
+        $merge can not run inside a transaction, so both steps are bounded by the highest _id seen
+        beforehand: a conversation created in between is neither copied nor deleted.
+        System messages holding a prompt_ref are copied with the agent's prompt as their content,
+        so that the backup still holds it once the agent is deleted.
+        """
+        last = self.conversation_collection.find_one(
+            {"agent_name": agent_name},
+            {"_id": 1},
+            sort=[("_id", DESCENDING)]
+        )
+        if last is None:
+            return 0, 0
+        match = {"agent_name": agent_name, "_id": {"$lte": last["_id"]}}
+        to_backup = self.conversation_collection.count_documents(match)
+        self.conversation_collection.aggregate([
+            {"$match": match},
+            {"$lookup": {"from": "agent", "localField": "agent_name", "foreignField": "name", "as": "agent"}},
+            {"$set": {"messages": {"$map": {
+                "input": "$messages",
+                "as": "message",
+                "in": {"$cond": [
+                    {"$eq": [{"$type": "$$message.prompt_ref"}, "object"]},
+                    {
+                        "role": "$$message.role",
+                        "content": {"$ifNull": [{"$arrayElemAt": ["$agent.system_prompt", 0]}, ""]}
+                    },
+                    "$$message"
+                ]}
+            }}}},
+            {"$project": {"agent": 0}},
+            {"$addFields": {"id": {"$toString": "$_id"}}},
+            {"$merge": {"into": "backup", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ])
+        deleted = self.conversation_collection.delete_many(match).deleted_count
+        return to_backup, deleted
+
+    def count_conversations_by_agent_name(self, agent_name: str) -> int:
+        return self.collection.count_documents({"agent_name": agent_name})
+
+    def get_backed_up_agent_names(self) -> List[str]:
+        return sorted(self.collection.distinct("agent_name"))
+
+    def iter_conversation_batches_by_agent_name(
+        self,
+        agent_name: str,
+        batch_size: int = 1000,
+        after_id: Optional[str] = None
+    ) -> Iterator[Tuple[List, str]]:
+        query = {"agent_name": agent_name}
+        if after_id:
+            query["_id"] = {"$gt": ObjectId(after_id)}
+        cursor = self.collection.find(query).sort("_id", ASCENDING).batch_size(batch_size)
+        try:
+            batch = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) == batch_size:
+                    yield batch, str(batch[-1]["_id"])
+                    batch = []
+            if batch:
+                yield batch, str(batch[-1]["_id"])
+        finally:
+            cursor.close()
+
+    def get_recovery_checkpoint(self, agent_name: str) -> Optional[Dict]:
+        document = self.checkpoint_collection.find_one({"_id": agent_name})
+        if document:
+            return {"last_id": document["last_id"], "recovered": document["recovered"]}
+        return None
+
+    def save_recovery_checkpoint(self, agent_name: str, last_id: Optional[str], recovered: int) -> None:
+        self.checkpoint_collection.replace_one(
+            {"_id": agent_name},
+            {"last_id": last_id, "recovered": recovered, "updated_at": _now()},
+            upsert=True
+        )
+
+    def delete_recovery_checkpoint(self, agent_name: str) -> None:
+        self.checkpoint_collection.delete_one({"_id": agent_name})
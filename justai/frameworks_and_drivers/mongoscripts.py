@@ -18,4 +18,6 @@ user_collection = db['user']  # User collection
 
 agent_collection.create_index("name", unique=True)
 conversation_collection.create_index("agent_name")
+conversation_collection.create_index([("agent_name", 1), ("tags", 1)])  # Multikey index for tag lookups
+conversation_collection.create_index([("agent_name", 1), ("label", 1)])  # Labelled conversations lookups
 user_collection.create_index("user_name", unique=True)  # Unique index for user_name
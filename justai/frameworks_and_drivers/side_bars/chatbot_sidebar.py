@@ -85,9 +85,7 @@ def chatbot_sidebar(
                 agents_fetch(agent_use_cases.get_all)
             )
 
-        agent_convos = conversation_use_cases.get_by_agent_name(st.session_state.agent)
-        user_convos = conversation_use_cases.search_in_conversations_by_tag(agent_convos, st.session_state.user)
-        labels = conversation_use_cases.extract_labels_from_conversations(user_convos)
+        labels = conversation_use_cases.get_labelled_conversations(st.session_state.agent, st.session_state.user)
         labels["New conversation"] = "New conversation"
         which_conversation_name = st.radio("Select a conversation", labels)
         which_conversation_id = labels[which_conversation_name]
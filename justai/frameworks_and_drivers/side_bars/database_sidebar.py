@@ -1,9 +1,17 @@
 import streamlit as st
 from typing import Union, Dict
 
+from justai.frameworks_and_drivers.cached_repositories import CachedAgentRepository, CachedUserRepository
+from justai.frameworks_and_drivers.memory_repositories import InMemoryAgentRepository, InMemoryBackupRepository
+from justai.frameworks_and_drivers.memory_repositories import InMemoryConversationRepository, InMemoryFeedbackRepository
+from justai.frameworks_and_drivers.memory_repositories import InMemoryUserRepository
+from justai.frameworks_and_drivers.mongo_client import mongo_client_registry
 from justai.frameworks_and_drivers.mongo_feedback_repository import MongoFeedbackRepository
 from justai.frameworks_and_drivers.mongo_repositories import MongoAgentRepository, MongoBackupRepository
 from justai.frameworks_and_drivers.mongo_repositories import MongoConversationRepository, MongoUserRepository
+from justai.frameworks_and_drivers.sqlite_repositories import SQLiteAgentRepository, SQLiteBackupRepository
+from justai.frameworks_and_drivers.sqlite_repositories import SQLiteConversationRepository, SQLiteFeedbackRepository
+from justai.frameworks_and_drivers.sqlite_repositories import SQLiteUserRepository
 from justai.interface_adapters.conversational_repository_interface import IAgentRepository, IBackupRepository
 from justai.interface_adapters.conversational_repository_interface import IConversationRepository, IUserRepository
 
@@ -14,25 +22,92 @@ REPOSITORIES = {
         'conversation': MongoConversationRepository,
         'backup': MongoBackupRepository,
         'feedback': MongoFeedbackRepository
+    },
+    'sqlite': {
+        'user': SQLiteUserRepository,
+        'agent': SQLiteAgentRepository,
+        'conversation': SQLiteConversationRepository,
+        'backup': SQLiteBackupRepository,
+        'feedback': SQLiteFeedbackRepository
+    },
+    'memory': {
+        'user': InMemoryUserRepository,
+        'agent': InMemoryAgentRepository,
+        'conversation': InMemoryConversationRepository,
+        'backup': InMemoryBackupRepository,
+        'feedback': InMemoryFeedbackRepository
     }
 }
 
 SUCCESS_CONDITIONS = {
-    'mongodb': lambda x: x.startswith("mongodb+srv")
+    'mongodb': lambda x: x.startswith("mongodb+srv"),
+    'sqlite': lambda x: x.startswith("sqlite:///"),
+    'memory': lambda x: bool(x)
 }
 
+# Database types usable without a secret, connected to the default link unless one is configured.
+# The in-memory data lives as long as the Streamlit server process, the SQLite database is a local file
+DEFAULT_CONNECTION_LINKS = {
+    'sqlite': "sqlite:///data/justai.sqlite3",
+    'memory': "memory://default"
+}
+
+# Optional overrides of the shared MongoClient settings (pool size, timeouts...), read from the secrets
+CLIENT_OPTIONS_SECRET_KEYS = {
+    'mongodb': "MONGODB_CLIENT_OPTIONS"
+}
 
+# Keyword arguments passed to the repositories of a database type, by repository key
+REPOSITORY_OPTIONS = {
+    'mongodb': {
+        'conversation': {'lazy_decoding': True}
+    }
+}
+
+# Keyword arguments of the repositories read from the secrets when set, by database type, repository key and argument
+REPOSITORY_OPTION_SECRET_KEYS = {
+    'mongodb': {
+        'conversation': {'compression_threshold': "MONGODB_COMPRESSION_THRESHOLD"},
+        'backup': {'compression_threshold': "MONGODB_COMPRESSION_THRESHOLD"}
+    }
+}
+
+# Read-through caches wrapped around the repositories of rarely modified, frequently read entities
+CACHED_REPOSITORIES = {
+    'user': CachedUserRepository,
+    'agent': CachedAgentRepository
+}
+
+
+@st.cache_resource(show_spinner=False)
 def init_repositories(
     database_type,
     connection_link
 ) -> Dict[str, Union[IUserRepository, IAgentRepository, IConversationRepository, IBackupRepository]]:
+    '''
+    Builds the repositories of a database type.
+    Cached as a resource: every session connected to the same database shares the same repositories,
+    which in turn share a single pooled client per connection link.
+    '''
     repo_classes = REPOSITORIES.get(database_type)
     if not repo_classes:
         raise ValueError(f"Unsupported database type: {database_type}")
 
+    options_key = CLIENT_OPTIONS_SECRET_KEYS.get(database_type)
+    if options_key and options_key in st.secrets:
+        mongo_client_registry.configure(**st.secrets[options_key])
+
+    repo_options = REPOSITORY_OPTIONS.get(database_type, {})
+    repo_secret_keys = REPOSITORY_OPTION_SECRET_KEYS.get(database_type, {})
     repos = {}
     for repo_key, repo_class in repo_classes.items():
-        repos[repo_key] = repo_class(connection_link)
+        options = dict(repo_options.get(repo_key, {}))
+        for argument, secret_key in repo_secret_keys.get(repo_key, {}).items():
+            if secret_key in st.secrets:
+                options[argument] = st.secrets[secret_key]
+        repos[repo_key] = repo_class(connection_link, **options)
+        if repo_key in CACHED_REPOSITORIES:
+            repos[repo_key] = CACHED_REPOSITORIES[repo_key](repos[repo_key])
     return repos
 
 
@@ -52,11 +127,11 @@ def database_sidebar() -> Union[Dict[str, Union[IAgentRepository, IConversationR
                     st.session_state.update_connection = True
                 return st.session_state.repos
 
-            db_type = st.selectbox('Select Database', ['mongodb', '...others'])
+            db_type = st.selectbox('Select Database', list(REPOSITORIES))
             secret_key = f"{db_type.upper()}_SRV"
 
-            if secret_key in st.secrets:
-                connection_link = st.secrets[secret_key]
+            if secret_key in st.secrets or db_type in DEFAULT_CONNECTION_LINKS:
+                connection_link = st.secrets.get(secret_key) or DEFAULT_CONNECTION_LINKS[db_type]
                 try:
                     repos = init_repositories(db_type, connection_link)
                     st.success(f'{db_type.capitalize()} repositories initialized!', icon='✅')
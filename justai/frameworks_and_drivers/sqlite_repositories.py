@@ -0,0 +1,791 @@
+import datetime
+import itertools
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from bson import ObjectId
+from justai.application.exceptions import DuplicateError, NotFoundError
+from justai.entities.agent import Agent
+from justai.entities.conversation import Conversation, ConversationHeader, Message
+from justai.entities.conversation_batch import ConversationBatch, ConversationBatchBuilder
+from justai.entities.feedback import Feedback, FeedbackTag
+from justai.entities.token_count import TokenCount
+from justai.entities.user import User
+from justai.interface_adapters.conversational_repository_interface import IAgentRepository, IUserRepository
+from justai.interface_adapters.conversational_repository_interface import IBackupRepository
+from justai.interface_adapters.conversational_repository_interface import IConversationRepository
+from justai.interface_adapters.feedback_repository_interface import IFeedbackRepository
+
+URI_PREFIX = "sqlite:///"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user (
+    user_name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS agent (
+    name TEXT PRIMARY KEY,
+    system_prompt TEXT NOT NULL,
+    dataset_generation_prompts TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS conversation (
+    id TEXT PRIMARY KEY,
+    agent_name TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT '[]',
+    label TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversation_agent_name ON conversation (agent_name, id);
+CREATE TABLE IF NOT EXISTS conversation_tag (
+    conversation_id TEXT NOT NULL REFERENCES conversation (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversation_tag_tag ON conversation_tag (tag, conversation_id);
+CREATE TABLE IF NOT EXISTS message (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL REFERENCES conversation (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (conversation_id, position)
+);
+CREATE TABLE IF NOT EXISTS conversation_token_count (
+    conversation_id TEXT NOT NULL REFERENCES conversation (id) ON DELETE CASCADE,
+    encoding TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    assistant INTEGER NOT NULL,
+    messages TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, encoding)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5 (content, content='message', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+    INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+    INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+    INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO message_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TABLE IF NOT EXISTS backup (
+    id TEXT PRIMARY KEY,
+    agent_name TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backup_agent_name ON backup (agent_name, id);
+CREATE TABLE IF NOT EXISTS recovery_checkpoint (
+    agent_name TEXT PRIMARY KEY,
+    last_id TEXT,
+    recovered INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT,
+    user_name TEXT,
+    content TEXT,
+    tags TEXT NOT NULL DEFAULT '[]',
+    rating INTEGER,
+    created_at TEXT
+);
+"""
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _message_to_row(message: Union[Message, dict]) -> Tuple[str, str]:
+    if isinstance(message, Message):
+        return message.role, message.content
+    return message["role"], message["content"]
+
+
+class SQLiteDatabase:
+    """
+    One SQLite database file, shared by the repositories built with the same connection link.
+
+    sqlite3 connections can not be shared between threads, so every thread gets its own connection,
+    opened on first use. The database runs in WAL mode: readers never block the writer, and the
+    statements, always parameterized, are prepared once per connection by the sqlite3 statement cache.
+
+    Methods:
+    - connection() -> sqlite3.Connection: Return the connection of the calling thread.
+    - transaction() -> ContextManager[sqlite3.Connection]: Run statements in a single transaction.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_created = False
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, cached_statements=256)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.execute("PRAGMA busy_timeout = 10000")
+            with self._schema_lock:
+                if not self._schema_created:
+                    connection.executescript(SCHEMA)
+                    self._schema_created = True
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        with connection:
+            yield connection
+
+
+_databases: Dict[str, SQLiteDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def get_sqlite_database(uri: str) -> SQLiteDatabase:
+    """Return the process-wide database for a connection link, either 'sqlite:///<path>' or a plain path."""
+    path = uri[len(URI_PREFIX):] if uri.startswith(URI_PREFIX) else uri
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = SQLiteDatabase(path)
+        return _databases[path]
+
+
+class SQLiteUserRepository(IUserRepository):
+    def __init__(self, uri: str):
+        self.database = get_sqlite_database(uri)
+
+    def get_by_name(self, user_name: str) -> Optional[User]:
+        row = self.database.connection().execute(
+            "SELECT user_name FROM user WHERE user_name = ?", (user_name,)
+        ).fetchone()
+        return User(row[0]) if row else None
+
+    def create(self, user: User) -> None:
+        try:
+            with self.database.transaction() as connection:
+                connection.execute("INSERT INTO user (user_name) VALUES (?)", (user.user_name,))
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"User with the name {user.user_name} already exists.")
+
+    def update(self, current_user: User, updated_user: User) -> None:
+        try:
+            with self.database.transaction() as connection:
+                cursor = connection.execute(
+                    "UPDATE user SET user_name = ? WHERE user_name = ?",
+                    (updated_user.user_name, current_user.user_name)
+                )
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"User with the name {updated_user.user_name} already exists.")
+        if cursor.rowcount == 0:
+            raise NotFoundError(f"User with the name {current_user.user_name} not found.")
+
+    def delete(self, user: User) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM user WHERE user_name = ?", (user.user_name,))
+
+    def get_all(self) -> List[User]:
+        rows = self.database.connection().execute("SELECT user_name FROM user ORDER BY rowid")
+        return [User(row[0]) for row in rows]
+
+    def exists(self, user_name: str) -> bool:
+        return self.database.connection().execute(
+            "SELECT 1 FROM user WHERE user_name = ?", (user_name,)
+        ).fetchone() is not None
+
+    def count(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM user").fetchone()[0]
+
+
+class SQLiteAgentRepository(IAgentRepository):
+    def __init__(self, uri: str):
+        self.database = get_sqlite_database(uri)
+
+    @staticmethod
+    def _to_agent(row) -> Agent:
+        return Agent(row[0], row[1], json.loads(row[2]))
+
+    def get_by_name(self, agent_name: str) -> Optional[Agent]:
+        row = self.database.connection().execute(
+            "SELECT name, system_prompt, dataset_generation_prompts FROM agent WHERE name = ?", (agent_name,)
+        ).fetchone()
+        return self._to_agent(row) if row else None
+
+    def create(self, agent: Agent) -> None:
+        try:
+            with self.database.transaction() as connection:
+                connection.execute(
+                    "INSERT INTO agent (name, system_prompt, dataset_generation_prompts) VALUES (?, ?, ?)",
+                    (agent.name, agent.system_prompt, json.dumps(agent.dataset_generation_prompts))
+                )
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"Agent with the name {agent.name} already exists.")
+
+    def update(self, current_agent: Agent, updated_agent: Agent) -> None:
+        try:
+            with self.database.transaction() as connection:
+                cursor = connection.execute(
+                    "UPDATE agent SET name = ?, system_prompt = ?, dataset_generation_prompts = ? WHERE name = ?",
+                    (
+                        updated_agent.name,
+                        updated_agent.system_prompt,
+                        json.dumps(updated_agent.dataset_generation_prompts),
+                        current_agent.name
+                    )
+                )
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"Agent with the name {updated_agent.name} already exists.")
+        if cursor.rowcount == 0:
+            raise NotFoundError(f"Agent with the name {current_agent.name} not found.")
+
+    def delete(self, agent: Agent) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM agent WHERE name = ?", (agent.name,))
+
+    def get_all(self) -> List[Agent]:
+        rows = self.database.connection().execute(
+            "SELECT name, system_prompt, dataset_generation_prompts FROM agent ORDER BY rowid"
+        )
+        return [self._to_agent(row) for row in rows]
+
+    def exists(self, agent_name: str) -> bool:
+        return self.database.connection().execute(
+            "SELECT 1 FROM agent WHERE name = ?", (agent_name,)
+        ).fetchone() is not None
+
+    def count(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM agent").fetchone()[0]
+
+
+class SQLiteConversationRepository(IConversationRepository):
+    """
+    Conversations are split over three tables: `conversation` holds one row per conversation,
+    `message` one row per message keyed by (conversation_id, position), and `conversation_tag`
+    indexes the tags. Message contents are indexed for full-text search by the `message_fts` FTS5 table,
+    kept up to date by triggers. `conversation_token_count` holds the token counts of a conversation,
+    one row per encoding, with the counts of the messages as a JSON array.
+    """
+    def __init__(self, uri: str):
+        self.database = get_sqlite_database(uri)
+
+    def _select_rows(self, where: str, parameters: tuple, suffix: str = "") -> Iterator[tuple]:
+        # One ordered join streams the conversations with their messages, grouped back by the callers
+        rows = self.database.connection().execute(
+            "SELECT c.id, c.agent_name, c.tags, m.role, m.content FROM "
+            f"(SELECT id, agent_name, tags FROM conversation WHERE {where} ORDER BY id {suffix}) AS c "
+            "LEFT JOIN message AS m ON m.conversation_id = c.id ORDER BY c.id, m.position",
+            parameters
+        )
+        return itertools.groupby(rows, key=lambda row: row[:3])
+
+    def _select_conversations(self, where: str, parameters: tuple, suffix: str = "") -> Iterator[Conversation]:
+        for (id, agent_name, tags), group in self._select_rows(where, parameters, suffix):
+            messages = [Message(row[3], row[4]) for row in group if row[3] is not None]
+            yield Conversation(agent_name, messages, id, json.loads(tags))
+
+    @staticmethod
+    def _insert_token_counts(
+        connection: sqlite3.Connection,
+        conversation_id: str,
+        token_counts: Optional[Dict[str, TokenCount]]
+    ) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO conversation_token_count (conversation_id, encoding, total, assistant, messages) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (conversation_id, encoding, count.total, count.assistant, json.dumps(count.messages))
+                for encoding, count in (token_counts or {}).items()
+            ]
+        )
+
+    @staticmethod
+    def _delete_token_counts(connection: sqlite3.Connection, conversation_id: str) -> None:
+        connection.execute("DELETE FROM conversation_token_count WHERE conversation_id = ?", (conversation_id,))
+
+    @classmethod
+    def _insert(
+        cls,
+        connection: sqlite3.Connection,
+        id: str,
+        agent_name: str,
+        messages: List,
+        tags: List[str],
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        connection.execute(
+            "INSERT INTO conversation (id, agent_name, tags, label, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (id, agent_name, json.dumps(tags), Conversation(agent_name, [], tags=tags).label, _now())
+        )
+        connection.executemany(
+            "INSERT INTO conversation_tag (conversation_id, tag) VALUES (?, ?)",
+            [(id, tag) for tag in set(tags)]
+        )
+        connection.executemany(
+            "INSERT INTO message (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+            [(id, position, *_message_to_row(message)) for position, message in enumerate(messages)]
+        )
+        cls._insert_token_counts(connection, id, token_counts)
+
+    @staticmethod
+    def _touch(connection: sqlite3.Connection, conversation_id: str) -> int:
+        return connection.execute(
+            "UPDATE conversation SET updated_at = ? WHERE id = ?", (_now(), conversation_id)
+        ).rowcount
+
+    def create(self, conversation: Conversation, token_counts: Optional[Dict[str, TokenCount]] = None) -> None:
+        id = conversation.id or str(ObjectId())
+        try:
+            with self.database.transaction() as connection:
+                self._insert(
+                    connection,
+                    id,
+                    conversation.agent_name,
+                    conversation.messages,
+                    list(conversation.tags),
+                    token_counts
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Conversation with id {conversation.id} already exists.")
+
+    def get_by_agent_name(self, agent_name: str) -> List[Conversation]:
+        return list(self.iter_by_agent_name(agent_name))
+
+    def get_by_id(self, conversation_id: str) -> Conversation:
+        conversation = next(self._select_conversations("id = ?", (conversation_id,)), None)
+        if conversation is None:
+            raise ValueError(f"Conversation with id {conversation_id} does not exist.")
+        return conversation
+
+    def get_by_agent_name_and_tag(self, agent_name: str, tag: str) -> List[Conversation]:
+        where = "agent_name = ? AND id IN (SELECT conversation_id FROM conversation_tag WHERE tag = ?)"
+        return list(self._select_conversations(where, (agent_name, tag)))
+
+    _LABELLED = (
+        "agent_name = ? AND label IS NOT NULL "
+        "AND id IN (SELECT conversation_id FROM conversation_tag WHERE tag = ?)"
+    )
+
+    def get_labelled_by_agent_name_and_user(self, agent_name: str, user_name: str) -> List[Conversation]:
+        return list(self._select_conversations(self._LABELLED, (agent_name, user_name)))
+
+    def _select_headers(self, where: str, parameters: tuple) -> Iterator[ConversationHeader]:
+        rows = self.database.connection().execute(
+            "SELECT id, agent_name, tags, updated_at, "
+            "(SELECT count(*) FROM message WHERE conversation_id = conversation.id) "
+            f"FROM conversation WHERE {where} ORDER BY id",
+            parameters
+        )
+        for id, agent, tags, updated_at, message_count in rows:
+            yield ConversationHeader(
+                id, agent, json.loads(tags), message_count, datetime.datetime.fromisoformat(updated_at)
+            )
+
+    def get_labelled_headers_by_agent_name_and_user(
+        self,
+        agent_name: str,
+        user_name: str
+    ) -> List[ConversationHeader]:
+        return list(self._select_headers(self._LABELLED, (agent_name, user_name)))
+
+    def iter_headers_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[ConversationHeader]:
+        return self._select_headers("agent_name = ?", (agent_name,))
+
+    def get_by_ids(self, conversation_ids: List[str]) -> List[Conversation]:
+        ids = sorted(set(conversation_ids))
+        conversations = []
+        # Chunked to stay below the limit on the number of parameters of a statement
+        for start in range(0, len(ids), 500):
+            chunk = tuple(ids[start:start + 500])
+            conversations.extend(self._select_conversations(f"id IN ({', '.join('?' * len(chunk))})", chunk))
+        return conversations
+
+    def update_agent_field(self, current_agent: Agent, updated_agent: Agent) -> None:
+        with self.database.transaction() as connection:
+            connection.execute(
+                "UPDATE message SET content = ? WHERE role = 'system' "
+                "AND conversation_id IN (SELECT id FROM conversation WHERE agent_name = ?)",
+                (updated_agent.system_prompt, current_agent.name)
+            )
+            if updated_agent.system_prompt != current_agent.system_prompt:
+                connection.execute(
+                    "DELETE FROM conversation_token_count "
+                    "WHERE conversation_id IN (SELECT id FROM conversation WHERE agent_name = ?)",
+                    (current_agent.name,)
+                )
+            connection.execute(
+                "UPDATE conversation SET agent_name = ? WHERE agent_name = ?",
+                (updated_agent.name, current_agent.name)
+            )
+
+    def update(
+        self,
+        current_conversation: Conversation,
+        updated_conversation: Conversation,
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        tags = list(updated_conversation.tags)
+        with self.database.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE conversation SET agent_name = ?, tags = ?, label = ?, updated_at = ? WHERE id = ?",
+                (
+                    updated_conversation.agent_name,
+                    json.dumps(tags),
+                    updated_conversation.label,
+                    _now(),
+                    current_conversation.id
+                )
+            )
+            if cursor.rowcount == 0:
+                return
+            connection.execute("DELETE FROM conversation_tag WHERE conversation_id = ?", (current_conversation.id,))
+            connection.executemany(
+                "INSERT INTO conversation_tag (conversation_id, tag) VALUES (?, ?)",
+                [(current_conversation.id, tag) for tag in set(tags)]
+            )
+            connection.execute("DELETE FROM message WHERE conversation_id = ?", (current_conversation.id,))
+            connection.executemany(
+                "INSERT INTO message (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+                [
+                    (current_conversation.id, position, *_message_to_row(message))
+                    for position, message in enumerate(updated_conversation.messages)
+                ]
+            )
+            self._delete_token_counts(connection, current_conversation.id)
+            self._insert_token_counts(connection, current_conversation.id, token_counts)
+
+    def append_messages(
+        self,
+        conversation_id: str,
+        messages: List[Message],
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        with self.database.transaction() as connection:
+            if not self._touch(connection, conversation_id):
+                raise ValueError(f"Conversation with id {conversation_id} does not exist.")
+            start = connection.execute(
+                "SELECT coalesce(max(position) + 1, 0) FROM message WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()[0]
+            connection.executemany(
+                "INSERT INTO message (conversation_id, position, role, content) VALUES (?, ?, ?, ?)",
+                [
+                    (conversation_id, start + offset, *_message_to_row(message))
+                    for offset, message in enumerate(messages)
+                ]
+            )
+            stored = {
+                encoding: TokenCount(encoding, json.loads(message_counts), total, assistant)
+                for encoding, total, assistant, message_counts in connection.execute(
+                    "SELECT encoding, total, assistant, messages FROM conversation_token_count "
+                    "WHERE conversation_id = ?",
+                    (conversation_id,)
+                )
+            }
+            self._delete_token_counts(connection, conversation_id)
+            if token_counts and stored.keys() == token_counts.keys():
+                self._insert_token_counts(connection, conversation_id, {
+                    encoding: stored[encoding].extended(count) for encoding, count in token_counts.items()
+                })
+
+    def replace_message_at(self, conversation_id: str, index: int, message: Message) -> None:
+        with self.database.transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE message SET role = ?, content = ? WHERE conversation_id = ? AND position = ?",
+                (*_message_to_row(message), conversation_id, index)
+            )
+            if not cursor.rowcount:
+                raise ValueError(f"Conversation with id {conversation_id} has no message at index {index}.")
+            self._touch(connection, conversation_id)
+            self._delete_token_counts(connection, conversation_id)
+
+    def truncate_after(self, conversation_id: str, index: int) -> None:
+        with self.database.transaction() as connection:
+            if not self._touch(connection, conversation_id):
+                raise ValueError(f"Conversation with id {conversation_id} does not exist.")
+            connection.execute(
+                "DELETE FROM message WHERE conversation_id = ? AND position > ?", (conversation_id, index)
+            )
+            self._delete_token_counts(connection, conversation_id)
+
+    def delete_by_agent_name(self, agent_name: str) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM conversation WHERE agent_name = ?", (agent_name,))
+
+    def delete_by_agent_object(self, agent: Agent) -> None:
+        self.delete_by_agent_name(agent.name)
+
+    def delete_by_id(self, conversation_id: str) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM conversation WHERE id = ?", (conversation_id,))
+
+    def recover(self, conversations: List) -> int:
+        recovered = 0
+        with self.database.transaction() as connection:
+            for document in conversations:
+                id = str(document["_id"])
+                # Conversations inserted by an interrupted recovery are skipped
+                if connection.execute("SELECT 1 FROM conversation WHERE id = ?", (id,)).fetchone():
+                    continue
+                self._insert(connection, id, document["agent_name"], document["messages"], document.get("tags") or [])
+                recovered += 1
+        return recovered
+
+    def get_all(self) -> List[Conversation]:
+        return list(self.iter_all())
+
+    def iter_all(self, batch_size: int = 500) -> Iterator[Conversation]:
+        return self._select_conversations("1", ())
+
+    def iter_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[Conversation]:
+        return self._select_conversations("agent_name = ?", (agent_name,))
+
+    def get_batch_by_agent_name(self, agent_name: str, batch_size: int = 500) -> ConversationBatch:
+        builder = ConversationBatchBuilder()
+        for (id, agent_name, tags), group in self._select_rows("agent_name = ?", (agent_name,)):
+            builder.add(id, agent_name, json.loads(tags), (row[3:] for row in group if row[3] is not None))
+        return builder.build()
+
+    def get_page(
+        self,
+        after_id: Optional[str] = None,
+        limit: int = 50,
+        agent_name: Optional[str] = None
+    ) -> List[Conversation]:
+        conditions, parameters = ["1"], []
+        if agent_name is not None:
+            conditions.append("agent_name = ?")
+            parameters.append(agent_name)
+        if after_id:
+            conditions.append("id > ?")
+            parameters.append(after_id)
+        parameters.append(limit)
+        return list(self._select_conversations(" AND ".join(conditions), tuple(parameters), "LIMIT ?"))
+
+    def exists_by_agent_name(self, agent_name: str) -> bool:
+        return self.database.connection().execute(
+            "SELECT 1 FROM conversation WHERE agent_name = ? LIMIT 1", (agent_name,)
+        ).fetchone() is not None
+
+    def count_by_agent_name(self, agent_name: str) -> int:
+        return self.database.connection().execute(
+            "SELECT count(*) FROM conversation WHERE agent_name = ?", (agent_name,)
+        ).fetchone()[0]
+
+    def count(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM conversation").fetchone()[0]
+
+    def search_by_content(self, text: str, agent_name: Optional[str] = None, limit: int = 50) -> List[Conversation]:
+        # The text is searched as a single FTS5 phrase, so that its punctuation is not parsed as query syntax
+        where = (
+            "id IN (SELECT m.conversation_id FROM message_fts JOIN message AS m ON m.id = message_fts.rowid "
+            "WHERE message_fts MATCH ?)"
+        )
+        parameters = ['"' + text.replace('"', '""') + '"']
+        if agent_name is not None:
+            where += " AND agent_name = ?"
+            parameters.append(agent_name)
+        parameters.append(limit)
+        return list(self._select_conversations(where, tuple(parameters), "LIMIT ?"))
+
+    def iter_headers_without_token_counts(
+        self,
+        encoding: str,
+        agent_name: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Iterator[ConversationHeader]:
+        where = (
+            "NOT EXISTS (SELECT 1 FROM conversation_token_count "
+            "WHERE conversation_id = conversation.id AND encoding = ?)"
+        )
+        parameters = (encoding,)
+        if agent_name is not None:
+            where += " AND agent_name = ?"
+            parameters += (agent_name,)
+        return self._select_headers(where, parameters)
+
+    def set_token_counts(
+        self,
+        conversation_id: str,
+        token_counts: Dict[str, TokenCount],
+        last_modified: Optional[datetime.datetime]
+    ) -> bool:
+        with self.database.transaction() as connection:
+            query, parameters = "SELECT 1 FROM conversation WHERE id = ?", (conversation_id,)
+            if last_modified is not None:
+                query, parameters = query + " AND updated_at = ?", parameters + (last_modified.isoformat(),)
+            if connection.execute(query, parameters).fetchone() is None:
+                return False
+            self._insert_token_counts(connection, conversation_id, token_counts)
+            return True
+
+    def get_token_statistics(self, agent_name: str, encoding: str, max_tokens: int) -> Dict[str, int]:
+        row = self.database.connection().execute(
+            "SELECT count(*), count(t.total), coalesce(sum(t.total), 0), coalesce(sum(t.assistant), 0), "
+            "coalesce(sum(min(t.total, ?)), 0), coalesce(sum(t.total > ?), 0) "
+            "FROM conversation AS c LEFT JOIN conversation_token_count AS t "
+            "ON t.conversation_id = c.id AND t.encoding = ? WHERE c.agent_name = ?",
+            (max_tokens, max_tokens, encoding, agent_name)
+        ).fetchone()
+        keys = ("conversations", "counted", "total_tokens", "assistant_tokens", "billing_tokens", "over_limit")
+        return dict(zip(keys, row))
+
+
+class SQLiteBackupRepository(IBackupRepository):
+    """Backed up conversations are stored as JSON documents, shaped like the MongoDB backup."""
+    def __init__(self, uri: str):
+        self.database = get_sqlite_database(uri)
+
+    def backup_conversations(self, conversations: Union[List[Conversation], Conversation]) -> None:
+        """Backup a list of conversations."""
+        if not isinstance(conversations, list):
+            conversations = [conversations]
+        rows = []
+        for conversation in conversations:
+            document = conversation.to_dict()
+            document["_id"] = conversation.id or str(ObjectId())
+            rows.append((document["_id"], conversation.agent_name, json.dumps(document)))
+        with self.database.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO backup (id, agent_name, document) VALUES (?, ?, ?)", rows)
+
+    def get_conversations_by_agent_object(self, agent: Agent) -> List:
+        """Fetch conversations linked with a specific agent from backup."""
+        rows = self.database.connection().execute(
+            "SELECT document FROM backup WHERE agent_name = ? ORDER BY id", (agent.name,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def delete_conversations_by_agent_object(self, agent: Agent) -> None:
+        """Delete conversations linked with a specific agent from backup."""
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM backup WHERE agent_name = ?", (agent.name,))
+
+    def move_conversations_by_agent_name(self, agent_name: str) -> Tuple[int, int]:
+        """Move the conversations linked with a specific agent to the backup, in a single transaction."""
+        with self.database.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO backup (id, agent_name, document) "
+                "SELECT c.id, c.agent_name, json_object("
+                "'_id', c.id, 'id', c.id, 'agent_name', c.agent_name, 'tags', json(c.tags), 'messages', "
+                "(SELECT coalesce(json_group_array(json_object('role', m.role, 'content', m.content)), json('[]')) "
+                "FROM (SELECT role, content FROM message WHERE conversation_id = c.id ORDER BY position) AS m)) "
+                "FROM conversation AS c WHERE c.agent_name = ?",
+                (agent_name,)
+            )
+            deleted = connection.execute("DELETE FROM conversation WHERE agent_name = ?", (agent_name,)).rowcount
+        return deleted, deleted
+
+    def count_conversations_by_agent_name(self, agent_name: str) -> int:
+        return self.database.connection().execute(
+            "SELECT count(*) FROM backup WHERE agent_name = ?", (agent_name,)
+        ).fetchone()[0]
+
+    def get_backed_up_agent_names(self) -> List[str]:
+        rows = self.database.connection().execute("SELECT DISTINCT agent_name FROM backup ORDER BY agent_name")
+        return [row[0] for row in rows]
+
+    def iter_conversation_batches_by_agent_name(
+        self,
+        agent_name: str,
+        batch_size: int = 1000,
+        after_id: Optional[str] = None
+    ) -> Iterator[Tuple[List, str]]:
+        while True:
+            rows = self.database.connection().execute(
+                "SELECT id, document FROM backup WHERE agent_name = ? AND id > ? ORDER BY id LIMIT ?",
+                (agent_name, after_id or "", batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield [json.loads(row[1]) for row in rows], after_id
+
+    def get_recovery_checkpoint(self, agent_name: str) -> Optional[Dict]:
+        row = self.database.connection().execute(
+            "SELECT last_id, recovered FROM recovery_checkpoint WHERE agent_name = ?", (agent_name,)
+        ).fetchone()
+        return {"last_id": row[0], "recovered": row[1]} if row else None
+
+    def save_recovery_checkpoint(self, agent_name: str, last_id: Optional[str], recovered: int) -> None:
+        with self.database.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO recovery_checkpoint (agent_name, last_id, recovered, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (agent_name, last_id, recovered, _now())
+            )
+
+    def delete_recovery_checkpoint(self, agent_name: str) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM recovery_checkpoint WHERE agent_name = ?", (agent_name,))
+
+
+class SQLiteFeedbackRepository(IFeedbackRepository):
+    def __init__(self, uri: str):
+        self.database = get_sqlite_database(uri)
+
+    _COLUMNS = "id, label, user_name, content, tags, rating, created_at"
+
+    @staticmethod
+    def _to_feedback(row) -> Feedback:
+        return Feedback(
+            label=row[1],
+            user_name=row[2],
+            content=row[3],
+            tags=[FeedbackTag(tag) for tag in json.loads(row[4])],
+            rating=row[5],
+            created_at=row[6],
+            id=row[0]
+        )
+
+    @staticmethod
+    def _to_row(feedback: Feedback) -> tuple:
+        document = feedback.serialize()
+        return (
+            document["label"],
+            document["user_name"],
+            document["content"],
+            json.dumps(document["tags"]),
+            document["rating"],
+            document["created_at"]
+        )
+
+    def create(self, feedback: Feedback) -> None:
+        try:
+            with self.database.transaction() as connection:
+                cursor = connection.execute(
+                    f"INSERT INTO feedback ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (feedback.id, *self._to_row(feedback))
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Feedback with id {feedback.id} already exists.")
+        feedback.id = cursor.lastrowid
+
+    def get_by_id(self, feedback_id: int) -> Optional[Feedback]:
+        row = self.database.connection().execute(
+            f"SELECT {self._COLUMNS} FROM feedback WHERE id = ?", (feedback_id,)
+        ).fetchone()
+        return self._to_feedback(row) if row else None
+
+    def update(self, current_feedback: Feedback, updated_feedback: Feedback) -> None:
+        with self.database.transaction() as connection:
+            connection.execute(
+                "UPDATE feedback SET label = ?, user_name = ?, content = ?, tags = ?, rating = ?, created_at = ? "
+                "WHERE id = ?",
+                (*self._to_row(updated_feedback), current_feedback.id)
+            )
+
+    def delete(self, feedback: Feedback) -> None:
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM feedback WHERE id = ?", (feedback.id,))
+
+    def get_all(self) -> List[Feedback]:
+        rows = self.database.connection().execute(f"SELECT {self._COLUMNS} FROM feedback ORDER BY id")
+        return [self._to_feedback(row) for row in rows]
+
+    def count(self) -> int:
+        return self.database.connection().execute("SELECT count(*) FROM feedback").fetchone()[0]
@@ -1,7 +1,10 @@
+import datetime
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from justai.entities.agent import Agent
-from justai.entities.conversation import Conversation
+from justai.entities.conversation import Conversation, ConversationHeader, Message
+from justai.entities.conversation_batch import ConversationBatch
+from justai.entities.token_count import TokenCount
 from justai.entities.user import User
 
 
@@ -15,6 +18,8 @@ class IUserRepository(ABC):
     - update(current_user: User, updated_user: User) -> None: Update an existing user.
     - delete(user: User) -> None: Delete a user.
     - get_all() -> List[User]: Fetch all users.
+    - exists(user_name: str) -> bool: Check whether a user exists without fetching it.
+    - count() -> int: Count the users.
 
     Implementing classes should ensure these methods are provided with appropriate
     storage-level logic to handle user data.
@@ -27,12 +32,15 @@ class IUserRepository(ABC):
 
     @abstractmethod
     def create(self, user: User) -> None:
-        """Create a new user."""
+        """Create a new user. Raises DuplicateError if the name is already taken."""
         pass
 
     @abstractmethod
     def update(self, current_user: User, updated_user: User) -> None:
-        """Update an existing user."""
+        """
+        Update an existing user.
+        Raises DuplicateError if the new name is already taken, NotFoundError if the user does not exist.
+        """
         pass
 
     @abstractmethod
@@ -45,6 +53,16 @@ class IUserRepository(ABC):
         """Fetch all users."""
         pass
 
+    @abstractmethod
+    def exists(self, user_name: str) -> bool:
+        """Check whether a user exists, without fetching it."""
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        """Count the users."""
+        pass
+
 
 class IAgentRepository(ABC):
     """
@@ -56,6 +74,8 @@ class IAgentRepository(ABC):
     - update(current_agent: Agent, updated_agent: Agent) -> None: Update an existing agent.
     - delete(agent: Agent) -> None: Delete an agent.
     - get_all() -> List[Agent]: Fetch all agents.
+    - exists(agent_name: str) -> bool: Check whether an agent exists without fetching it.
+    - count() -> int: Count the agents.
 
     Implementing classes should ensure these methods are provided with appropriate
     storage-level logic to handle agent data.
@@ -68,12 +88,15 @@ class IAgentRepository(ABC):
 
     @abstractmethod
     def create(self, agent: Agent) -> None:
-        """Create a new agent."""
+        """Create a new agent. Raises DuplicateError if the name is already taken."""
         pass
 
     @abstractmethod
     def update(self, current_agent: Agent, updated_agent: Agent) -> None:
-        """Update an existing agent."""
+        """
+        Update an existing agent.
+        Raises DuplicateError if the new name is already taken, NotFoundError if the agent does not exist.
+        """
         pass
 
     @abstractmethod
@@ -86,29 +109,79 @@ class IAgentRepository(ABC):
         """Fetch all agents."""
         pass
 
+    @abstractmethod
+    def exists(self, agent_name: str) -> bool:
+        """Check whether an agent exists, without fetching it."""
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        """Count the agents."""
+        pass
+
 
 class IConversationRepository(ABC):
     """
     An interface for managing conversations in the storage layer.
 
     Methods:
-    - create(conversation: Conversation) -> None: Create a new conversation.
+    - create(conversation: Conversation, token_counts: Optional[Dict[str, TokenCount]]) -> None:
+        Create a new conversation, storing the token counts of its messages alongside if given.
     - get_by_agent_name(agent_name: str) -> List[Conversation]:
         Fetch conversations linked with a specific agent by name.
     - get_by_id(conversation_id: str) -> Conversation: Fetch a conversation by its ID.
+    - get_by_agent_name_and_tag(agent_name: str, tag: str) -> List[Conversation]:
+        Fetch conversations linked with a specific agent and carrying a specific tag.
+    - get_labelled_by_agent_name_and_user(agent_name: str, user_name: str) -> List[Conversation]:
+        Fetch the labelled conversations of a user for a specific agent.
+    - get_labelled_headers_by_agent_name_and_user(agent_name: str, user_name: str) -> List[ConversationHeader]:
+        Same as above but only fetch the headers of the conversations, never their messages.
     - update_agent_field(current_agent: Agent, updated_agent: Agent) -> None:
         Update agent details in linked conversations.
+    - update(current_conversation: Conversation, updated_conversation: Conversation,
+        token_counts: Optional[Dict[str, TokenCount]]) -> None: Rewrite a conversation and its token counts.
+    - append_messages(conversation_id: str, messages: List[Message]) -> None:
+        Append messages at the end of a conversation without rewriting the existing ones.
+    - replace_message_at(conversation_id: str, index: int, message: Message) -> None:
+        Replace the message at a specific position of a conversation.
+    - truncate_after(conversation_id: str, index: int) -> None:
+        Remove every message of a conversation after a specific position.
     - delete_by_agent_name(agent_name: str) -> None: Delete conversations linked with a specific agent by name.
     - delete_by_agent_object(agent: Agent) -> None: Delete conversations linked with a specific agent object.
-    - recover(conversations: List) -> None: Recover a list of conversations from backup.
+    - recover(conversations: List) -> int: Recover a list of conversations from backup.
     - get_all() -> List[Conversation]: Fetch all conversations.
+    - iter_all(batch_size: int) -> Iterator[Conversation]: Stream all conversations, sorted by ID.
+    - get_batch_by_agent_name(agent_name: str, batch_size: int) -> ConversationBatch:
+        Fetch the conversations linked with a specific agent into a compact columnar batch.
+    - iter_by_agent_name(agent_name: str, batch_size: int) -> Iterator[Conversation]:
+        Stream conversations linked with a specific agent, sorted by ID.
+    - iter_headers_by_agent_name(agent_name: str, batch_size: int) -> Iterator[ConversationHeader]:
+        Same as above but only stream the headers of the conversations, never their messages.
+    - get_by_ids(conversation_ids: List[str]) -> List[Conversation]: Fetch several conversations by their IDs.
+    - get_page(after_id: Optional[str], limit: int, agent_name: Optional[str]) -> List[Conversation]:
+        Fetch at most `limit` conversations whose ID comes after `after_id` (keyset pagination).
+    - exists_by_agent_name(agent_name: str) -> bool: Check whether an agent has conversations without fetching them.
+    - count_by_agent_name(agent_name: str) -> int: Count the conversations linked with a specific agent.
+    - count() -> int: Count all conversations.
+    - search_by_content(text: str, agent_name: Optional[str], limit: int) -> List[Conversation]:
+        Fetch the conversations having a message that contains the text, optionally restricted to one agent.
+    - iter_headers_without_token_counts(encoding: str, agent_name: Optional[str], batch_size: int)
+        -> Iterator[ConversationHeader]: Stream the headers of the conversations not counted with an encoding.
+    - set_token_counts(conversation_id: str, token_counts: Dict[str, TokenCount], last_modified) -> bool:
+        Store the token counts of a conversation, unless it was modified since `last_modified`.
+    - get_token_statistics(agent_name: str, encoding: str, max_tokens: int) -> Dict[str, int]:
+        Aggregate the stored token counts of the conversations of an agent.
+
+    Token counts are stored by the writes rewriting every message of a conversation (create, update).
+    The other writes to the messages (append_messages, replace_message_at, truncate_after, and a change of
+    the agent's prompt in update_agent_field) drop them: a conversation never holds counts of older messages.
 
     Concrete implementations should provide the above methods to handle conversations and their associations with agents
     """
 
     @abstractmethod
-    def create(self, conversation: Conversation) -> None:
-        """Create a new conversation."""
+    def create(self, conversation: Conversation, token_counts: Optional[Dict[str, TokenCount]] = None) -> None:
+        """Create a new conversation, with the token counts of its messages by encoding if given."""
         pass
 
     @abstractmethod
@@ -121,14 +194,62 @@ class IConversationRepository(ABC):
         """Fetch conversations linked with a specific agent."""
         pass
 
+    @abstractmethod
+    def get_by_agent_name_and_tag(self, agent_name: str, tag: str) -> List[Conversation]:
+        """Fetch conversations linked with a specific agent and carrying a specific tag."""
+        pass
+
+    @abstractmethod
+    def get_labelled_by_agent_name_and_user(self, agent_name: str, user_name: str) -> List[Conversation]:
+        """Fetch the conversations of an agent tagged with a user name and carrying a label."""
+        pass
+
+    @abstractmethod
+    def get_labelled_headers_by_agent_name_and_user(
+        self,
+        agent_name: str,
+        user_name: str
+    ) -> List[ConversationHeader]:
+        """Fetch the headers (no messages) of the labelled conversations of a user for a specific agent."""
+        pass
+
     @abstractmethod
     def update_agent_field(self, current_agent: Agent, updated_agent: Agent) -> None:
         """Update agent details in linked conversations."""
         pass
 
     @abstractmethod
-    def update(self, current_conversation: Conversation, updated_conversation: Conversation) -> None:
-        """Update an existing conversation."""
+    def update(
+        self,
+        current_conversation: Conversation,
+        updated_conversation: Conversation,
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        """Update an existing conversation. Its stored token counts are replaced by `token_counts`, dropped if None."""
+        pass
+
+    @abstractmethod
+    def append_messages(
+        self,
+        conversation_id: str,
+        messages: List[Message],
+        token_counts: Optional[Dict[str, TokenCount]] = None
+    ) -> None:
+        """
+        Append messages at the end of a conversation, leaving the existing messages untouched.
+        `token_counts` counts the appended messages alone, see TokenCount.extended: they are added to the stored
+        counts when the conversation has counts for exactly these encodings, otherwise its counts are dropped.
+        """
+        pass
+
+    @abstractmethod
+    def replace_message_at(self, conversation_id: str, index: int, message: Message) -> None:
+        """Replace the message at position `index` of a conversation."""
+        pass
+
+    @abstractmethod
+    def truncate_after(self, conversation_id: str, index: int) -> None:
+        """Keep the messages of a conversation up to position `index` included, remove the others."""
         pass
 
     @abstractmethod
@@ -147,8 +268,14 @@ class IConversationRepository(ABC):
         pass
 
     @abstractmethod
-    def recover(self, conversations: List) -> None:
-        """Recover a list of conversations from backup."""
+    def recover(self, conversations: List) -> int:
+        """
+        Recover a list of conversations from backup.
+        Conversations that were already recovered are skipped, so a batch can safely be recovered twice.
+
+        Returns:
+            int: The number of conversations inserted.
+        """
         pass
 
     @abstractmethod
@@ -156,6 +283,113 @@ class IConversationRepository(ABC):
         """Fetch all conversations."""
         pass
 
+    @abstractmethod
+    def iter_all(self, batch_size: int = 500) -> Iterator[Conversation]:
+        """Stream all conversations, sorted by ID, without loading them all in memory."""
+        pass
+
+    @abstractmethod
+    def get_batch_by_agent_name(self, agent_name: str, batch_size: int = 500) -> ConversationBatch:
+        """
+        Fetch the conversations linked with a specific agent, sorted by ID, into a ConversationBatch.
+        Intended for bulk reads: no Conversation or Message object is created.
+        """
+        pass
+
+    @abstractmethod
+    def iter_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[Conversation]:
+        """Stream conversations linked with a specific agent, sorted by ID."""
+        pass
+
+    @abstractmethod
+    def iter_headers_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[ConversationHeader]:
+        """Stream the headers (no messages) of the conversations linked with a specific agent, sorted by ID."""
+        pass
+
+    @abstractmethod
+    def get_by_ids(self, conversation_ids: List[str]) -> List[Conversation]:
+        """Fetch the conversations with the given IDs, sorted by ID. Missing conversations are skipped."""
+        pass
+
+    @abstractmethod
+    def get_page(
+        self,
+        after_id: Optional[str] = None,
+        limit: int = 50,
+        agent_name: Optional[str] = None
+    ) -> List[Conversation]:
+        """
+        Fetch a page of conversations sorted by ID.
+
+        Args:
+            after_id (Optional[str]): ID of the last conversation of the previous page, None for the first page.
+            limit (int): Maximum number of conversations to return.
+            agent_name (Optional[str]): Only return conversations linked with this agent if provided.
+        """
+        pass
+
+    @abstractmethod
+    def exists_by_agent_name(self, agent_name: str) -> bool:
+        """Check whether conversations are linked with a specific agent, without fetching them."""
+        pass
+
+    @abstractmethod
+    def count_by_agent_name(self, agent_name: str) -> int:
+        """Count the conversations linked with a specific agent."""
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        """Count all conversations."""
+        pass
+
+    @abstractmethod
+    def search_by_content(self, text: str, agent_name: Optional[str] = None, limit: int = 50) -> List[Conversation]:
+        """
+        Fetch at most `limit` conversations having a message that contains the text, sorted by ID.
+        Backends with a full-text index match whole words, the others match substrings, ignoring case.
+        """
+        pass
+
+    @abstractmethod
+    def iter_headers_without_token_counts(
+        self,
+        encoding: str,
+        agent_name: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Iterator[ConversationHeader]:
+        """Stream the headers of the conversations with no token counts for an encoding, sorted by ID."""
+        pass
+
+    @abstractmethod
+    def set_token_counts(
+        self,
+        conversation_id: str,
+        token_counts: Dict[str, TokenCount],
+        last_modified: Optional[datetime.datetime]
+    ) -> bool:
+        """
+        Store token counts computed from a conversation read when it was last modified at `last_modified`,
+        as given by its header. Nothing is stored if it was written since. With a `last_modified` of None,
+        the counts are stored whatever the last modification.
+
+        Returns:
+            bool: Whether the counts were stored.
+        """
+        pass
+
+    @abstractmethod
+    def get_token_statistics(self, agent_name: str, encoding: str, max_tokens: int) -> Dict[str, int]:
+        """
+        Aggregate the token counts of the conversations of an agent, without reading their messages.
+
+        Returns:
+            Dict[str, int]: The number of `conversations`, of `counted` conversations, their `total_tokens`,
+                `assistant_tokens`, `billing_tokens` (each conversation counting at most `max_tokens`)
+                and the number of conversations `over_limit`, above `max_tokens`.
+        """
+        pass
+
 
 class IBackupRepository(ABC):
     """
@@ -165,6 +399,16 @@ class IBackupRepository(ABC):
     - backup_conversations(conversations: Union[List[Conversation], Conversation]) -> None: Backup a list conversations.
     - get_conversations_by_agent_object(agent: Agent) -> List: Fetch convos linked with a specific agent from backup.
     - delete_conversations_by_agent_object(agent: Agent) -> None: Delete convos linked with specific agent from backup.
+    - move_conversations_by_agent_name(agent_name: str) -> Tuple[int, int]: Move the conversations of an agent
+        to the backup, returning the number of conversations backed up and deleted.
+    - count_conversations_by_agent_name(agent_name: str) -> int: Count the backed up convos of an agent.
+    - get_backed_up_agent_names() -> List[str]: Fetch the names of the agents having backed up conversations.
+    - iter_conversation_batches_by_agent_name(agent_name: str, batch_size: int, after_id: Optional[str])
+        -> Iterator[Tuple[List, str]]: Stream the backed up convos of an agent in batches, sorted by ID.
+    - get_recovery_checkpoint(agent_name: str) -> Optional[Dict]: Fetch the progress of an interrupted recovery.
+    - save_recovery_checkpoint(agent_name: str, last_id: Optional[str], recovered: int) -> None:
+        Record the progress of a recovery.
+    - delete_recovery_checkpoint(agent_name: str) -> None: Forget the progress of a finished recovery.
 
     Implementing classes should manage the backups efficiently and ensure retrieval and deletions are accurate.
     """
@@ -183,3 +427,65 @@ class IBackupRepository(ABC):
     def delete_conversations_by_agent_object(self, agent: Agent) -> None:
         """Delete conversations linked with a specific agent from backup."""
         pass
+
+    @abstractmethod
+    def move_conversations_by_agent_name(self, agent_name: str) -> Tuple[int, int]:
+        """
+        Copy the conversations linked with a specific agent to the backup, then delete them.
+
+        Returns:
+            Tuple[int, int]: The number of conversations backed up and the number of conversations deleted.
+        """
+        pass
+
+    @abstractmethod
+    def count_conversations_by_agent_name(self, agent_name: str) -> int:
+        """Count the backed up conversations linked with a specific agent."""
+        pass
+
+    @abstractmethod
+    def get_backed_up_agent_names(self) -> List[str]:
+        """Fetch the names of the agents having conversations in the backup."""
+        pass
+
+    @abstractmethod
+    def iter_conversation_batches_by_agent_name(
+        self,
+        agent_name: str,
+        batch_size: int = 1000,
+        after_id: Optional[str] = None
+    ) -> Iterator[Tuple[List, str]]:
+        """
+        Stream the backed up conversations linked with a specific agent, sorted by ID.
+
+        Args:
+            agent_name (str): The name of the agent.
+            batch_size (int): Maximum number of conversations per batch.
+            after_id (Optional[str]): Only stream the conversations whose ID comes after this one.
+
+        Yields:
+            Tuple[List, str]: A batch of backed up conversations and the ID of its last conversation.
+        """
+        pass
+
+    @abstractmethod
+    def get_recovery_checkpoint(self, agent_name: str) -> Optional[Dict]:
+        """
+        Fetch the progress of a recovery of an agent that has not completed.
+
+        Returns:
+            Optional[Dict]: None if no recovery is in progress, otherwise a dictionary with the ID of the last
+            recovered conversation ('last_id', None if no batch was recovered yet) and the number of
+            conversations recovered so far ('recovered').
+        """
+        pass
+
+    @abstractmethod
+    def save_recovery_checkpoint(self, agent_name: str, last_id: Optional[str], recovered: int) -> None:
+        """Record the progress of the recovery of an agent."""
+        pass
+
+    @abstractmethod
+    def delete_recovery_checkpoint(self, agent_name: str) -> None:
+        """Forget the progress of the recovery of an agent."""
+        pass
@@ -13,6 +13,7 @@ class IFeedbackRepository(ABC):
     - update(current_feedback: Feedback, updated_feedback: Feedback) -> None: Update an existing feedback entry.
     - delete(feedback: Feedback) -> None: Delete a feedback entry.
     - get_all() -> List[Feedback]: Fetch all feedback entries.
+    - count() -> int: Count the feedback entries.
 
     Implementing classes should ensure these methods are provided with appropriate
     storage-level logic to handle feedback data.
@@ -42,3 +43,8 @@ class IFeedbackRepository(ABC):
     def get_all(self) -> List[Feedback]:
         """Fetch all feedback entries."""
         pass
+
+    @abstractmethod
+    def count(self) -> int:
+        """Count the feedback entries."""
+        pass
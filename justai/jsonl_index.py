@@ -0,0 +1,163 @@
+"""
+Random access to the examples of large JSONL files.
+
+The byte offset of each line is stored once in a sidecar file, <file>.idx, next to the JSONL file.
+The index is memory-mapped when opened, so reading example N costs one seek and the parsing of that line
+only, whatever the size of the file. It records the size and modification time of the file it was built from,
+and is built again when they change: a dataset rebuilt or patched since is indexed again on its next read.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, List, Optional
+
+import numpy as np
+
+INDEX_SUFFIX = ".idx"
+
+# magic, version, size and modification time (ns) of the indexed file, number of lines
+_HEADER = struct.Struct("<4sHxxQqQ")
+_MAGIC = b"JLIX"
+_VERSION = 1
+_OFFSET = struct.Struct("<Q")
+
+# Bytes of the JSONL file scanned at once when building an index
+SCAN_CHUNK_SIZE = 16 << 20
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def build_index(path: str) -> str:
+    """
+    Write the offset index of a JSONL file and return its path.
+    Memory does not depend on the size of the file: offsets are written while it is scanned.
+    """
+    stat = os.stat(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as index, open(path, "rb") as source:
+            index.write(_HEADER.pack(_MAGIC, _VERSION, 0, 0, 0))
+            index.write(_OFFSET.pack(0))
+            count = 0
+            position = 0
+            last = b"\n"
+            while chunk := source.read(SCAN_CHUNK_SIZE):
+                # Each line starts after the newline ending the previous one
+                ends = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + (position + 1)
+                index.write(ends.astype("<u8").tobytes())
+                count += len(ends)
+                position += len(chunk)
+                last = chunk[-1:]
+            if last != b"\n":
+                # Last line without a trailing newline
+                index.write(_OFFSET.pack(position))
+                count += 1
+            index.seek(0)
+            index.write(_HEADER.pack(_MAGIC, _VERSION, position, stat.st_mtime_ns, count))
+        if position != stat.st_size:
+            raise RuntimeError(f"{path} was modified while being indexed.")
+        os.replace(tmp_path, index_path(path))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return index_path(path)
+
+
+class JsonlIndex:
+    """
+    Paged reader of a JSONL file, through its offset index. Used as a context manager.
+
+    Lines are numbered from 0. `read(start, stop)` parses the lines of a page only,
+    read from the file with a single seek.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._offsets: Optional[mmap.mmap] = None
+        self._count = 0
+
+    @classmethod
+    def open(cls, path: str) -> "JsonlIndex":
+        """Open the index of a JSONL file, building it first when missing or out of date."""
+        index = cls(path)
+        if not index._load():
+            build_index(path)
+            if not index._load():
+                raise RuntimeError(f"{path} was modified while being indexed.")
+        return index
+
+    def _load(self) -> bool:
+        # The file is opened first: a file replaced after its index was checked is never read
+        source = open(self.path, "rb")
+        stat = os.fstat(source.fileno())
+        try:
+            with open(index_path(self.path), "rb") as file:
+                offsets = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # ValueError: empty index file
+            source.close()
+            return False
+        header = _HEADER.unpack_from(offsets) if len(offsets) >= _HEADER.size else None
+        if header is None or header[:4] != (_MAGIC, _VERSION, stat.st_size, stat.st_mtime_ns) \
+                or len(offsets) != _HEADER.size + (header[4] + 1) * _OFFSET.size:
+            offsets.close()
+            source.close()
+            return False
+        self.close()
+        self._file = source
+        self._offsets = offsets
+        self._count = header[4]
+        return True
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _offset(self, line: int) -> int:
+        return _OFFSET.unpack_from(self._offsets, _HEADER.size + line * _OFFSET.size)[0]
+
+    def read_lines(self, start: int, stop: Optional[int] = None) -> List[bytes]:
+        """Raw lines from `start` to `stop` excluded, clipped to the file like a slice."""
+        start, stop, _ = slice(start, stop).indices(self._count)
+        if start >= stop:
+            return []
+        begin = self._offset(start)
+        self._file.seek(begin)
+        return self._file.read(self._offset(stop) - begin).splitlines()
+
+    def read(self, start: int, stop: Optional[int] = None) -> List[Any]:
+        """Parsed examples from `start` to `stop` excluded. Blank lines are skipped."""
+        return [json.loads(line) for line in self.read_lines(start, stop) if line.strip()]
+
+    def __getitem__(self, line: int) -> Any:
+        if not -self._count <= line < self._count:
+            raise IndexError(f"Line {line} out of range for {self.path} ({self._count} lines).")
+        return json.loads(self.read_lines(line % self._count, line % self._count + 1)[0])
+
+    def close(self) -> None:
+        if self._offsets is not None:
+            self._offsets.close()
+            self._offsets = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "JsonlIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def count_lines(path: str) -> int:
+    with JsonlIndex.open(path) as index:
+        return len(index)
+
+
+def read_page(path: str, start: int, stop: Optional[int] = None) -> List[Any]:
+    """Parsed examples of a JSONL file from line `start` to `stop` excluded."""
+    with JsonlIndex.open(path) as index:
+        return index.read(start, stop)
@@ -0,0 +1,131 @@
+"""
+Persistent cache of the token counts of message contents, in a SQLite file on local disk.
+
+Counts are keyed by the encoding name and a BLAKE2b hash of the content, so a dataset analysed again
+only encodes the contents that were never counted: after a small edit, only the new messages.
+The cache holds at most `max_entries` counts: the least recently used ones are evicted first.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+DEFAULT_CACHE_PATH = "data/token_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 2_000_000
+
+# Hashes looked up per query, below the limit of SQLite on the number of parameters
+LOOKUP_BATCH_SIZE = 500
+# A hit only refreshes the last use of a count older than this, in seconds, to keep lookups read-only
+TOUCH_INTERVAL = 3600
+# Share of max_entries kept by an eviction, so that evictions do not run on every insert
+EVICTION_TARGET = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_count (
+    encoding TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    tokens INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (encoding, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS token_count_last_used ON token_count (last_used);
+"""
+
+
+def content_hash(content: str) -> bytes:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCountCache:
+    """
+    Token counts by (encoding, content hash), shared by the threads of the server.
+
+    Like SQLiteDatabase, every thread gets its own connection to the file, in WAL mode.
+
+    Methods:
+    - get_many(encoding_name, hashes) -> Dict[bytes, int]: The cached counts among the given hashes.
+    - put_many(encoding_name, counts): Store counts, evicting the least recently used ones beyond max_entries.
+    - stats() -> Dict[str, float]: Hits, misses and hit rate since the cache was opened, entries and evictions.
+    - clear(): Delete every count.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, cached_statements=64)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA busy_timeout = 10000")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, encoding_name: str, hashes: List[bytes]) -> Dict[bytes, int]:
+        connection = self.connection()
+        now = int(time.time())
+        found: Dict[bytes, int] = {}
+        stale: List[Tuple[int, str, bytes]] = []
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+            rows = connection.execute(
+                f"SELECT hash, tokens, last_used FROM token_count "
+                f"WHERE encoding = ? AND hash IN ({','.join('?' * len(batch))})",
+                (encoding_name, *batch)
+            )
+            for digest, tokens, last_used in rows:
+                found[digest] = tokens
+                if now - last_used > TOUCH_INTERVAL:
+                    stale.append((now, encoding_name, digest))
+        if stale:
+            with connection:
+                connection.executemany("UPDATE token_count SET last_used = ? WHERE encoding = ? AND hash = ?", stale)
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, encoding_name: str, counts: Iterable[Tuple[bytes, int]]) -> None:
+        connection = self.connection()
+        now = int(time.time())
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO token_count (encoding, hash, tokens, last_used) VALUES (?, ?, ?, ?)",
+                ((encoding_name, digest, int(tokens), now) for digest, tokens in counts)
+            )
+            entries = connection.execute("SELECT count(*) FROM token_count").fetchone()[0]
+            if entries > self.max_entries:
+                evicted = entries - int(self.max_entries * EVICTION_TARGET)
+                connection.execute(
+                    "DELETE FROM token_count WHERE (encoding, hash) IN "
+                    "(SELECT encoding, hash FROM token_count ORDER BY last_used LIMIT ?)",
+                    (evicted,)
+                )
+                with self._stats_lock:
+                    self.evictions += evicted
+
+    def stats(self) -> Dict[str, float]:
+        entries = self.connection().execute("SELECT count(*) FROM token_count").fetchone()[0]
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "evictions": self.evictions
+            }
+
+    def clear(self) -> None:
+        with self.connection() as connection:
+            connection.execute("DELETE FROM token_count")
@@ -0,0 +1,234 @@
+"""
+Token counts of fine-tuning examples, following the OpenAI cookbook (not exact, see
+https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb).
+
+count_dataset_tokens counts a whole dataset in one pass: the message contents of every example are
+flattened into one list, encoded by batches on a thread pool (tiktoken releases the GIL while encoding),
+and the lengths are summed back per example with NumPy. Roles and names, a handful of distinct strings,
+are encoded once each. With a TokenCountCache, the counts are kept between analyses and only new contents
+are encoded. conversation_token_counts counts a single stored conversation, when it is written.
+No Streamlit here: the counts are also used by the dataset builds and the conversation use cases.
+"""
+import functools
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import tiktoken
+
+from justai.entities.conversation import Message
+from justai.entities.token_count import DEFAULT_ENCODING, TokenCount
+from justai.token_cache import TokenCountCache, content_hash
+
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+# Every reply is primed with <|start|>assistant<|message|>
+TOKENS_PER_REPLY = 3
+
+# Texts encoded per task of the thread pool
+ENCODE_BATCH_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """The encoding, loaded on first use: importing this module does not download anything."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _encoded_lengths(encoding: tiktoken.Encoding, texts: List[str]) -> np.ndarray:
+    return np.fromiter(map(len, map(encoding.encode_ordinary, texts)), dtype=np.int64, count=len(texts))
+
+
+def _count_new_texts(
+    texts: List[str],
+    encoding_name: str,
+    num_threads: Optional[int]
+) -> np.ndarray:
+    encoding = get_encoding(encoding_name)
+    batches = [texts[start:start + ENCODE_BATCH_SIZE] for start in range(0, len(texts), ENCODE_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return _encoded_lengths(encoding, texts)
+    with ThreadPoolExecutor(num_threads or os.cpu_count()) as executor:
+        return np.concatenate(list(executor.map(functools.partial(_encoded_lengths, encoding), batches)))
+
+
+def count_texts(
+    texts: List[str],
+    encoding_name: str = DEFAULT_ENCODING,
+    num_threads: Optional[int] = None,
+    cache: Optional[TokenCountCache] = None
+) -> np.ndarray:
+    """
+    Number of tokens of each text, encoded by batches of ENCODE_BATCH_SIZE texts on `num_threads` threads.
+    With a cache, only the distinct texts missing from it are encoded, and their counts are added to it.
+    """
+    if cache is None:
+        return _count_new_texts(texts, encoding_name, num_threads)
+    # Index of each text among the distinct ones: a system prompt repeated by every example is looked up once
+    positions: Dict[bytes, int] = {}
+    distinct_texts: List[str] = []
+    text_positions = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        digest = content_hash(text)
+        position = positions.get(digest)
+        if position is None:
+            position = positions[digest] = len(distinct_texts)
+            distinct_texts.append(text)
+        text_positions[i] = position
+    digests = list(positions)
+    cached = cache.get_many(encoding_name, digests)
+    lengths = np.fromiter((cached.get(digest, -1) for digest in digests), dtype=np.int64, count=len(digests))
+    missing = np.flatnonzero(lengths < 0)
+    if len(missing):
+        lengths[missing] = _count_new_texts([distinct_texts[i] for i in missing], encoding_name, num_threads)
+        cache.put_many(encoding_name, ((digests[i], lengths[i]) for i in missing))
+    return lengths[text_positions]
+
+
+class TokenCounts:
+    """
+    Counts of a dataset, one entry per example in each NumPy array.
+
+    Attributes:
+        total (np.ndarray): Tokens of the example, message and reply overheads included.
+        assistant (np.ndarray): Tokens of the contents of the assistant messages.
+        messages (np.ndarray): Number of messages.
+        has_system (np.ndarray): Whether the example has a system message.
+        has_user (np.ndarray): Whether the example has a user message.
+    """
+    __slots__ = ("total", "assistant", "messages", "has_system", "has_user")
+
+    def __init__(
+        self,
+        total: np.ndarray,
+        assistant: np.ndarray,
+        messages: np.ndarray,
+        has_system: np.ndarray,
+        has_user: np.ndarray
+    ):
+        self.total = total
+        self.assistant = assistant
+        self.messages = messages
+        self.has_system = has_system
+        self.has_user = has_user
+
+    def __len__(self) -> int:
+        return len(self.total)
+
+
+def count_dataset_tokens(
+    dataset: Iterable[Dict[str, Any]],
+    encoding_name: str = DEFAULT_ENCODING,
+    num_threads: Optional[int] = None,
+    cache: Optional[TokenCountCache] = None
+) -> TokenCounts:
+    """
+    Count the tokens of examples in the chat format, {"messages": [{"role": ..., "content": ...}, ...]}.
+    With a cache, only the message contents never counted before are encoded.
+    """
+    encoding = get_encoding(encoding_name)
+    short_lengths: Dict[str, int] = {}
+    texts: List[str] = []
+    owners = array("q")
+    from_assistant = bytearray()
+    overheads = array("q")
+    messages_counts = array("q")
+    has_system = bytearray()
+    has_user = bytearray()
+
+    for example_index, example in enumerate(dataset):
+        messages = example["messages"]
+        overhead = TOKENS_PER_REPLY + TOKENS_PER_MESSAGE * len(messages)
+        roles = set()
+        for message in messages:
+            role = message.get("role")
+            roles.add(role)
+            for key, value in message.items():
+                if key == "name":
+                    overhead += TOKENS_PER_NAME
+                if not isinstance(value, str):
+                    continue
+                if key == "content":
+                    texts.append(value)
+                    owners.append(example_index)
+                    from_assistant.append(role == "assistant")
+                    continue
+                if value not in short_lengths:
+                    short_lengths[value] = len(encoding.encode_ordinary(value))
+                overhead += short_lengths[value]
+        overheads.append(overhead)
+        messages_counts.append(len(messages))
+        has_system.append("system" in roles)
+        has_user.append("user" in roles)
+
+    num_examples = len(overheads)
+    lengths = count_texts(texts, encoding_name, num_threads, cache)
+    owners = np.frombuffer(owners, dtype=np.int64)
+    assistant_mask = np.frombuffer(bytes(from_assistant), dtype=np.bool_)
+    content_tokens = np.bincount(owners, weights=lengths, minlength=num_examples).astype(np.int64)
+    assistant_tokens = np.bincount(
+        owners[assistant_mask], weights=lengths[assistant_mask], minlength=num_examples
+    ).astype(np.int64)
+    return TokenCounts(
+        total=np.array(overheads, dtype=np.int64) + content_tokens,
+        assistant=assistant_tokens,
+        messages=np.array(messages_counts, dtype=np.int64),
+        has_system=np.frombuffer(bytes(has_system), dtype=np.bool_),
+        has_user=np.frombuffer(bytes(has_user), dtype=np.bool_)
+    )
+
+
+def conversation_token_counts(
+    messages: Sequence[Union[Message, Dict[str, Any]]],
+    encoding_names: Sequence[str] = (DEFAULT_ENCODING,)
+) -> Dict[str, TokenCount]:
+    """
+    Token counts of the messages of a conversation for each encoding, as stored with the conversation.
+    The total is counted like the examples of count_dataset_tokens, the conversation having no names.
+    """
+    rows = [
+        (message.role, message.content) if isinstance(message, Message) else (message["role"], message["content"])
+        for message in messages
+    ]
+    counts = {}
+    for encoding_name in encoding_names:
+        encoding = get_encoding(encoding_name)
+        lengths = [len(encoding.encode_ordinary(content)) for _, content in rows]
+        roles = sum(len(encoding.encode_ordinary(role)) for role, _ in rows)
+        counts[encoding_name] = TokenCount(
+            encoding_name,
+            lengths,
+            total=TOKENS_PER_REPLY + TOKENS_PER_MESSAGE * len(rows) + roles + sum(lengths),
+            assistant=sum(length for (role, _), length in zip(rows, lengths) if role == "assistant")
+        )
+    return counts
+
+
+def num_tokens_from_messages(
+    messages: List[Dict[str, Any]],
+    tokens_per_message: int = TOKENS_PER_MESSAGE,
+    tokens_per_name: int = TOKENS_PER_NAME,
+    encoding_name: str = DEFAULT_ENCODING
+) -> int:
+    """Tokens of a single example."""
+    encoding = get_encoding(encoding_name)
+    num_tokens = TOKENS_PER_REPLY
+    for message in messages:
+        num_tokens += tokens_per_message
+        for key, value in message.items():
+            if isinstance(value, str):
+                num_tokens += len(encoding.encode_ordinary(value))
+            if key == "name":
+                num_tokens += tokens_per_name
+    return num_tokens
+
+
+def num_assistant_tokens_from_messages(messages: List[Dict[str, Any]], encoding_name: str = DEFAULT_ENCODING) -> int:
+    encoding = get_encoding(encoding_name)
+    return sum(
+        len(encoding.encode_ordinary(message["content"]))
+        for message in messages
+        if message["role"] == "assistant" and isinstance(message.get("content"), str)
+    )
@@ -3,7 +3,7 @@ from justai.entities.agent import Agent
 from justai.interface_adapters.conversational_repository_interface import IAgentRepository
 from justai.interface_adapters.conversational_repository_interface import IBackupRepository
 from justai.interface_adapters.conversational_repository_interface import IConversationRepository
-from typing import List
+from typing import Callable, List, Optional
 import copy
 
 
@@ -27,30 +27,29 @@ class AgentUseCases:
         Raises:
             DuplicateError: If an agent with the same name already exists.
         """
-        existing_agent = self.agent_repository.get_by_name(agent_name)
-        if existing_agent:
-            raise DuplicateError(f"Agent with the name {agent_name} already exists.")
+        # The repository enforces unique names, a duplicate surfaces as a DuplicateError
         agent = Agent(agent_name, agent_system_prompt)
         self.agent_repository.create(agent)
 
-    def delete(self, agent_name: str) -> None:
+    def delete(self, agent_name: str) -> int:
         """
         Deletes an agent and backs up its linked conversations.
 
         Args:
             agent_name (str): The name of the agent to delete.
+
+        Returns:
+            int: The number of conversations moved to the backup.
         """
         agent = self.agent_repository.get_by_name(agent_name)
         if not agent:
             raise NotFoundError(f"Agent with the name {agent_name} not found.")
 
-        # Backup and delete linked conversations for the agent
-        linked_conversations = self.conversation_repository.get_by_agent_name(agent.name)
-        if linked_conversations:
-            self.backup_repository.backup_conversations(linked_conversations)
-            self.conversation_repository.delete_by_agent_name(agent.name)
+        # Backup and delete linked conversations for the agent, without loading them
+        backed_up, _ = self.backup_repository.move_conversations_by_agent_name(agent.name)
         # Delete the agent
         self.agent_repository.delete(agent)
+        return backed_up
 
     def edit(self, agent_name: str, new_agent_name: str, new_system_prompt: str) -> None:
         """
@@ -60,23 +59,26 @@ class AgentUseCases:
             agent_name (str): The current name of the agent.
             new_agent_name (str): The new name for the agent.
             new_system_prompt (str): The new system prompt for the agent.
+
+        Raises:
+            NotFoundError: If the agent is not found.
+            DuplicateError: If the new name is already used by an agent or by orphaned conversations.
         """
         agent_to_edit = self.agent_repository.get_by_name(agent_name)
-        if self.agent_repository.get_by_name(new_agent_name):
-            raise DuplicateError(f"Agent with the name {new_agent_name} already exists.")
-        if self.conversation_repository.get_by_agent_name(new_agent_name):
+        if not agent_to_edit:
+            raise NotFoundError(f"Agent with the name {agent_name} not found.")
+        # Orphaned conversations are not covered by the agents' unique index
+        if new_agent_name != agent_name and self.conversation_repository.exists_by_agent_name(new_agent_name):
             raise DuplicateError(f"Conversations with the agent name {new_agent_name} already exists.")
         agent_new_version = Agent(new_agent_name, new_system_prompt)
 
+        # Raises DuplicateError if the new name is taken, nothing has been written in that case
+        self.agent_repository.update(agent_to_edit, agent_new_version)
         try:
-            self.agent_repository.update(agent_to_edit, agent_new_version)
             self.conversation_repository.update_agent_field(agent_to_edit, agent_new_version)
         except Exception as e:
-            # If there's an error, attempt a manual rollback.
-            # This might involve deleting the agent if it was added,
-            # and delete the associated conversations
-            if (self.agent_repository.get_by_name(agent_new_version.name)):
-                self.delete(agent_new_version.name)
+            # If the conversations could not be updated, restore the previous version of the agent
+            self.agent_repository.update(agent_new_version, agent_to_edit)
             raise e
 
     def get_all(self) -> List[Agent]:
@@ -87,45 +89,79 @@ class AgentUseCases:
         """Returns an agent object."""
         return self.agent_repository.get_by_name(agent_name)
 
-    def recover(self, agent_name: str, agent_prompt: str) -> None:
+    def count(self) -> int:
+        """Returns the number of agents."""
+        return self.agent_repository.count()
+
+    def get_backed_up_agent_names(self) -> List[str]:
+        """Returns the names of the agents whose conversations can be recovered from the backup."""
+        return self.backup_repository.get_backed_up_agent_names()
+
+    def recover(
+        self,
+        agent_name: str,
+        agent_prompt: str,
+        batch_size: int = 1000,
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> int:
         """
         Recovers an agent and its conversations from the backup.
 
+        The conversations are streamed from the backup and inserted batch by batch, recording a checkpoint
+        after each batch. If the recovery is interrupted, calling this method again resumes it after the
+        last recovered batch. The backup is only deleted once every conversation has been recovered.
+
         Args:
             agent_name (str): Name of the agent to recover.
+            agent_prompt (str): System prompt of the recovered agent.
+            batch_size (int): Number of conversations inserted per batch.
+            progress_callback (Optional[Callable[[int, int], None]]): Called after each batch with the number
+                of conversations recovered so far and the total number of conversations to recover.
+
+        Returns:
+            int: The number of conversations recovered.
 
         Raises:
+            ValueError: If the agent already exists and no recovery of it is in progress.
             NotFoundError: If the agent's backup is not found.
-            DataBaseError: For other generic database errors.
         """
-        # Check if agent exists in the main repository (to prevent duplication)
-        agent_in_main_repo = self.agent_repository.get_by_name(agent_name)
-        if agent_in_main_repo:
+        checkpoint = self.backup_repository.get_recovery_checkpoint(agent_name)
+        # Check if agent exists in the main repository (to prevent duplication), unless resuming a recovery
+        agent_in_main_repo = self.agent_repository.exists(agent_name)
+        if agent_in_main_repo and checkpoint is None:
             raise ValueError(f"Agent {agent_name} already exists in the main repository!")
+
+        total = self.backup_repository.count_conversations_by_agent_name(agent_name)
+        if not total:
+            raise NotFoundError(f"No backup found for agent: {agent_name}")
+
+        if checkpoint is None:
+            # Mark the recovery as in progress before creating the agent, so that it can be resumed
+            checkpoint = {"last_id": None, "recovered": 0}
+            self.backup_repository.save_recovery_checkpoint(agent_name, None, 0)
         agent_to_recover = Agent(agent_name, agent_prompt)
-        try:
+        if not agent_in_main_repo:
             # Recover the agent first
             self.agent_repository.create(agent_to_recover)
 
-            # Recover agent's conversations
-            backed_up_conversations = self.backup_repository.get_conversations_by_agent_object(agent_to_recover)
-            if not backed_up_conversations:
-                raise NotFoundError(f"No backup found for agent: {agent_name}")
-
-            self.conversation_repository.recover(backed_up_conversations)
-
-        except Exception as e:
-            # If there's an error, attempt a manual rollback.
-            # This might involve deleting the agent if it was added,
-            # or deleting the recovered conversations if they were added.
-            if self.agent_repository.get_by_name(agent_to_recover.name):
-                self.agent_repository.delete(agent_to_recover)
-            if self.conversation_repository.get_by_agent_name(agent_to_recover.name):
-                self.conversation_repository.delete_by_agent_object(agent_to_recover)
-            raise e
+        # Recover agent's conversations
+        recovered = checkpoint["recovered"]
+        batches = self.backup_repository.iter_conversation_batches_by_agent_name(
+            agent_name,
+            batch_size,
+            checkpoint["last_id"]
+        )
+        for batch, last_id in batches:
+            self.conversation_repository.recover(batch)
+            recovered += len(batch)
+            self.backup_repository.save_recovery_checkpoint(agent_name, last_id, recovered)
+            if progress_callback:
+                progress_callback(recovered, total)
 
         # If everything's successful till here, remove the backed up conversations
         self.backup_repository.delete_conversations_by_agent_object(agent_to_recover)
+        self.backup_repository.delete_recovery_checkpoint(agent_name)
+        return recovered
 
     def add_dataset_generation_prompt(self, agent_name: str, prompt_label: str, prompt: str) -> None:
         """
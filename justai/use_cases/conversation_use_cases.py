@@ -1,9 +1,12 @@
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Sequence
 
 from justai.application.exceptions import NotFoundError
-from justai.entities.conversation import Conversation
+from justai.entities.conversation import Conversation, ConversationHeader, Message
+from justai.entities.conversation_batch import ConversationBatch
+from justai.entities.token_count import DEFAULT_ENCODING, TokenCount
 from justai.interface_adapters.conversational_repository_interface import IBackupRepository, IConversationRepository
 from justai.interface_adapters.conversational_repository_interface import IAgentRepository
+from justai.token_counting import TOKENS_PER_REPLY, conversation_token_counts
 
 
 class ConversationUseCases:
@@ -14,25 +17,62 @@ class ConversationUseCases:
         agent_repository (IAgentRepository): Repository for accessing agent data.
         conversation_repository (IConversationRepository): Repository for accessing conversation data.
         backup_repository (IBackupRepository): Repository for accessing backup data of conversations.
+        token_encodings (Sequence[str]): Encodings the conversations are counted with when written.
 
     Methods:
         create: Adds a new conversation to the repository.
         get_all: Retrieves all conversations from the repository.
         get_by_agent_name: Retrieves all conversations associated with a specific agent.
+        iter_by_agent_name: Streams the conversations associated with a specific agent.
+        get_batch_by_agent_name: Retrieves the conversations of an agent into a compact ConversationBatch.
+        get_page: Retrieves a page of conversations, optionally restricted to one agent.
+        count: Counts the conversations, optionally restricted to one agent.
+        search_by_content: Retrieves the conversations having a message that contains a text.
         delete_by_id: Deletes a conversation by its ID and backs it up before deletion.
         modify_messages: Updates the messages of a conversation.
         modify: Updates messages, ID, and tags of a conversation.
+        append_messages: Appends messages to a conversation without rewriting it.
+        replace_message_at: Replaces a single message of a conversation.
+        truncate_after: Removes the messages of a conversation after a given index.
         recover: Recovers a backed-up conversation by its ID and deletes the backup afterwards.
         search_in_conversations_by_tag: Filters a list of conversations by a specific tag.
+        get_by_agent_name_and_tag: Retrieves the conversations of an agent carrying a specific tag.
+        get_labelled_conversations: Retrieves the labelled conversations of a user for an agent, by label.
+        get_labelled_headers: Same as get_labelled_conversations, without loading the messages.
         search_in_conversations_by_agent_name: Filters a list of conversations by a specific agent name.
+        backfill_token_counts: Counts the tokens of the stored conversations written without counts.
+        get_token_statistics: Aggregates the stored token counts of the conversations of an agent.
     """
     def __init__(self,
                  agent_repository: IAgentRepository,
                  conversation_repository: IConversationRepository,
-                 backup_repository: IBackupRepository):
+                 backup_repository: IBackupRepository,
+                 token_encodings: Sequence[str] = (DEFAULT_ENCODING,)):
         self.agent_repository = agent_repository
         self.conversation_repository = conversation_repository
         self.backup_repository = backup_repository
+        self.token_encodings = tuple(token_encodings)
+
+    def _token_counts(
+        self,
+        messages: List[Message],
+        encodings: Optional[Sequence[str]] = None
+    ) -> Dict[str, TokenCount]:
+        """
+        Token counts of the messages, stored with the conversation. A conversation is still written when an encoding
+        can not be loaded (no network to download it): it is then stored without counts, see backfill_token_counts.
+        """
+        try:
+            return conversation_token_counts(messages, self.token_encodings if encodings is None else encodings)
+        except (OSError, ValueError):
+            return {}
+
+    def _recount(self, conversation_id: str) -> None:
+        """Count again a conversation modified in place, whose stored counts were dropped by the repository."""
+        conversation = self.conversation_repository.get_by_id(conversation_id)
+        token_counts = self._token_counts(conversation.messages) if conversation else {}
+        if token_counts:
+            self.conversation_repository.set_token_counts(conversation_id, token_counts, None)
 
     def create(
         self,
@@ -43,11 +83,10 @@ class ConversationUseCases:
     ) -> Conversation:
         id = id or None
         tags = tags or None
-        agent = self.agent_repository.get_by_name(agent_name)
-        if not agent:
+        if not self.agent_repository.exists(agent_name):
             raise NotFoundError(f"No agent found with the name {agent_name}.")
         conversation = Conversation(agent_name, messages, id, tags)
-        self.conversation_repository.create(conversation)
+        self.conversation_repository.create(conversation, self._token_counts(conversation.messages))
         return conversation
 
     def get_all(self) -> List[Conversation]:
@@ -56,6 +95,47 @@ class ConversationUseCases:
     def get_by_agent_name(self, agent_name: str) -> List[Conversation]:
         return self.conversation_repository.get_by_agent_name(agent_name)
 
+    def iter_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[Conversation]:
+        return self.conversation_repository.iter_by_agent_name(agent_name, batch_size)
+
+    def iter_headers_by_agent_name(self, agent_name: str, batch_size: int = 500) -> Iterator[ConversationHeader]:
+        return self.conversation_repository.iter_headers_by_agent_name(agent_name, batch_size)
+
+    def get_by_ids(self, conversation_ids: List[str]) -> List[Conversation]:
+        return self.conversation_repository.get_by_ids(conversation_ids)
+
+    def get_batch_by_agent_name(self, agent_name: str, batch_size: int = 500) -> ConversationBatch:
+        return self.conversation_repository.get_batch_by_agent_name(agent_name, batch_size)
+
+    def get_page(
+        self,
+        after_id: Optional[str] = None,
+        limit: int = 50,
+        agent_name: Optional[str] = None
+    ) -> List[Conversation]:
+        """
+        Retrieves a page of conversations sorted by ID.
+
+        Args:
+            after_id (Optional[str]): ID of the last conversation of the previous page, None for the first page.
+            limit (int): Maximum number of conversations in the page.
+            agent_name (Optional[str]): Restricts the page to the conversations of this agent if provided.
+
+        Returns:
+            List[Conversation]: The conversations of the page.
+        """
+        return self.conversation_repository.get_page(after_id, limit, agent_name)
+
+    def count(self, agent_name: Optional[str] = None) -> int:
+        """Returns the number of conversations, restricted to one agent when `agent_name` is given."""
+        if agent_name is None:
+            return self.conversation_repository.count()
+        return self.conversation_repository.count_by_agent_name(agent_name)
+
+    def search_by_content(self, text: str, agent_name: Optional[str] = None, limit: int = 50) -> List[Conversation]:
+        """Returns at most `limit` conversations having a message that contains the text."""
+        return self.conversation_repository.search_by_content(text, agent_name, limit)
+
     def delete_by_id(self, conversation_id: str) -> Conversation:
         # First backup the conversation
         conversation = self.conversation_repository.get_by_id(conversation_id)
@@ -70,7 +150,9 @@ class ConversationUseCases:
         if not conversation_to_edit:
             raise NotFoundError(f"No conversation found with the ID {conversation_id}.")
         edited_conversation = Conversation(conversation_to_edit.agent_name, new_messages)
-        self.conversation_repository.update(conversation_to_edit, edited_conversation)
+        self.conversation_repository.update(
+            conversation_to_edit, edited_conversation, self._token_counts(edited_conversation.messages)
+        )
 
     def modify(
         self,
@@ -85,7 +167,45 @@ class ConversationUseCases:
         if not conversation_to_edit:
             raise NotFoundError(f"No conversation found with the ID {conversation_id}.")
         edited_conversation = Conversation(conversation_to_edit.agent_name, new_messages, id, tags)
-        self.conversation_repository.update(conversation_to_edit, edited_conversation)
+        self.conversation_repository.update(
+            conversation_to_edit, edited_conversation, self._token_counts(edited_conversation.messages)
+        )
+
+    def append_messages(self, conversation_id: str, messages: List[Message]) -> None:
+        """
+        Appends messages at the end of a stored conversation. Only the new messages are written,
+        and only they are counted: their counts are added to the stored ones.
+
+        Raises:
+            ValueError: If the conversation does not exist.
+        """
+        if messages:
+            # The overhead of the reply is already in the stored totals
+            token_counts = {
+                encoding: TokenCount(encoding, count.messages, count.total - TOKENS_PER_REPLY, count.assistant)
+                for encoding, count in self._token_counts(messages).items()
+            }
+            self.conversation_repository.append_messages(conversation_id, messages, token_counts)
+
+    def replace_message_at(self, conversation_id: str, index: int, message: Message) -> None:
+        """
+        Replaces the message at position `index` of a stored conversation, then counts it again.
+
+        Raises:
+            ValueError: If the conversation does not exist or has no message at this index.
+        """
+        self.conversation_repository.replace_message_at(conversation_id, index, message)
+        self._recount(conversation_id)
+
+    def truncate_after(self, conversation_id: str, index: int) -> None:
+        """
+        Keeps the messages of a stored conversation up to position `index` included, then counts it again.
+
+        Raises:
+            ValueError: If the conversation does not exist.
+        """
+        self.conversation_repository.truncate_after(conversation_id, index)
+        self._recount(conversation_id)
 
     def recover(self, conversation_id: str) -> None:
         '''
@@ -94,13 +214,46 @@ class ConversationUseCases:
         backed_up_conversation = self.backup_repository.get_by_id(conversation_id)
         if not backed_up_conversation:
             raise NotFoundError(f"No backup found for the conversation with ID {conversation_id}.")
-        self.conversation_repository.create(backed_up_conversation)
+        self.conversation_repository.create(backed_up_conversation, self._token_counts(backed_up_conversation.messages))
         # Once recovered, remove the backed up conversation
         self.backup_repository.delete_by_id(conversation_id)
 
     def search_in_conversations_by_tag(self, conversations: List[Conversation], tag: str) -> List[Conversation]:
         return [conversation for conversation in conversations if tag in conversation.tags]
 
+    def get_by_agent_name_and_tag(self, agent_name: str, tag: str) -> List[Conversation]:
+        return self.conversation_repository.get_by_agent_name_and_tag(agent_name, tag)
+
+    def get_labelled_conversations(self, agent_name: str, user_name: str) -> Dict[str, Conversation]:
+        """
+        Retrieve the labelled conversations of a user for an agent.
+        The filtering is done by the repository, only the matching conversations are fetched.
+
+        Args:
+            agent_name (str): The name of the agent.
+            user_name (str): The name of the user, as found in the tags of the conversations.
+
+        Returns:
+            Dict[str, Conversation]: A dictionary mapping labels to their corresponding conversation.
+        """
+        conversations = self.conversation_repository.get_labelled_by_agent_name_and_user(agent_name, user_name)
+        return self.extract_labels_from_conversations(conversations)
+
+    def get_labelled_headers(self, agent_name: str, user_name: str) -> Dict[str, ConversationHeader]:
+        """
+        Retrieve the headers of the labelled conversations of a user for an agent.
+        Meant for listings: the messages are not fetched, load a conversation with get_by_id once selected.
+
+        Args:
+            agent_name (str): The name of the agent.
+            user_name (str): The name of the user, as found in the tags of the conversations.
+
+        Returns:
+            Dict[str, ConversationHeader]: A dictionary mapping labels to their corresponding conversation header.
+        """
+        headers = self.conversation_repository.get_labelled_headers_by_agent_name_and_user(agent_name, user_name)
+        return {header.label: header for header in headers}
+
     def search_in_conversations_by_agent_name(
         self,
         conversations: List[Conversation],
@@ -121,10 +274,9 @@ class ConversationUseCases:
         label_dict = {}
 
         for convo in conversations:
-            for tag in convo.tags:
-                if tag.startswith("label: "):
-                    label_dict[tag.replace("label: ", "").strip()] = convo
-                    break  # Assuming there's only one label per conversation
+            # Assuming there's only one label per conversation
+            if convo.label is not None:
+                label_dict[convo.label] = convo
 
         return label_dict
 
@@ -150,7 +302,9 @@ class ConversationUseCases:
                 conversation.tags = updated_tags
 
                 # Overwrite the existing conversation
-                self.conversation_repository.update(existing_conversation, conversation)
+                self.conversation_repository.update(
+                    existing_conversation, conversation, self._token_counts(conversation.messages)
+                )
 
         except ValueError:
             # Handle the error raised when the conversation doesn't exist
@@ -173,3 +327,70 @@ class ConversationUseCases:
         if not conversation:
             raise NotFoundError(f"No conversation found with the ID {conversation_id}.")
         return conversation
+
+    def backfill_token_counts(
+        self,
+        agent_name: Optional[str] = None,
+        encoding: str = DEFAULT_ENCODING,
+        batch_size: int = 500
+    ) -> int:
+        """
+        Counts the tokens of the stored conversations having no counts for an encoding: conversations written
+        before counts were stored, or since modified by an incremental write. Conversations are read by batches,
+        and a conversation written again while it was counted is left as it is.
+
+        Args:
+            agent_name (Optional[str]): Restricts the backfill to the conversations of this agent if provided.
+            encoding (str): The name of the tiktoken encoding.
+            batch_size (int): Number of conversations read at once.
+
+        Returns:
+            int: The number of conversations whose counts were stored.
+        """
+        headers = self.conversation_repository.iter_headers_without_token_counts(encoding, agent_name, batch_size)
+        stored = 0
+        batch: List[ConversationHeader] = []
+        for header in headers:
+            batch.append(header)
+            if len(batch) == batch_size:
+                stored += self._store_token_counts(batch, encoding)
+                batch = []
+        if batch:
+            stored += self._store_token_counts(batch, encoding)
+        return stored
+
+    def _store_token_counts(self, headers: List[ConversationHeader], encoding: str) -> int:
+        conversations = {
+            conversation.id: conversation
+            for conversation in self.conversation_repository.get_by_ids([header.id for header in headers])
+        }
+        stored = 0
+        for header in headers:
+            conversation = conversations.get(header.id)
+            if conversation is None:
+                continue
+            # Not guarded by _token_counts: a backfill is run on purpose, a missing encoding is reported
+            counts = conversation_token_counts(conversation.messages, (encoding,))
+            stored += self.conversation_repository.set_token_counts(header.id, counts, header.last_modified)
+        return stored
+
+    def get_token_statistics(
+        self,
+        agent_name: str,
+        encoding: str = DEFAULT_ENCODING,
+        max_tokens: int = 4096
+    ) -> Dict[str, int]:
+        """
+        Aggregates the stored token counts of the conversations of an agent, without reading their messages.
+        Conversations without counts are only included in `conversations`: compare it with `counted`
+        to know whether a backfill is needed.
+
+        Args:
+            agent_name (str): The name of the agent.
+            encoding (str): The name of the tiktoken encoding.
+            max_tokens (int): The number of tokens a fine-tuning example is truncated to.
+
+        Returns:
+            Dict[str, int]: conversations, counted, total_tokens, assistant_tokens, billing_tokens and over_limit.
+        """
+        return self.conversation_repository.get_token_statistics(agent_name, encoding, max_tokens)
@@ -36,6 +36,10 @@ class FeedbackUseCases:
         """Returns a list of all feedback entries."""
         return self.feedback_repository.get_all()
 
+    def count(self) -> int:
+        """Returns the number of feedback entries."""
+        return self.feedback_repository.count()
+
     def get(self, feedback_id: int) -> Feedback:
         """
         Returns a feedback object.
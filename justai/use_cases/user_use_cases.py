@@ -1,5 +1,5 @@
 from typing import List
-from justai.application.exceptions import DuplicateError, NotFoundError
+from justai.application.exceptions import NotFoundError
 from justai.entities.user import User
 from justai.interface_adapters.conversational_repository_interface import IUserRepository
 
@@ -18,9 +18,7 @@ class UserUseCases:
         Raises:
             DuplicateError: If a user with the same name already exists.
         """
-        existing_user = self.user_repository.get_by_name(user_name)
-        if existing_user:
-            raise DuplicateError(f"User with the name {user_name} already exists.")
+        # The repository enforces unique names, a duplicate surfaces as a DuplicateError
         user = User(user_name)
         self.user_repository.create(user)
 
@@ -28,6 +26,10 @@ class UserUseCases:
         """Returns a list of all users."""
         return self.user_repository.get_all()
 
+    def count(self) -> int:
+        """Returns the number of users."""
+        return self.user_repository.count()
+
     def get(self, user_name: str) -> User:
         """Returns a user object."""
         return self.user_repository.get_by_name(user_name)
@@ -59,15 +61,6 @@ class UserUseCases:
             DuplicateError: If a user with the new name already exists.
             NotFoundError: If the user with the current name is not found.
         """
-        # Check if a user with the new name already exists
-        if self.user_repository.get_by_name(new_user_name):
-            raise DuplicateError(f"User with the name {new_user_name} already exists.")
-
-        # Fetch the user to edit using the current name
-        user_to_edit = self.user_repository.get_by_name(current_user_name)
-        if not user_to_edit:
-            raise NotFoundError(f"User with the name {current_user_name} not found.")
-
-        # Update the user's name
-        new_user = User(new_user_name)
-        self.user_repository.update(user_to_edit, new_user)
+        # Single write: the repository raises DuplicateError if the new name is taken,
+        # and NotFoundError if no user has the current name
+        self.user_repository.update(User(current_user_name), User(new_user_name))
@@ -45,13 +45,10 @@ with st.expander("Agent Management Dashboard"):
 ####
 # CONVERSATIONS
 ####
-all_conversations = conversation_use_cases.get_all()
-
 conversation_management_dashboard(
     agent_use_cases,
     conversation_use_cases,
-    [agent.name for agent in agents],
-    all_conversations
+    [agent.name for agent in agents]
 )
 
 st.divider()
@@ -92,7 +92,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 agents = agent_use_cases.get_all()
-conversations = conversation_use_cases.get_all()
 
 # Select an Agent to work with
 agent_names = [agent.name for agent in agents]
@@ -123,7 +122,6 @@ with st.expander("# Conversation Management Dashboard", expanded=False):
         agent_use_cases,
         conversation_use_cases,
         [agent.name for agent in agents],
-        conversations,
         expander=False
     )
 
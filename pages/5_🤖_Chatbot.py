@@ -4,7 +4,7 @@ from types import NoneType
 import openai
 import streamlit as st
 import justai
-from justai.entities.conversation import Conversation, Message
+from justai.entities.conversation import Conversation, ConversationHeader, Message
 from justai.frameworks_and_drivers.dashboards.feedback_dashboard import FeedbackManagementDashboard
 from justai.use_cases.agent_use_cases import AgentUseCases
 from justai.use_cases.conversation_use_cases import ConversationUseCases
@@ -36,6 +36,7 @@ class StreamlitChatbot:
         self.messages = [self.__class__.DEFAULT_MESSAGE_SYSTEM, self.__class__.DEFAULT_MESSAGE_ASSISTANT]
         self.conversation_tree = [self.__class__.DEFAULT_CONVERSATION]
         self.current_branch = 0
+        self.saved_branch = 0
         self.flag_save = False
         self.conv_radio_index = 0
         self.openai_client = openai_client
@@ -77,7 +78,7 @@ class StreamlitChatbot:
         return classic_models + ft_openai_models
 
     def fetch_conversation_labels(self):
-        """Fetch labels for conversations."""
+        """Fetch labels for conversations. Saved conversations are only listed by their header."""
         labels = {}
         agent = self.agent_use_cases.get_one(self.agent_name)
 
@@ -89,9 +90,7 @@ class StreamlitChatbot:
             ],
             tags=[self.user_name]
         )
-        agent_convos = self.conversation_use_cases.get_by_agent_name(self.agent_name)
-        user_convos = self.conversation_use_cases.search_in_conversations_by_tag(agent_convos, self.user_name)
-        labels.update(self.conversation_use_cases.extract_labels_from_conversations(user_convos))
+        labels.update(self.conversation_use_cases.get_labelled_headers(self.agent_name, self.user_name))
         return labels
 
     def handle_save_conversation_form(self):
@@ -123,6 +122,8 @@ class StreamlitChatbot:
                             self.conversation_tree[self.current_branch],
                             "label: " + save_name
                         )
+                        # The stored conversation now holds this branch, whose turns are written from now on
+                        self.saved_branch = self.current_branch
                         st.session_state.n = save_name
                         st.success(f"Conversation {save_name} saved successfully!")
                         time.sleep(1)
@@ -184,24 +185,58 @@ class StreamlitChatbot:
                 key='n',
                 on_change=_set_conv_radio_index
             )
-            self.current_conversation = labels[conversation_radio_id]
-            if self.previous_conversation.id != self.current_conversation.id\
+            selected_conversation = labels[conversation_radio_id]
+            if self.previous_conversation.id != selected_conversation.id\
                     or self.agent_name != self.previous_conversation.agent_name\
                     or not conversation_use_cases.search_in_conversations_by_tag(
                         [self.previous_conversation],
                         self.user_name):
                 # The conversation has changed, so update the conversation_tree and other necessary states
+                # Only now is the full conversation loaded, the radio only holds headers
+                if isinstance(selected_conversation, ConversationHeader):
+                    selected_conversation = self.conversation_use_cases.get_by_id(selected_conversation.id)
                 # ! In the future conversation tree could be a tree structure
                 self.current_branch = 0
-                self.conversation_tree = [self.current_conversation]
-                self.previous_conversation = self.current_conversation
+                self.saved_branch = 0
+                self.conversation_tree = [selected_conversation]
+                self.previous_conversation = selected_conversation
+            self.current_conversation = self.previous_conversation
+
+    def is_live_saved(self):
+        """
+        Whether the displayed branch mirrors a stored conversation, being the branch last written to it
+        by a save, an overwrite or a rerun. Turns of such a branch are written incrementally as they happen.
+        """
+        return self.current_conversation is not None\
+            and self.current_conversation.id is not None\
+            and self.current_branch == self.saved_branch
+
+    def save_last_turn(self, merged_index=None):
+        """
+        Writes the last turn to the stored conversation: new messages are appended,
+        and a user message merged with the previous one is replaced in place.
+        """
+        if not self.is_live_saved():
+            return
+        conversation_id = self.current_conversation.id
+        if merged_index is not None:
+            self.conversation_use_cases.replace_message_at(conversation_id, merged_index, self.messages[merged_index])
+            new_messages = self.messages[merged_index + 1:]
+        else:
+            new_messages = self.messages[-2:]
+        self.conversation_use_cases.append_messages(conversation_id, new_messages)
 
     def rerun_chat_from_index(self, idx):
+        was_live_saved = self.is_live_saved()
         new_messages = self.messages[:idx+1]
         new_conversation = copy.deepcopy(self.current_conversation)
         new_conversation.messages = [Message(msg.role, msg.content) for msg in new_messages]
         self.conversation_tree.append(new_conversation)
         self.current_branch = len(self.conversation_tree) - 1
+        if was_live_saved:
+            # The new branch becomes the stored version of the conversation
+            self.conversation_use_cases.truncate_after(new_conversation.id, idx)
+            self.saved_branch = self.current_branch
 
     def edit_message_in_session(self):
         with st.expander("Edit a message"):
@@ -225,7 +260,14 @@ class StreamlitChatbot:
             self.messages = [msg for msg in self.current_conversation.messages]
             msg_to_edit = self.messages[msg_idx_to_edit].content
             msg_to_edit = st.text_area("edit message", value=msg_to_edit)
-            self.messages[msg_idx_to_edit].content = msg_to_edit
+            if msg_to_edit != self.messages[msg_idx_to_edit].content:
+                self.messages[msg_idx_to_edit].content = msg_to_edit
+                if self.is_live_saved():
+                    self.conversation_use_cases.replace_message_at(
+                        self.current_conversation.id,
+                        msg_idx_to_edit,
+                        self.messages[msg_idx_to_edit]
+                    )
 
     def clear_chat_history(self):
         self.messages = self.__class__.DEFAULT_CONVERSATION.messages
@@ -248,8 +290,10 @@ class StreamlitChatbot:
     #               st.number_input(uuid.uuid1().__str__(), step=1, label_visibility="hidden")
     #           )
         if prompt := st.chat_input("What is up?"):
+            merged_index = None
             if self.messages and self.messages[-1].role == "user":
                 # Merge with the previous user message
+                merged_index = len(self.messages) - 1
                 self.messages[-1].content += "\n\n" + prompt
                 with st.chat_message("user"):
                     st.markdown(self.messages[-1].content)
@@ -259,9 +303,9 @@ class StreamlitChatbot:
                 with st.chat_message("user"):
                     st.markdown(prompt)
 
-            self.generate_assistant_response()
+            self.generate_assistant_response(merged_index)
 
-    def generate_assistant_response(self):
+    def generate_assistant_response(self, merged_index=None):
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
             full_response = ""
@@ -277,6 +321,7 @@ class StreamlitChatbot:
             message_placeholder.markdown(full_response)
         self.messages.append(Message("assistant", full_response))
         self.current_conversation.messages = self.messages
+        self.save_last_turn(merged_index)
         st.rerun()
 
     def run(self):
@@ -1,11 +1,16 @@
 import streamlit as st
 
 import locale
-
-from justai.data_openai_analysis import data_loading_openft, estimate_cost, validate_format
-from justai.data_openai_analysis import count_tokens_and_data_warnings
-from justai.dataset import format_dataframe_for_display, iio_jsonl_formatting, messages_jsonl_formatting
-from justai.dataset import import_gen_dataset, template_message_format_display
+import os
+
+from justai.data_openai_analysis import MAX_TOKENS_PER_EXAMPLE, dataset_report, display_dataset_report
+from justai.data_openai_analysis import estimate_cost_from_totals, token_count_cache
+from justai.dataset import format_dataframe_for_display, import_gen_dataset, template_message_format_display
+from justai.dataset_build import build_dataset, settings_fingerprint
+from justai.dataset_export import DEFAULT_SPLIT_RATIOS, DEFAULT_SPLIT_SEED, messages_example, split_router
+from justai.dataset_export import template_example
+from justai.dataset_shards import agent_dataset_dir, agent_split_paths, write_shards
+from justai.jsonl_index import count_lines
 import justai
 from justai.frameworks_and_drivers.dashboards.feedback_dashboard import FeedbackManagementDashboard
 from justai.use_cases.agent_use_cases import AgentUseCases
@@ -49,7 +54,30 @@ agents_data = [agent.to_dict() for agent in agents]
 st.dataframe(agents_data)
 agent_name = st.selectbox("Select an agent", agent_names)
 
-dataset_agent_dataframe = import_gen_dataset(conversation_use_cases, agent_name)
+with st.expander("Dataset options"):
+    limit_rows = st.checkbox("Only use the first conversations of the agent", value=True)
+    max_rows = st.number_input("Number of conversations", min_value=1, value=500, disabled=not limit_rows)
+    split_seed = st.number_input("Split seed", value=DEFAULT_SPLIT_SEED, step=1)
+    split_names = ("Train", "Validation", "Test")
+    ratio_cols = st.columns(len(split_names))
+    split_ratios = tuple(
+        ratio_col.number_input(f"{split_name} ratio", min_value=0.0, max_value=1.0, value=default_ratio, step=0.01)
+        for ratio_col, split_name, default_ratio in zip(ratio_cols, split_names, DEFAULT_SPLIT_RATIOS)
+    )
+    st.caption("Each conversation is assigned to a split from a hash of its id and the seed: "
+               "it stays in the same split when conversations are added or removed.")
+if not sum(split_ratios):
+    st.error("At least one split ratio must be positive.")
+    st.stop()
+max_rows = int(max_rows) if limit_rows else None
+
+dataset_agent_dataframe = import_gen_dataset(
+    conversation_use_cases,
+    agent_name,
+    max_rows=max_rows,
+    seed=int(split_seed),
+    ratios=split_ratios
+)
 
 
 num_df_rows = st.slider("Select number of rows to display:",
@@ -61,6 +89,55 @@ dataset_agent_dataframe_display['messages'] = dataset_agent_dataframe_display['m
 
 st.write(dataset_agent_dataframe_display.head(num_df_rows))
 
+# The files are built from the database, each conversation going to the same split as above.
+# Only the conversations modified since the last build are read and written again.
+split_of = split_router(int(split_seed), split_ratios)
+agent_system_prompt = next((agent.system_prompt for agent in agents if agent.name == agent_name), "")
+build_settings = {
+    "seed": int(split_seed),
+    "ratios": split_ratios,
+    "system_prompt": settings_fingerprint(agent_system_prompt)
+}
+
+
+# Each agent has its own dataset directory, so that datasets of several agents can be built at the same time
+dataset_paths = agent_split_paths(agent_name or "")
+
+
+with st.expander("Shards"):
+    publish_shards = st.checkbox("Publish each build as shards, in a new directory with a manifest", value=False)
+    shard_cols = st.columns(3)
+    shard_max_examples = shard_cols[0].number_input("Max examples per shard (0: no limit)", min_value=0, value=0)
+    shard_max_mb = shard_cols[1].number_input("Max MB per shard (0: no limit)", min_value=0, value=0)
+    shard_gzip = shard_cols[2].checkbox("Gzip the shards, for archival copies")
+
+
+def build_and_publish(to_example, format_settings):
+    report = build_dataset(
+        conversation_use_cases,
+        agent_name,
+        split_of,
+        to_example,
+        {**build_settings, "format": format_settings},
+        max_rows,
+        dataset_paths
+    )
+    st.success(
+        f"{'Built' if report['full_build'] else 'Updated'} the dataset: {report['added']} added, "
+        f"{report['modified']} modified, {report['removed']} removed, {report['unchanged']} unchanged conversations."
+    )
+    if publish_shards:
+        manifest = write_shards(
+            agent_name,
+            max_bytes=int(shard_max_mb * 1_000_000) or None,
+            max_examples=int(shard_max_examples) or None,
+            compress=shard_gzip,
+            cache=token_count_cache()
+        )
+        st.success(f"Published build `{manifest['build_id']}` in `{agent_dataset_dir(agent_name)}`.")
+        st.json(manifest, expanded=False)
+    return report
+
 
 '''
 ## II- Writing the template message format
@@ -98,61 +175,47 @@ if selected_format == formats[0]:
         # Every form must have a submit button.
         submitted = st.form_submit_button("Format the dataset for fitting into the API")
         if submitted:
-            formatted_file = iio_jsonl_formatting(
-                dataset_agent_dataframe,
-                template_message_format,
-                user_message_columns,
-                assistant_message_columns
+            formatted_file = build_and_publish(
+                template_example(template_message_format, user_message_columns, assistant_message_columns),
+                settings_fingerprint(template_message_format, user_message_columns, assistant_message_columns)
                 )
 
-            ds_tr_df_for_display = format_dataframe_for_display(path='data/openai_ready/output_train.jsonl')
-            ds_va_df_for_display = format_dataframe_for_display(path="data/openai_ready/output_valid.jsonl")
-            ds_ts_df_for_display = format_dataframe_for_display(path="data/openai_ready/output_test.jsonl")
-
-            num_formatted_df_rows = st.slider(
-                "Select number of rows to display:",
+            num_formatted_examples = st.slider(
+                "Select number of examples to display:",
                 1,
-                len(ds_tr_df_for_display)
+                max(count_lines(dataset_paths[0]), 2)
                 )
-            st.write(ds_tr_df_for_display.head(num_formatted_df_rows))
-            st.write(ds_va_df_for_display.head(num_formatted_df_rows))
-            st.write(ds_ts_df_for_display.head(num_formatted_df_rows))
+            # Only the displayed examples are read from the files
+            st.write(format_dataframe_for_display(dataset_paths[0], 0, num_formatted_examples))
+            st.write(format_dataframe_for_display(dataset_paths[1], 0, num_formatted_examples))
+            st.write(format_dataframe_for_display(dataset_paths[2], 0, num_formatted_examples))
 
 if selected_format == formats[1]:
     with st.form("Format the dataset for fitting into the API"):
         '''
-        Assuming you have a Messages format
+        Assuming you have a Messages format: the messages of each conversation are written as they are.
         '''
 
-        # Get column names for user and assistant messages from the user
-        messages_columns = st.multiselect(
-            "Select the Messages column",
-            dataset_agent_dataframe.columns,
-            key="Messages_cols"
-        )
-
         # Every form must have a submit button.
         submitted = st.form_submit_button("Format the dataset for fitting into the API")
         if submitted:
-            formatted_file = messages_jsonl_formatting(
-                dataset_agent_dataframe,
-                messages_columns
-                )
+            formatted_file = build_and_publish(messages_example, "messages")
 
-ds_tr_df_for_display = format_dataframe_for_display(path='data/openai_ready/output_train.jsonl')
-ds_va_df_for_display = format_dataframe_for_display(path="data/openai_ready/output_valid.jsonl")
-ds_ts_df_for_display = format_dataframe_for_display(path="data/openai_ready/output_test.jsonl")
+if not all(os.path.exists(path) for path in dataset_paths.values()):
+    st.info("Format the dataset to create its files.")
+    st.stop()
 
-st.write(len(ds_tr_df_for_display))
-num_formatted_df_rows = st.slider(
-    "Select number of rows to display:",
+num_train_examples = count_lines(dataset_paths[0])
+st.write(num_train_examples)
+num_formatted_examples = st.slider(
+    "Select number of examples to display:",
     1,
-    len(ds_tr_df_for_display),
-    min(5, len(ds_tr_df_for_display))
+    max(num_train_examples, 2),
+    min(5, max(num_train_examples, 1))
     )
-st.dataframe(ds_tr_df_for_display.head(num_formatted_df_rows), use_container_width=True)
-st.dataframe(ds_va_df_for_display.head(num_formatted_df_rows), use_container_width=True)
-st.dataframe(ds_ts_df_for_display.head(num_formatted_df_rows), use_container_width=True)
+st.dataframe(format_dataframe_for_display(dataset_paths[0], 0, num_formatted_examples), use_container_width=True)
+st.dataframe(format_dataframe_for_display(dataset_paths[1], 0, num_formatted_examples), use_container_width=True)
+st.dataframe(format_dataframe_for_display(dataset_paths[2], 0, num_formatted_examples), use_container_width=True)
 
 '''
 ## IV-Data Preparation and Analysis
@@ -179,44 +242,41 @@ st.caption("An epoch is a single pass through the entire dataset. ")
 st.divider()
 
 '''
-### 1. Training Dataset
+### 0. All the Conversations of the Agent
 '''
-
-pre_validation_dataset_tr = data_loading_openft("data/openai_ready/output_train.jsonl")
-format_errors_tr = validate_format(pre_validation_dataset_tr)
-if pre_validation_dataset_tr:
-    pre_val_convo_lens_tr = count_tokens_and_data_warnings(pre_validation_dataset_tr)
-    estimate_cost(pre_validation_dataset_tr, pre_val_convo_lens_tr, n_epochs_manual, cost_per_1k_tokens)
-else:
-    st.metric("Training Dataset", "Empty")
+# Counted when the conversations are written: nothing is exported nor tokenized here
+token_statistics = conversation_use_cases.get_token_statistics(agent_name, max_tokens=MAX_TOKENS_PER_EXAMPLE)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Conversations", token_statistics["conversations"])
+col2.metric("Total tokens", token_statistics["total_tokens"])
+col3.metric("Assistant tokens", token_statistics["assistant_tokens"])
+col4.metric(f"Over {MAX_TOKENS_PER_EXAMPLE} tokens", token_statistics["over_limit"])
+n_uncounted = token_statistics["conversations"] - token_statistics["counted"]
+if n_uncounted:
+    st.warning(f"{n_uncounted} conversations have no token counts yet, they are not included above.")
+    if st.button("Count their tokens"):
+        with st.spinner("Counting tokens..."):
+            conversation_use_cases.backfill_token_counts(agent_name)
+        st.rerun()
+if token_statistics["counted"]:
+    estimate_cost_from_totals(
+        token_statistics["counted"], token_statistics["billing_tokens"], n_epochs_manual, cost_per_1k_tokens
+    )
 st.divider()
-'''
-### 2. Validation Dataset
-'''
 
-pre_validation_dataset_va = data_loading_openft("data/openai_ready/output_valid.jsonl")
-format_errors_val = validate_format(pre_validation_dataset_va)
-if format_errors_val:
-    st.write("Found errors:")
-    for k, v in format_errors_val.items():
-        st.write(f"{k}: {v}")
-else:
-    st.metric("Format Errors", "0")
-if pre_validation_dataset_va:
-    pre_val_convo_lens_va = count_tokens_and_data_warnings(pre_validation_dataset_va)
-    estimate_cost(pre_validation_dataset_va, pre_val_convo_lens_va, n_epochs_manual, cost_per_1k_tokens)
-else:
-    st.metric("Validation Dataset", "Empty")
-st.divider()
-'''
-### 3. Test Dataset
-'''
 
-pre_validation_dataset_ts = data_loading_openft("data/openai_ready/output_test.jsonl")
-format_errors_ts = validate_format(pre_validation_dataset_ts)
-if pre_validation_dataset_ts:
-    pre_val_convo_lens_ts = count_tokens_and_data_warnings(pre_validation_dataset_ts)
-    estimate_cost(pre_validation_dataset_ts, pre_val_convo_lens_ts, n_epochs_manual, cost_per_1k_tokens)
-else:
-    st.metric("Test Dataset", "Empty")
-st.divider()
+def analyse_split(number, name, path):
+    # Each file is read once, its report is kept until the file is built again
+    st.subheader(f"{number}. {name}")
+    report = dataset_report(path)
+    display_dataset_report(report)
+    if report.n_examples:
+        estimate_cost_from_totals(report.n_examples, report.n_billing_tokens, n_epochs_manual, cost_per_1k_tokens)
+    else:
+        st.metric(name, "Empty")
+    st.divider()
+
+
+analyse_split(1, "Training Dataset", dataset_paths[0])
+analyse_split(2, "Validation Dataset", dataset_paths[1])
+analyse_split(3, "Test Dataset", dataset_paths[2])
@@ -1,6 +1,10 @@
 import streamlit as st
-import pandas as pd
-import json
+import os
+
+from justai.dataset import format_dataframe_for_display
+from justai.dataset_export import split_paths
+from justai.dataset_shards import list_dataset_files
+from justai.jsonl_index import count_lines
 
 ########################################################################################################################
 # SIDEBAR
@@ -14,67 +18,40 @@ with st.sidebar:
 ########################################################################################################################
 
 
-def read_ds_into_table(path):
-    # Read the JSONL file and convert it to a DataFrame
-    data = []
-    with open(path, 'r') as file:
-        for line in file:
-            data.append(json.loads(line))
-
-    # Extract messages and format them
-    roles = []
-    contents = []
-    indices = []
-    for idx, entry in enumerate(data, 1):
-        for message in entry["messages"]:
-            roles.append(message["role"].upper())
-            contents.append(message["content"])
-            # Only add the index for the first role in each group (for the SYSTEM role)
-            if message["role"] == "system":
-                indices.append(idx)
-            else:
-                indices.append('')
-
-    df = pd.DataFrame({
-        'Index': indices,
-        'Role': roles,
-        'Content': contents
-    })
-    return df
+def display_split(title, path):
+    # Only the examples selected with the slider are read, through the offset index of the file
+    num_examples = count_lines(path)
+    if num_examples == 0:
+        st.write(f"{title}: no examples.")
+        return
+    first, last = st.slider(
+        "Select the examples to display:",
+        1,
+        max(num_examples, 2),
+        (1, min(6, num_examples)),
+        key=path
+        )
+    with st.expander(title):
+        st.table(format_dataframe_for_display(path, first - 1, last).set_index('Index'))
 
 
 # Display in Streamlit
 st.title("Chat Logs from JSONL File")
 
-train_df = read_ds_into_table('data/openai_ready/output_train.jsonl')
-val_df = read_ds_into_table('data/openai_ready/output_valid.jsonl')
-test_df = read_ds_into_table('data/openai_ready/output_test.jsonl')
-
-num_formatted_df_rows_tr = st.slider(
-    "Select number of rows to display:",
-    1,
-    len(train_df),
-    (1, 6)
-    )
-with st.expander("Training set"):
-    st.table(train_df.set_index('Index').iloc[num_formatted_df_rows_tr[0]-1:num_formatted_df_rows_tr[1]])
-
-num_formatted_df_rows_val = st.slider(
-    "Select number of rows to display:",
-    1,
-    len(val_df),
-    (1, 6)
-    )
-with st.expander("Validation set"):
-    st.table(val_df.set_index('Index').iloc[num_formatted_df_rows_val[0]-1:num_formatted_df_rows_val[1]])
-
-num_formatted_df_rows_ts = st.slider(
-    "Select number of rows to display:",
-    1,
-    len(test_df),
-    (1, 6)
-    )
-with st.expander("Testing set"):
-    st.table(test_df.set_index('Index').iloc[num_formatted_df_rows_ts[0]-1:num_formatted_df_rows_ts[1]])
+# The datasets of the agents are built in their own directories
+dataset_dirs = sorted({
+    os.path.dirname(os.path.join("data/openai_ready", path))
+    for path in list_dataset_files("data/openai_ready")
+    if os.path.basename(path) == "output_train.jsonl"
+})
+dataset_dir = st.selectbox("Select a dataset", dataset_dirs)
+if dataset_dir is None:
+    st.info("No dataset has been built yet.")
+    st.stop()
+dataset_paths = split_paths(dataset_dir)
+
+display_split("Training set", dataset_paths[0])
+display_split("Validation set", dataset_paths[1])
+display_split("Testing set", dataset_paths[2])
 
 # Note: If you have other Streamlit elements to display, you can add them accordingly.
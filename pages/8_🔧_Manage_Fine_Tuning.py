@@ -7,6 +7,7 @@ import locale
 
 from streamlit_sortables import sort_items
 import justai
+from justai.dataset_shards import list_dataset_files
 
 locale.getpreferredencoding = lambda: "UTF-8"
 
@@ -51,7 +52,8 @@ with st.expander("Key Features"):
 
 col1, col2, col3 = st.columns(3)
 col1.write('**The list of available datasets locally:**')
-list_of_available_datasets = [file for file in os.listdir("data/openai_ready")]
+# Agents build their datasets in their own directories, and published builds in subdirectories of those
+list_of_available_datasets = list_dataset_files("data/openai_ready")
 col1.write(f'Num of datasets:`{len(list_of_available_datasets)}` ')
 col1.json(list_of_available_datasets, expanded=False)
 
@@ -88,9 +90,9 @@ with col1.form("create_file_openai"):
         st.write('File submitted: ', dataset_to_submit_to_openai)
         st.write('Response of openai.File.Create: ')
         st.json(openai_client.files.create(
-            file=open("data/openai_ready/"+dataset_to_submit_to_openai, "rb"),
+            file=open(os.path.join("data/openai_ready", dataset_to_submit_to_openai), "rb"),
             purpose='fine-tune',
-            user_provided_filename=dataset_to_submit_to_openai
+            user_provided_filename=dataset_to_submit_to_openai.replace(os.sep, "_")
             ),
             expanded=False
         )
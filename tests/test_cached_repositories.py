@@ -0,0 +1,48 @@
+import unittest
+
+from justai.entities.agent import Agent
+from justai.frameworks_and_drivers.cached_repositories import CachedAgentRepository
+
+
+class RacingAgentRepository:
+    """Agent repository on which another writer creates an agent while a read is in flight."""
+    def __init__(self):
+        self.agents = {}
+        self.on_read = None
+
+    def get_by_name(self, agent_name):
+        agent = self.agents.get(agent_name)
+        if self.on_read:
+            on_read, self.on_read = self.on_read, None
+            on_read()
+        return agent
+
+    def exists(self, agent_name):
+        return agent_name in self.agents
+
+
+class CachedAgentRepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.repository = RacingAgentRepository()
+        self.cached = CachedAgentRepository(self.repository)
+
+    def test_missing_agents_are_not_cached(self):
+        self.assertIsNone(self.cached.get_by_name("agent"))
+        self.repository.agents["agent"] = Agent("agent", "prompt")
+        self.assertTrue(self.cached.exists("agent"))
+        self.assertEqual(self.cached.get_by_name("agent").system_prompt, "prompt")
+
+    def test_value_read_before_a_write_is_not_stored(self):
+        self.repository.agents["agent"] = Agent("agent", "old prompt")
+
+        def write():
+            self.repository.agents["agent"] = Agent("agent", "new prompt")
+            self.cached.cache.invalidate(("name", "agent"))
+
+        self.repository.on_read = write
+        self.assertEqual(self.cached.get_by_name("agent").system_prompt, "old prompt")
+        self.assertEqual(self.cached.get_by_name("agent").system_prompt, "new prompt")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import copy
+import pickle
+import threading
+import unittest
+
+from justai.entities.conversation import Conversation, LazyMessageList, Message
+
+
+class LockedDecoder:
+    """Decoder holding an unpicklable resource, like a repository holding its MongoClient."""
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def __call__(self, entry):
+        return Message(entry["role"], entry["content"])
+
+
+class LazyMessageListTest(unittest.TestCase):
+    def setUp(self):
+        entries = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+        self.conversation = Conversation("agent", LazyMessageList(entries, LockedDecoder()), "id", ["tag"])
+
+    def test_deepcopy_materializes_the_messages(self):
+        copied = copy.deepcopy(self.conversation)
+        self.assertIsInstance(copied.messages, list)
+        self.assertEqual([message.to_dict() for message in copied.messages],
+                         [message.to_dict() for message in self.conversation.messages])
+        copied.messages[0].content = "edited"
+        self.assertEqual(self.conversation.messages[0].content, "hello")
+
+    def test_pickle_materializes_the_messages(self):
+        messages = pickle.loads(pickle.dumps(self.conversation.messages))
+        self.assertIsInstance(messages, list)
+        self.assertEqual([message.content for message in messages], ["hello", "hi"])
+
+
+if __name__ == "__main__":
+    unittest.main()